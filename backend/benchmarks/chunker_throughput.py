@@ -0,0 +1,104 @@
+# TextChunker (utils/text_chunker.py) と LangChain の RecursiveCharacterTextSplitter の速度・メモリ比較ベンチマーク
+# 長時間の文字起こしと XLSX のテキスト化に似た合成テキストを分割し、チャンクの境界が一致することも確認します。
+# DB や Gemini には接続しません。
+#
+#   python -m benchmarks.chunker_throughput [--chars 2000000] [--repeat 3]
+#
+# 比較する方法:
+#   langchain  呼び出しごとに RecursiveCharacterTextSplitter を構築し、リストで受け取る (以前の VectorService.chunk_text)
+#   chunker    構築済みの TextChunker からジェネレータで受け取る (現在の VectorService.iter_chunks)
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.text_chunker import DEFAULT_SEPARATORS, TextChunker
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+_PHRASES = [
+    "えーと、今日は線形代数の固有値について説明します", "つまり行列を対角化できるということです",
+    "ここまでで質問はありますか", "次回の小テストはこの範囲から出します", "では例題を見てみましょう",
+    "この式を変形すると", "フーリエ変換との関係も後で触れます", "はい、それでは始めます",
+]
+
+
+def make_transcript(chars: int, rng: random.Random) -> str:
+    # 文字起こし: 読点・句点で続く長い発話。段落区切りはまれで、改行のない長い区間もあります
+    parts, size = [], 0
+    while size < chars:
+        sentence = "、".join(rng.choice(_PHRASES) for _ in range(rng.randint(1, 4))) + "。"
+        if rng.random() < 0.02:
+            sentence += "\n\n" if rng.random() < 0.3 else "\n"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:chars]
+
+
+def make_sheet(chars: int, rng: random.Random) -> str:
+    # XLSX のテキスト化: 空白区切りの短い行がひたすら続きます
+    rows, size = [], 0
+    while size < chars:
+        row = " ".join(f"{rng.choice(['A', 'B', '課題', '点数'])}{rng.randint(0, 9999)}" for _ in range(rng.randint(3, 12)))
+        rows.append(row)
+        size += len(row) + 1
+    return "\n".join(rows)[:chars]
+
+
+def langchain_split(text: str) -> list:
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=DEFAULT_SEPARATORS
+    )
+    return splitter.split_text(text)
+
+
+def measure(label: str, split, text: str, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = split(text)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    split(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    elapsed = statistics.median(timings)
+    print(
+        f"  {label:<10} {len(text) / elapsed / 1e6:6.2f}M chars/s  {count / elapsed:9.0f} chunks/s  "
+        f"peak {peak / 1e6:7.1f}MB  (median {elapsed * 1000:.0f}ms of {repeat})"
+    )
+    return elapsed
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    chunker = TextChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    for name, text in (("transcript", make_transcript(args.chars, rng)), ("sheet", make_sheet(args.chars, rng))):
+        expected = langchain_split(text)
+        actual = chunker.split(text)
+        if actual != expected:
+            raise SystemExit(f"{name}: chunk boundaries differ from LangChain ({len(actual)} vs {len(expected)} chunks)")
+        print(f"{name}: {len(text)} chars -> {len(expected)} chunks, boundaries identical")
+
+        def consume_chunker(text):
+            # 1チャンクずつ受け取って捨てます (保存処理がチャンクを逐次処理する場合と同じ)
+            count = 0
+            for _ in chunker.iter_chunks(text):
+                count += 1
+            return count
+
+        before = measure("langchain", lambda text: len(langchain_split(text)), text, args.repeat)
+        after = measure("chunker", consume_chunker, text, args.repeat)
+        print(f"  speedup x{before / after:.1f}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TextChunker vs RecursiveCharacterTextSplitter throughput")
+    parser.add_argument("--chars", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
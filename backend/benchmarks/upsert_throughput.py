@@ -0,0 +1,105 @@
+# DocumentChunk への書き込み速度 (rows/s) の比較ベンチマーク
+# DATABASE_URL の Postgres に、"DocumentChunk" と同じ定義 (インデックス込み) の一時テーブルを作って計測します。
+# 一時テーブルは同じ接続内で本物のテーブルより優先されるので、本番のテーブルには触れません。
+#
+#   python -m benchmarks.upsert_throughput [--rows 2000] [--repeat 3]
+#
+# 比較する方法:
+#   per-row  1行ずつ INSERT し、ベクトルは '[...]' の文字列で渡す (以前の upsert_vectors)
+#   bulk     UPSERT_BATCH_SIZE 行ずつ unnest で一括 INSERT、ベクトルはバイナリ (現在の upsert_vectors)
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import numpy as np
+
+from database.db import close_pg_pool, get_pg_pool
+from services.vector_service import UPSERT_BATCH_SIZE, VectorService
+
+DIM = 768  # text-embedding-004
+
+PER_ROW_INSERT_SQL = """
+    INSERT INTO "DocumentChunk"
+    ("id", "userId", "fileId", "fileName", "content", "chunkIndex", "tags", "type", "documentId", "embedding", "createdAt")
+    VALUES (gen_random_uuid(), $1, $2, $3, $4, $5, $6, $7, $8, $9::vector, NOW())
+"""
+
+
+def make_vectors(rows: int, rng: np.random.Generator):
+    document_id = str(uuid.uuid4())
+    embeddings = rng.standard_normal((rows, DIM)).astype(np.float32)
+    return [
+        {
+            "values": embeddings[i].tolist(),
+            "metadata": {
+                "userId": "bench-user",
+                "fileId": document_id,
+                "fileName": "bench.pdf",
+                # 文字起こしのチャンクと同じくらいの長さ
+                "text": f"ベンチマーク用のチャンク {i} " + "あ" * 800,
+                "chunkIndex": i,
+                "tags": ["bench", f"tag{i % 5}"],
+                "type": "transcript",
+                "dbId": document_id,
+            },
+        }
+        for i in range(rows)
+    ]
+
+
+async def insert_per_row(conn, vectors) -> int:
+    for vec in vectors:
+        meta = vec["metadata"]
+        await conn.execute(
+            PER_ROW_INSERT_SQL,
+            meta["userId"], meta["fileId"], meta["fileName"], meta["text"], meta["chunkIndex"],
+            meta["tags"], meta["type"], meta["dbId"],
+            f"[{','.join(map(str, vec['values']))}]"
+        )
+    return len(vectors)
+
+
+async def insert_bulk(conn, vectors) -> int:
+    async with conn.transaction():
+        return await VectorService._insert_vectors(conn, vectors)
+
+
+async def measure(conn, label, insert, vectors, repeat):
+    rates = []
+    for _ in range(repeat):
+        await conn.execute('TRUNCATE "DocumentChunk"')
+        start = time.perf_counter()
+        count = await insert(conn, vectors)
+        rates.append(count / (time.perf_counter() - start))
+    print(f"{label:<10} {statistics.median(rates):8.0f} rows/s  (median of {repeat}, {len(vectors)} rows)")
+    return statistics.median(rates)
+
+
+async def main(args):
+    vectors = make_vectors(args.rows, np.random.default_rng(args.seed))
+    pool = await get_pg_pool()
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute(
+                'CREATE TEMP TABLE "DocumentChunk" (LIKE public."DocumentChunk" INCLUDING DEFAULTS INCLUDING INDEXES)'
+            )
+            print(f"UPSERT_BATCH_SIZE={UPSERT_BATCH_SIZE}, dim={DIM}\n")
+            before = await measure(conn, "per-row", insert_per_row, vectors, args.repeat)
+            after = await measure(conn, "bulk", insert_bulk, vectors, args.repeat)
+            print(f"\nspeedup x{after / before:.1f}")
+            await conn.execute('DROP TABLE pg_temp."DocumentChunk"')
+    finally:
+        await close_pg_pool()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="DocumentChunk insert throughput: per-row vs bulk unnest")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,179 @@
+# userId で絞り込んだ HNSW 検索の再現率 (recall@k) と所要時間を、検索設定ごとに比較するベンチマーク
+# pgvector の入った Postgres (DATABASE_URL) に一時テーブルを作って計測します。本番のテーブルには触れません。
+#
+#   python -m benchmarks.vector_recall [--users 1000] [--rows-per-user 1000] [--queries 200]
+#
+# 既定は 1,000 ユーザー x 1,000 行 = 100 万行 (1ユーザーの絞り込みで全体の 0.1%)。
+# 絞り込みつき HNSW の再現率は行数と絞り込みの選択率で大きく変わるので、小さいコーパスの結果から
+# 100 万行での挙動は判断できません。--users / --rows-per-user を小さくするのは動作確認用です。
+# 100 万行 x 768 次元ではベクトルだけで約 3GB、HNSW の構築に maintenance_work_mem (--maintenance-work-mem)
+# と数十分〜数時間 (CPU 数による) が必要です。コーパスはバッチごとに生成するので、Python 側のメモリは一定です。
+#
+# 比較する設定:
+#   iterative_scan=off, ef_search=VECTOR_EF_SEARCH          (以前の既定)
+#   iterative_scan=off, ef_search=VECTOR_FILTERED_EF_SEARCH (pgvector 0.8 未満でのフォールバック)
+#   iterative_scan=relaxed_order, ef_search=VECTOR_EF_SEARCH (現在の既定。pgvector 0.8 以上のみ)
+# 正解は インデックスを使わない全件走査 (厳密な近傍) です。
+# 本番と同じく "userId" の B-tree インデックスも作るので、プランナーがそちらを選ぶ場合は plan 列に表示されます
+# (1ユーザーの行数が少ないと B-tree + 並べ替え = 厳密な検索になります)。HNSW の絞り込み検索だけを測るには
+# --no-user-index を指定します。
+import argparse
+import asyncio
+import re
+import statistics
+import time
+
+import numpy as np
+
+import services.vector_service as vector_service
+from database.db import close_pg_pool, get_pg_pool
+from database.vector_codec import Vector
+
+DIM = 768  # text-embedding-004
+BATCH_ROWS = 5000
+NOISE = 0.35
+
+SEARCH_SQL = """
+    SELECT id, 1 - (embedding <=> $1::vector) AS score
+    FROM bench_chunk
+    WHERE "userId" = $2
+    ORDER BY embedding <=> $1::vector
+    LIMIT $3
+"""
+
+
+def iter_batches(users: int, rows_per_user: int, centers: np.ndarray, rng: np.random.Generator):
+    # 全ユーザーで共通のトピック (クラスタ) を使います。ユーザーごとに絞り込むと、近傍の大半が他人の行になる状況です
+    # ユーザーの行が連続しないよう、行番号 i のユーザーは i % users にします (本番でも取り込み順はばらばら)
+    total = users * rows_per_user
+    for offset in range(0, total, BATCH_ROWS):
+        count = min(BATCH_ROWS, total - offset)
+        picked = centers[rng.integers(0, len(centers), count)]
+        rows = picked + NOISE * rng.standard_normal((count, DIM)).astype(np.float32)
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+        ids = list(range(offset, offset + count))
+        yield ids, [f"user{i % users}" for i in ids], rows
+
+
+async def load(conn, args, centers, rng):
+    await conn.execute(f"""
+        CREATE TEMP TABLE bench_chunk (id int PRIMARY KEY, "userId" text NOT NULL, embedding vector({DIM}) NOT NULL)
+    """)
+    start = time.perf_counter()
+    for ids, user_ids, rows in iter_batches(args.users, args.rows_per_user, centers, rng):
+        await conn.execute(
+            """
+            INSERT INTO bench_chunk (id, "userId", embedding)
+            SELECT * FROM unnest($1::int[], $2::text[], $3::vector[])
+            """,
+            ids, user_ids, [Vector(v) for v in rows]
+        )
+    print(f"  inserted in {time.perf_counter() - start:.0f}s")
+
+    start = time.perf_counter()
+    await conn.execute(f"SET maintenance_work_mem = '{args.maintenance_work_mem}'")
+    # 本番と同じパラメータの HNSW インデックスと userId の B-tree インデックス
+    await conn.execute("CREATE INDEX ON bench_chunk USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)")
+    if args.user_index:
+        await conn.execute('CREATE INDEX ON bench_chunk ("userId")')
+    await conn.execute("ANALYZE bench_chunk")
+    print(f"  indexed in {time.perf_counter() - start:.0f}s")
+
+
+async def run_queries(conn, queries, top_k, ef_search, iterative_scan, filtered=True, exact=False):
+    vector_service.VECTOR_ITERATIVE_SCAN = iterative_scan
+    vector_service._iterative_scan_supported = None
+    results, latencies, plan = [], [], None
+    for user_id, query in queries:
+        start = time.perf_counter()
+        async with conn.transaction():
+            if exact:
+                await conn.execute("SET LOCAL enable_indexscan = off")
+            else:
+                await vector_service.VectorService._apply_search_settings(conn, ef_search, None, filtered=filtered)
+            rows = await conn.fetch(SEARCH_SQL, Vector(query), user_id, top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if plan is None:
+                plan = await query_plan(conn, query, user_id, top_k)
+        results.append([row["id"] for row in rows])
+    return results, latencies, plan
+
+
+async def query_plan(conn, query, user_id, top_k) -> str:
+    # 使われたインデックス (hnsw / userId の B-tree / 全件走査) を表示用に取り出します
+    lines = await conn.fetch("EXPLAIN " + SEARCH_SQL, Vector(query), user_id, top_k)
+    plan = " ".join(row[0] for row in lines)
+    if "embedding_idx" in plan:
+        return "hnsw"
+    if "userId_idx" in plan:
+        return "btree"
+    return "seq" if "Seq Scan" in plan else re.sub(r"\s+", " ", lines[0][0])[:20]
+
+
+def summarize(label, results, latencies, plan, truth, top_k):
+    recall = statistics.mean(len(set(r) & set(t)) / len(t) for r, t in zip(results, truth) if t)
+    returned = statistics.mean(len(r) for r in results)
+    latencies = sorted(latencies)
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    print(
+        f"{label:<42} recall@{top_k} {recall:6.3f}  rows {returned:5.1f}  "
+        f"p50 {statistics.median(latencies):7.2f}ms  p95 {p95:7.2f}ms  plan {plan}"
+    )
+
+
+async def main(args):
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((args.topics, DIM)).astype(np.float32)
+    queries = []
+    for _ in range(args.queries):
+        user = f"user{rng.integers(0, args.users)}"
+        query = centers[rng.integers(0, args.topics)] + NOISE * rng.standard_normal(DIM).astype(np.float32)
+        queries.append((user, query / np.linalg.norm(query)))
+
+    pool = await get_pg_pool()
+    try:
+        async with pool.acquire() as conn:
+            total = args.users * args.rows_per_user
+            print(f"Loading {total} rows ({args.users} users x {args.rows_per_user}) ...")
+            await load(conn, args, centers, rng)
+            version = await conn.fetchval("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            print(f"pgvector {version}, top_k={args.top_k}, {args.queries} queries\n")
+
+            truth, latencies, plan = await run_queries(conn, queries, args.top_k, None, "off", exact=True)
+            summarize("exact (no index scan)", truth, latencies, plan, truth, args.top_k)
+            ef_search = vector_service.VECTOR_EF_SEARCH
+            configs = [
+                # filtered=False: 以前のコードと同じく、絞り込みがあっても ef_search を上げない
+                (f"off, ef_search={ef_search}", "off", False),
+                (f"off, ef_search={vector_service.VECTOR_FILTERED_EF_SEARCH} (fallback)", "off", True),
+                (f"relaxed_order, ef_search={ef_search}", "relaxed_order", True),
+            ]
+            for label, iterative_scan, filtered in configs:
+                if iterative_scan != "off":
+                    vector_service.VECTOR_ITERATIVE_SCAN = iterative_scan
+                    vector_service._iterative_scan_supported = None
+                    if not await vector_service.VectorService._iterative_scan_available(conn):
+                        print(f"{label:<42} skipped: needs pgvector 0.8+")
+                        continue
+                results, latencies, plan = await run_queries(
+                    conn, queries, args.top_k, ef_search, iterative_scan, filtered=filtered
+                )
+                summarize(label, results, latencies, plan, truth, args.top_k)
+    finally:
+        await close_pg_pool()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Filtered HNSW recall/latency by search settings")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rows-per-user", type=int, default=1000)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--maintenance-work-mem", default="4GB")
+    parser.add_argument("--user-index", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
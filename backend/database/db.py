@@ -1,10 +1,79 @@
+import asyncio
+import os
+import logging
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import asyncpg
 from prisma import Prisma
 
+from database.vector_codec import register_vector_codec
+
+logger = logging.getLogger(__name__)
+
 db = Prisma()
 
+# Prisma Client とは別に、一括書き込みなど Prisma では表現しにくい処理用に asyncpg のプールを持ちます
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "5"))
+
+_pg_pool: Optional[asyncpg.Pool] = None
+# 最初の get_pg_pool が同時に呼ばれてもプールを1つだけ作るためのロック
+_pg_pool_lock = asyncio.Lock()
+
+# Prisma 専用の接続パラメータ。asyncpg は知らないパラメータをサーバー設定として送ってしまうので除去します
+# (sslcert は Prisma ではサーバーの CA 証明書、libpq / asyncpg ではクライアント証明書と意味が違うため除去)
+# sslmode など libpq と共通のパラメータはそのまま渡します
+_PRISMA_ONLY_PARAMS = {
+    "schema", "pgbouncer", "connection_limit", "pool_timeout", "connect_timeout",
+    "socket_timeout", "statement_cache_size", "sslcert", "sslidentity", "sslpassword", "sslaccept",
+}
+
+
+def _asyncpg_dsn(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key not in _PRISMA_ONLY_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+async def get_pg_pool() -> asyncpg.Pool:
+    """
+    Return the shared asyncpg pool, creating it on first use.
+    statement_cache_size=0 keeps it compatible with pgbouncer (Supabase :6543).
+    Every connection gets the binary pgvector codec, so `vector` parameters
+    accept lists, NumPy arrays or array('f') buffers directly.
+    """
+    global _pg_pool
+    if _pg_pool is not None:
+        return _pg_pool
+    async with _pg_pool_lock:
+        # ロックを待っている間に他の呼び出しが作成済みなら、それを使います
+        if _pg_pool is None:
+            database_url = os.environ.get("DATABASE_URL")
+            if not database_url:
+                raise RuntimeError("DATABASE_URL is not set")
+            _pg_pool = await asyncpg.create_pool(
+                _asyncpg_dsn(database_url),
+                min_size=PG_POOL_MIN_SIZE,
+                max_size=PG_POOL_MAX_SIZE,
+                statement_cache_size=0,
+                init=register_vector_codec,
+            )
+            logger.info("asyncpg pool created.")
+    return _pg_pool
+
+
+async def close_pg_pool():
+    global _pg_pool
+    if _pg_pool is not None:
+        await _pg_pool.close()
+        _pg_pool = None
+
+
 async def connect_db():
     await db.connect()
 
 async def disconnect_db():
+    await close_pg_pool()
     if db.is_connected():
         await db.disconnect()
@@ -0,0 +1,79 @@
+# pgvector の vector 型をバイナリ形式でやり取りするための asyncpg コーデック
+#
+# pgvector binary format:
+#   int16 dim | int16 unused (0) | float32 * dim   (all big-endian)
+#
+# 文字列 '[0.1,0.2,...]' を組み立てる代わりに、float32 のバッファをそのまま送ります。
+import struct
+from array import array
+from typing import List, Sequence, Union
+
+import asyncpg
+import numpy as np
+
+VectorLike = Union[Sequence[float], np.ndarray, array]
+
+_HEADER = struct.Struct(">HH")
+
+
+class Vector:
+    """
+    Non-iterable holder for one embedding.
+    asyncpg treats nested lists/arrays inside an array parameter as extra
+    dimensions, so values for a `vector[]` parameter must be wrapped.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value: VectorLike):
+        self.value = value
+
+
+def encode_vector(value: VectorLike) -> bytes:
+    """
+    Encode an embedding into pgvector's binary wire format.
+    Accepts a float32/float64 NumPy array, an array('f') / array('d') buffer,
+    or a plain list of floats (the existing API).
+    """
+    if isinstance(value, Vector):
+        value = value.value
+
+    if isinstance(value, np.ndarray):
+        data = np.ascontiguousarray(value, dtype=">f4")
+        if data.ndim != 1:
+            raise ValueError(f"vector must be 1-dimensional, got shape {data.shape}")
+        return _HEADER.pack(data.shape[0], 0) + data.tobytes()
+
+    if isinstance(value, array):
+        # memoryview 経由でコピーし、ビッグエンディアンに変換します
+        data = np.frombuffer(value, dtype="f4" if value.typecode == "f" else "f8").astype(">f4")
+        return _HEADER.pack(data.shape[0], 0) + data.tobytes()
+
+    dim = len(value)
+    return struct.pack(f">HH{dim}f", dim, 0, *value)
+
+
+def decode_vector(data: bytes) -> List[float]:
+    dim, _ = _HEADER.unpack_from(data)
+    return list(struct.unpack_from(f">{dim}f", data, _HEADER.size))
+
+
+async def register_vector_codec(conn: asyncpg.Connection) -> None:
+    """
+    Register the binary vector codec on a connection (used as the pool's `init`).
+    The extension may live in "public" or in Supabase's "extensions" schema,
+    so the schema is looked up instead of assumed.
+    """
+    schema = await conn.fetchval(
+        "SELECT typnamespace::regnamespace::text FROM pg_type WHERE typname = 'vector'"
+    )
+    if schema is None:
+        raise RuntimeError("pgvector extension is not installed (type 'vector' not found)")
+
+    await conn.set_type_codec(
+        "vector",
+        schema=schema,
+        encoder=encode_vector,
+        decoder=decode_vector,
+        format="binary",
+    )
+
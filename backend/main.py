@@ -67,6 +67,10 @@ app.add_middleware(RequestLoggingMiddleware)
 
 
 from database.db import connect_db, disconnect_db
+from services.job_queue import job_worker
+
+# ジョブワーカーをAPIと同じプロセスで動かすかどうか (別プロセスで動かす場合は false にして worker.py を起動)
+JOB_WORKER_IN_PROCESS = os.environ.get("JOB_WORKER_IN_PROCESS", "true").lower() == "true"
 
 @app.on_event("startup")
 async def startup_event():
@@ -78,9 +82,14 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Error connecting to Prisma: {e}")
 
+    if JOB_WORKER_IN_PROCESS:
+        job_worker.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down...")
+    if JOB_WORKER_IN_PROCESS:
+        await job_worker.stop()
     await disconnect_db()
 
 
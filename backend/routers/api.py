@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from . import voice, auth, user, chat, knowledge, course, feedback
+from . import voice, auth, user, chat, knowledge, course, feedback, jobs
 
 # -------------------------------------------------------------------------
 # Router Aggregator
@@ -42,3 +42,6 @@ router.include_router(knowledge.router, prefix="/api/knowledge", tags=["Knowledg
 
 # --- Feedback ---
 router.include_router(feedback.router, prefix="/api/feedback", tags=["Feedback"])
+
+# --- Background Jobs (voice processing / file import) ---
+router.include_router(jobs.router, prefix="/api/jobs", tags=["Jobs"])
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from dependencies import get_current_user
 from typing import List, Optional
 import logging
@@ -67,3 +68,38 @@ async def ask(
     except Exception as e:
         logger.error(f"Error in ask endpoint: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.post("/ask/stream")
+async def ask_stream(
+    request: AskRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    RAG Chat Endpoint (Server-Sent Events)
+    回答をGeminiのストリーミングで逐次返します。イベント形式は ChatService.ask_stream を参照。
+    """
+    try:
+        # Use authenticated user ID instead of request.userId for security
+        user_id = current_user["uid"]
+        
+        # Rate Limit Check
+        await rate_limiter.check_limit(user_id)
+        
+        stream = await chat_service.ask_stream(
+            query=request.query,
+            user_id=user_id,
+            thread_id=request.thread_id,
+            tags=request.tags
+        )
+        return StreamingResponse(
+            stream,
+            media_type="text/event-stream",
+            # プロキシでのバッファリングを無効化し、チャンクをすぐにクライアントへ流します
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error in ask stream endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
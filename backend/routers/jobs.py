@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Depends
+import logging
+import re
+
+from dependencies import get_current_user
+from services.job_queue import JobQueue
+from services.user_service import UserService
+from schemas.job import JobStatusResponse
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    # 非同期版 (202 Accepted) エンドポイントで受け付けたジョブの状態を返します
+    try:
+        user_id = await UserService.resolve_user_id(current_user["uid"])
+        job = await JobQueue.get_job(job_id, user_id)
+    except Exception as e:
+        logger.error(f"Error fetching job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # セキュリティのため、4xx (入力不正・上限超過など) 以外のエラー内容はクライアントに返却しない
+    error = job["error"]
+    if error and not re.match(r"^4\d\d: ", error):
+        error = "Processing failed due to an internal error."
+    return JobStatusResponse(**{**job, "error": error})
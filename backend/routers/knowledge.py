@@ -1,11 +1,15 @@
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from typing import List, Optional
 import json
 import logging
+import uuid
 from services.knowledge_service import KnowledgeService
+from services.user_service import UserService
+from services.job_queue import JobQueue
 from schemas.knowledge import TextImportRequest, DeleteRequest, UpdateKnowledgeRequest
+from schemas.job import JobAcceptedResponse
 
 logger = logging.getLogger(__name__)
 
@@ -15,82 +19,115 @@ from dependencies import get_current_user
 from fastapi import Depends
 
 from utils.rate_limiter import InMemoryRateLimiter
+from utils.upload_stream import receive_multipart_upload
 
 # Initialize Rate Limiter (5 requests per 1 minute)
 rate_limiter = InMemoryRateLimiter(max_requests=5, window_seconds=60)
 
-@router.post("/import-file")
+# multipart 本体はハンドラー内でストリーミング受信するため、OpenAPI には手動で記載します
+IMPORT_FILE_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file", "metadata"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "metadata": {"type": "string"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+async def _receive_import_file(request: Request, current_user: dict):
+    # ファイルは受信しながら一時ファイルに書き出し、プランのサイズ上限を超えた時点で中断します
+    user_id = await UserService.resolve_user_id(current_user["uid"])
+    plan = await UserService.get_user_plan(user_id)
+    upload, fields = await receive_multipart_upload(
+        request, UserService.get_upload_size_limit(plan, "file"), required_fields=("metadata",)
+    )
+    logger.info(f"Spooled import file: {upload.filename} ({upload.size} bytes)")
+
+    try:
+        meta_dict = json.loads(fields["metadata"])
+    except Exception as e:
+        upload.cleanup()
+        logger.error(f"Invalid import metadata: {e}")
+        raise HTTPException(status_code=400, detail="Invalid metadata")
+
+    # Override user_id from token
+    meta_dict["userId"] = current_user["uid"]
+    meta_dict["fileName"] = upload.filename
+
+    # Security: Detect MIME type from content, ignoring client input
+    # (先頭バイトから受信中に判定済み)
+    detected_mime = upload.sniffed_mime
+    if detected_mime:
+        logger.info(f"Detected MIME type: {detected_mime}")
+        mime_type = detected_mime
+    else:
+         mime_type = meta_dict.get("mimeType") # Fallback to client input if detection fails
+
+    # Update metadata for storage
+    meta_dict["mimeType"] = mime_type
+    return user_id, upload, meta_dict, mime_type
+
+@router.post("/import-file", openapi_extra=IMPORT_FILE_OPENAPI)
 async def import_file(
-    file: UploadFile = File(...),
-    metadata: str = Form(...),
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
-    # ファイルインポートの統合エンドポイント
-    logger.info(f"Received unified import request for file: {file.filename}")
+    # ファイルインポートの統合エンドポイント (multipart: file, metadata)
+    logger.info(f"Received unified import request (User: {current_user['uid']})")
     
     # Rate Limit Check
     await rate_limiter.check_limit(current_user["uid"])
+
+    _, upload, meta_dict, mime_type = await _receive_import_file(request, current_user)
     
     try:
-        meta_dict = json.loads(metadata)
-        # Override user_id from token
-        meta_dict["userId"] = current_user["uid"]
-        meta_dict["fileName"] = file.filename
-        
-        # Override user_id from token
-        meta_dict["userId"] = current_user["uid"]
-        meta_dict["fileName"] = file.filename
-        
-        content = await file.read()
-        
-        # Security: Detect MIME type from content, ignoring client input
-        detected_mime = KnowledgeService.detect_mime_type(content)
-        if detected_mime:
-            logger.info(f"Detected MIME type: {detected_mime}")
-            mime_type = detected_mime
-        else:
-             mime_type = meta_dict.get("mimeType") # Fallback to client input if detection fails
-        
-        # Update metadata for storage
-        meta_dict["mimeType"] = mime_type
-
-        text = ""
-
-        if mime_type == "application/pdf":
-            text = await KnowledgeService.process_pdf(content)
-        elif mime_type and mime_type.startswith("image/"):
-            text = await KnowledgeService.process_image(content, mime_type, file.filename)
-        elif mime_type == "application/vnd.google-apps.presentation":
-            text = await KnowledgeService.process_pptx(content)
-        elif mime_type == "application/vnd.openxmlformats-officedocument.presentationml.presentation":
-            text = await KnowledgeService.process_pptx(content)
-        elif mime_type == "application/vnd.google-apps.document":
-            text = await KnowledgeService.process_docx(content)
-        elif mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            text = await KnowledgeService.process_docx(content)
-        elif mime_type == "application/vnd.google-apps.spreadsheet":
-            text = await KnowledgeService.process_xlsx(content)
-        elif mime_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            text = await KnowledgeService.process_xlsx(content)
-        elif mime_type == "text/csv":
-            text = await KnowledgeService.process_csv(content)
-        elif mime_type and mime_type.startswith("text/"):
-             text = content.decode("utf-8")
-        else:
-             # Fallback
-             text = content.decode("utf-8", errors="ignore")
-
-        return await KnowledgeService.process_and_save_content(text, meta_dict)
+        return await KnowledgeService.import_uploaded_file(upload.path, upload.filename, mime_type, meta_dict)
 
     except Exception as e:
         logger.error(f"Error importing file: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    finally:
+        upload.cleanup()
+
+@router.post("/import-file/async", status_code=202, response_model=JobAcceptedResponse, openapi_extra=IMPORT_FILE_OPENAPI)
+async def import_file_async(
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    # import-file のジョブ版: アップロードを保存してジョブIDを返します (結果は GET /api/jobs/{jobId})
+    logger.info(f"Received async import request (User: {current_user['uid']})")
+
+    # Rate Limit Check
+    await rate_limiter.check_limit(current_user["uid"])
+
+    user_id, upload, meta_dict, mime_type = await _receive_import_file(request, current_user)
+    # Document ID は投入時に決めておき、ジョブがリトライされても同じ Document に保存されるようにします
+    if not meta_dict.get("dbId"):
+        meta_dict["dbId"] = str(uuid.uuid4())
+
+    try:
+        job_id = await JobQueue.enqueue_upload(
+            user_id, "import_file", upload, {"metadata": meta_dict, "mimeType": mime_type}
+        )
+        return JobAcceptedResponse(job_id=job_id, status="QUEUED", document_id=meta_dict["dbId"])
+    except Exception as e:
+        upload.cleanup()
+        logger.error(f"Error enqueueing import: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
 
 @router.post("/import-text")
 async def import_text(
-    request: TextImportRequest,
     request: TextImportRequest,
     current_user: dict = Depends(get_current_user)
 ):
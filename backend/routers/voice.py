@@ -1,11 +1,15 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import List, Dict, Any
 import json
 import logging
 
 from services.voice_service import VoiceService
+from services.user_service import UserService
+from services.job_queue import JobQueue
 from dependencies import get_current_user
 from schemas.voice import SaveVoiceRequest, VoiceSaveResponse, VoiceProcessResponse
+from schemas.job import JobAcceptedResponse
+from utils.upload_stream import receive_multipart_upload
 
 # Setup Logger
 logger = logging.getLogger(__name__)
@@ -41,35 +45,75 @@ from utils.rate_limiter import InMemoryRateLimiter
 # Initialize Rate Limiter (5 requests per 1 minute)
 rate_limiter = InMemoryRateLimiter(max_requests=5, window_seconds=60)
 
-@router.post("/process", response_model=VoiceProcessResponse)
+# multipart 本体はハンドラー内でストリーミング受信するため、OpenAPI には手動で記載します
+VOICE_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file", "metadata"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "metadata": {"type": "string"},
+                        "save": {"type": "boolean", "default": True},
+                    },
+                }
+            }
+        },
+    }
+}
+
+async def _receive_voice_upload(request: Request, user: Dict[str, Any]):
+    # Plan-based size limit, enforced while the body streams in
+    user_id = await UserService.resolve_user_id(user["uid"])
+    plan = await UserService.get_user_plan(user_id)
+    upload, fields = await receive_multipart_upload(
+        request, UserService.get_upload_size_limit(plan, "voice"), required_fields=("metadata",)
+    )
+    logger.info(f"Spooled voice memo: {upload.filename} ({upload.size} bytes)")
+
+    try:
+        meta_dict = json.loads(fields["metadata"])
+        save = fields.get("save", "true").strip().lower() not in ("false", "0", "off", "no")
+
+        # Override or Validate User ID from metadata
+        if "userId" in meta_dict and meta_dict["userId"] != user["uid"]:
+             logger.warning(f"Metadata User ID {meta_dict.get('userId')} mismatch with Auth ID {user['uid']}")
+             raise HTTPException(status_code=403, detail="User ID mismatch")
+    except HTTPException:
+        upload.cleanup()
+        raise
+    except Exception as e:
+        upload.cleanup()
+        logger.error(f"Invalid voice metadata: {e}")
+        raise HTTPException(status_code=400, detail="Invalid metadata")
+
+    # Enforce Auth ID
+    meta_dict["userId"] = user["uid"]
+    return user_id, upload, meta_dict, save
+
+@router.post("/process", response_model=VoiceProcessResponse, openapi_extra=VOICE_UPLOAD_OPENAPI)
 async def process_voice_memo_endpoint(
-    file: UploadFile = File(...),
-    metadata: str = Form(...),
-    save: bool = Form(True),
+    request: Request,
     user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
     Process voice memo (Split -> Transcribe -> Summarize -> Save).
-    Same interface as legacy main.py endpoint.
+    Same interface as legacy main.py endpoint (multipart: file, metadata, save).
+    The upload is streamed to a temp file, never held in memory.
     """
-    logger.info(f"Received voice memo request for: {file.filename} (User: {user['uid']})")
+    logger.info(f"Received voice memo request (User: {user['uid']})")
     
     # Rate Limit Check
     await rate_limiter.check_limit(user["uid"])
+
+    _, upload, meta_dict, save = await _receive_voice_upload(request, user)
             
     try:
-        meta_dict = json.loads(metadata)
-        
-        # Override or Validate User ID from metadata
-        if "userId" in meta_dict and meta_dict["userId"] != user["uid"]:
-             logger.warning(f"Metadata User ID {meta_dict.get('userId')} mismatch with Auth ID {user['uid']}")
-             raise HTTPException(status_code=403, detail="User ID mismatch")
-        
-        # Enforce Auth ID
-        meta_dict["userId"] = user["uid"]
-
-        # Call Service (Service takes UploadFile directly now)
-        result = await VoiceService.process_voice_memo(file, meta_dict, save)
+        # Call Service (Service takes the spooled upload)
+        result = await VoiceService.process_voice_memo(upload, meta_dict, save)
         return result
 
     except HTTPException as e:
@@ -77,3 +121,36 @@ async def process_voice_memo_endpoint(
     except Exception as e:
          logger.error(f"Voice Error: {e}")
          raise HTTPException(status_code=500, detail="Internal Server Error")
+    finally:
+         upload.cleanup()
+
+@router.post("/process/async", status_code=202, response_model=JobAcceptedResponse, openapi_extra=VOICE_UPLOAD_OPENAPI)
+async def process_voice_memo_async_endpoint(
+    request: Request,
+    user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Same input as /process, but only spools the upload and enqueues a job.
+    Returns 202 with a job ID; poll GET /api/jobs/{jobId} for the result
+    (the same shape as the /process response).
+    """
+    logger.info(f"Received async voice memo request (User: {user['uid']})")
+
+    # Rate Limit Check
+    await rate_limiter.check_limit(user["uid"])
+
+    user_id, upload, meta_dict, save = await _receive_voice_upload(request, user)
+    if not meta_dict.get("fileId"):
+        upload.cleanup()
+        raise HTTPException(status_code=400, detail="Missing userId or fileId")
+
+    try:
+        job_id = await JobQueue.enqueue_upload(
+            user_id, "voice_process", upload, {"metadata": meta_dict, "save": save}
+        )
+        document_id = (meta_dict.get("dbId") or meta_dict["fileId"]) if save else None
+        return JobAcceptedResponse(job_id=job_id, status="QUEUED", document_id=document_id)
+    except Exception as e:
+        upload.cleanup()
+        logger.error(f"Voice Enqueue Error: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+from .common import CamelModel
+
+# --- Responses ---
+
+class JobAcceptedResponse(CamelModel):
+    job_id: str
+    status: str
+    document_id: Optional[str] = None  # 保存先の Document ID (投入時に決定)
+
+class JobStatusResponse(CamelModel):
+    id: str
+    kind: str
+    status: str  # QUEUED, RUNNING, SUCCEEDED, FAILED
+    attempts: int
+    max_attempts: int
+    result: Optional[Dict[str, Any]] = None  # 同期版エンドポイントのレスポンスと同じ形
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,172 @@
+# 同じ質問への回答を使い回すためのキャッシュ
+# キーは (ユーザー, 正規化した質問文, タグ, コーパスバージョン)。
+# ドキュメントの追加・削除・タグ変更で User."corpusVersion" が上がるので、古い回答は自然に使われなくなります。
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from database.db import get_pg_pool
+from services.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの有効期限 (秒)。Web検索の結果も回答に含まれるため、長くしすぎないようにします
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# キャッシュする回答数の上限 (LRU)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+# 質問文が完全一致しない場合に、埋め込みのコサイン類似度がこの値以上なら同じ質問とみなします (0 で無効)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+
+class AnswerKey(NamedTuple):
+    user_id: str
+    corpus_version: int
+    tags: Tuple[str, ...]
+    query: str
+
+    @property
+    def scope(self) -> Tuple[str, int, Tuple[str, ...]]:
+        # 類似度検索の対象になる範囲 (同じユーザー・バージョン・タグ)
+        return self.user_id, self.corpus_version, self.tags
+
+
+class _Entry:
+    __slots__ = ("answer", "embedding", "expires_at")
+
+    def __init__(self, answer: str, embedding: Optional[np.ndarray], expires_at: float):
+        self.answer = answer
+        self.embedding = embedding
+        self.expires_at = expires_at
+
+
+def _unit(embedding: List[float]) -> Optional[np.ndarray]:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else None
+
+
+async def get_corpus_version(user_id: str) -> int:
+    pool = await get_pg_pool()
+    version = await pool.fetchval('SELECT "corpusVersion" FROM "User" WHERE "id" = $1', user_id)
+    return version or 0
+
+
+async def bump_corpus_version(user_id: str):
+    pool = await get_pg_pool()
+    await pool.execute('UPDATE "User" SET "corpusVersion" = "corpusVersion" + 1 WHERE "id" = $1', user_id)
+
+
+class AnswerCache:
+    """
+    In-process LRU + TTL cache of generated answers.
+    Exact lookups use the normalized query. When a similarity threshold is
+    set, a miss falls back to the most similar cached query in the same
+    (user, corpus version, tags) scope.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        similarity: float = ANSWER_CACHE_SIMILARITY
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._entries: "OrderedDict[AnswerKey, _Entry]" = OrderedDict()
+        self._scopes: Dict[Tuple[str, int, Tuple[str, ...]], Set[AnswerKey]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @property
+    def uses_similarity(self) -> bool:
+        return self.similarity > 0
+
+    async def make_key(self, user_id: str, query: str, tags: Optional[List[str]]) -> AnswerKey:
+        version = await get_corpus_version(user_id)
+        return AnswerKey(user_id, version, tuple(sorted(set(tags or []))), normalize_text(query).lower())
+
+    def get(self, key: AnswerKey, embedding: Optional[List[float]] = None) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return entry.answer
+                self._discard(key)
+
+            if embedding is not None and self.uses_similarity:
+                match = self._most_similar(key, _unit(embedding), now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.similar_hits += 1
+                    return self._entries[match].answer
+
+            self.misses += 1
+            return None
+
+    def put(self, key: AnswerKey, answer: str, embedding: Optional[List[float]] = None):
+        if not answer:
+            return
+        unit = _unit(embedding) if embedding is not None and self.uses_similarity else None
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = _Entry(answer, unit, time.monotonic() + self.ttl_seconds)
+            self._scopes.setdefault(key.scope, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str):
+        # バージョンが変わればキーも変わりますが、不要になった回答のメモリを早めに解放します
+        with self._lock:
+            for key in [key for key in self._entries if key.user_id == user_id]:
+                self._discard(key)
+
+    def _most_similar(self, key: AnswerKey, unit: Optional[np.ndarray], now: float) -> Optional[AnswerKey]:
+        if unit is None:
+            return None
+        best_key, best_score = None, self.similarity
+        for candidate in list(self._scopes.get(key.scope, ())):
+            entry = self._entries[candidate]
+            if entry.expires_at <= now:
+                self._discard(candidate)
+                continue
+            if entry.embedding is None:
+                continue
+            score = float(np.dot(unit, entry.embedding))
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        return best_key
+
+    def _discard(self, key: AnswerKey):
+        if self._entries.pop(key, None) is None:
+            return
+        scope = self._scopes.get(key.scope)
+        if scope is not None:
+            scope.discard(key)
+            if not scope:
+                del self._scopes[key.scope]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "exactHits": self.exact_hits,
+                "similarHits": self.similar_hits,
+                "misses": self.misses,
+                "hitRate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+answer_cache = AnswerCache()
@@ -2,10 +2,10 @@
 # チャット機能（RAGを含む対話ロジック、履歴管理）を担当するサービス
 import os
 import logging
-from typing import List, Dict, Any, Optional
-import google.generativeai as genai
+from typing import AsyncIterator, List, Dict, Any, NamedTuple, Optional
 from datetime import datetime, timezone, timedelta
 import traceback
+import time
 
 import json
 from database.db import db
@@ -13,6 +13,11 @@ from services.prompts import CHAT_SYSTEM_PROMPT, INTENT_CLASSIFICATION_PROMPT
 from services.search_service import SearchService
 from services.vector_service import VectorService
 from services.user_service import UserService
+from services.context_packer import CONTEXT_NEIGHBOR_CHUNKS, ContextPacker, match_chunk_key
+from services.title_index import title_index
+from services.answer_cache import AnswerKey, answer_cache
+from services.intent_classifier import intent_classifier
+from services.llm_gateway import llm_gateway
 import asyncio
 
 # Setup Logger
@@ -21,11 +26,160 @@ logger = logging.getLogger(__name__)
 # Timezone Definition
 JST = timezone(timedelta(hours=9))
 
-# Initialize Clients
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+NO_CONTEXT_MESSAGE = "関連する学習データは見つかりませんでした。"
+
+# 回答生成モデル: "gemini" (本番) / "fake" (ローカル検証用。APIを呼ばずに擬似的にストリーミング)
+CHAT_MODEL_BACKEND = os.getenv("CHAT_MODEL_BACKEND", "gemini")
+
+# Web検索のゲート: 学習データの検索結果で十分に回答できそうな場合は Web 検索を省略します
+WEB_SEARCH_GATING = os.getenv("WEB_SEARCH_GATING", "true").lower() == "true"
+# ベクトル類似度 (コサイン) がこの値以上のヒットを「確信度が高い」とみなします
+WEB_SEARCH_SKIP_SCORE = float(os.getenv("WEB_SEARCH_SKIP_SCORE", "0.80"))
+# 確信度が高いヒットがこの件数以上あれば Web 検索を省略します
+WEB_SEARCH_SKIP_MIN_HITS = int(os.getenv("WEB_SEARCH_SKIP_MIN_HITS", "1"))
+# false (既定): RAG検索の結果を見てから開始し、不要なら Tavily を呼びません (クレジットを節約)
+# true: RAG検索と並行して Web 検索を開始します (低レイテンシ)。不要と分かっても送信済みの Tavily 呼び出しは
+#       取り消せないので、省略した検索の分もクレジットを消費します
+WEB_SEARCH_SPECULATIVE = os.getenv("WEB_SEARCH_SPECULATIVE", "false").lower() == "true"
+WEB_SEARCH_SKIPPED_MESSAGE = "(Skipped Web Search)"
+
+
+class FakeStreamingModel:
+    """
+    Local stand-in for GenerativeModel that needs no API key.
+    It streams a canned answer in small chunks with a fixed delay, so
+    time-to-first-token and streaming behaviour can be checked locally.
+    A non-streaming call takes as long as the whole stream (one delay per
+    chunk), like a real model producing the same tokens.
+    """
+
+    class _Chunk:
+        def __init__(self, text: str):
+            self.text = text
+
+    def __init__(self, answer: str = "これはローカル検証用のダミー回答です。", chunk_chars: int = 4, delay: float = 0.05):
+        self.answer = answer
+        self.chunk_chars = chunk_chars
+        self.delay = delay
+
+    @property
+    def generation_seconds(self) -> float:
+        return self.delay * -(-len(self.answer) // self.chunk_chars)
+
+    def generate_content(self, prompt):
+        time.sleep(self.generation_seconds)
+        return self._Chunk(self.answer)
+
+    async def generate_content_async(self, prompt, stream: bool = False):
+        if not stream:
+            await asyncio.sleep(self.generation_seconds)
+            return self._Chunk(self.answer)
+        return self._stream()
+
+    async def _stream(self):
+        for i in range(0, len(self.answer), self.chunk_chars):
+            await asyncio.sleep(self.delay)
+            yield self._Chunk(self.answer[i:i + self.chunk_chars])
+
+
+def get_chat_model():
+    if CHAT_MODEL_BACKEND == "fake":
+        return FakeStreamingModel()
+    # モデルインスタンスは LLMGateway が保持し、リクエスト間で再利用します
+    return llm_gateway.model(system_instruction=CHAT_SYSTEM_PROMPT)
+
+
+class RetrievalResult(NamedTuple):
+    context: str
+    matches: List[Dict[str, Any]]
+
+
+class WebSearchGate:
+    """
+    Decides from the retrieval result whether a web search is still needed,
+    and counts the decisions. skipRate only counts searches that were really
+    avoided: a skip after a speculative search was already started does not
+    save the Tavily call.
+    """
+
+    INTERNAL_KEYWORDS = ["登録", "ファイル", "要約", "データ", "registered", "file", "data"]
+
+    def __init__(
+        self,
+        enabled: bool = WEB_SEARCH_GATING,
+        skip_score: float = WEB_SEARCH_SKIP_SCORE,
+        min_hits: int = WEB_SEARCH_SKIP_MIN_HITS
+    ):
+        self.enabled = enabled
+        self.skip_score = skip_score
+        self.min_hits = min_hits
+        self.counts: Dict[str, int] = {"searched": 0, "internal_no_context": 0, "high_confidence": 0}
+        self.avoided = 0
+
+    def skip_reason(self, query: str, retrieval: RetrievalResult, search_started: bool = False) -> Optional[str]:
+        """
+        Returns why the web search can be skipped, or None if it is needed.
+        search_started: a speculative search is already running, so skipping
+        it does not avoid the upstream call.
+        """
+        reason = None
+        if retrieval.context == NO_CONTEXT_MESSAGE and any(k in query for k in self.INTERNAL_KEYWORDS):
+            # 内部データの質問で、かつ学習データが見つからなかった場合 (従来のルール)
+            reason = "internal_no_context"
+        elif self.enabled:
+            confident = sum(1 for m in retrieval.matches if m.get('vectorScore', 0.0) >= self.skip_score)
+            if confident >= self.min_hits:
+                reason = "high_confidence"
+        self.counts[reason or "searched"] += 1
+        if reason and not search_started:
+            self.avoided += 1
+        return reason
+
+    def stats(self) -> Dict[str, float]:
+        total = sum(self.counts.values())
+        return {**self.counts, "avoided": self.avoided, "skipRate": self.avoided / total if total else 0.0}
+
+
+web_search_gate = WebSearchGate()
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    # Server-Sent Events の1イベント分の文字列を作ります
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class StageTimer:
+    """
+    ask の各ステージの所要時間 (ms) を記録します。
+    並列実行されるステージも個別に計測されるので、クリティカルパスを確認できます。
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    async def run(self, name: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[name] = (time.perf_counter() - start) * 1000
+
+    def summary(self) -> str:
+        total = (time.perf_counter() - self.started_at) * 1000
+        stages = ", ".join(f"{name}={ms:.0f}ms" for name, ms in self.timings.items())
+        return f"{stages} | total={total:.0f}ms"
+
+
+class PreparedAsk(NamedTuple):
+    # _prepare の結果。cached_answer がある場合 prompt は None (生成は不要)
+    user_id: str
+    thread_id: str
+    prompt: Optional[str]
+    cached_answer: Optional[str]
+    cache_key: Optional[AnswerKey]
+    query_embedding: Optional[List[float]]
 
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
 
 class ChatService:
     def __init__(self):
@@ -50,14 +204,18 @@ class ChatService:
         """
         ユーザーの入力意図 (Intent) をGeminiを使って分類します。
         例: "チャットしたい", "検索したい", "保存したい" などを判別し、適切な処理に振り分けるために使用します。
+        明らかな入力はローカルの事前分類器 (キャッシュ / キーワード / 埋め込みの重心) で判定し、Geminiを呼びません。
         """
         try:
+            local_result = await intent_classifier.classify(text)
+            if local_result is not None:
+                return local_result
+
             prompt = INTENT_CLASSIFICATION_PROMPT.format(text=text)
             
 
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            # Run blocking Gemini call in thread
-            response = await asyncio.to_thread(model.generate_content, prompt)
+            # Run blocking Gemini call on the LLM gateway's thread pool
+            response = await llm_gateway.generate(prompt, op="classify_intent")
             text_resp = response.text.strip()
             
             # Clean up code blocks if present
@@ -66,7 +224,10 @@ class ChatService:
             elif text_resp.startswith("```"):
                 text_resp = text_resp[3:-3]
                 
-            return json.loads(text_resp)
+            result = json.loads(text_resp)
+            intent_classifier.remember(text, result)
+            logger.info(f"Intent classified by Gemini: {intent_classifier.stats()}")
+            return result
         except Exception as e:
             logger.error(f"Error classifying intent: {e}")
             # Fallback
@@ -77,139 +238,174 @@ class ChatService:
         RAG Process:
         1. Resolve User
         2. Check Limits
-        3. Thread Management
-        4. Vector Search (RAG)
-        5. Web Search (Optional)
-        6. Generate Answer
+        (Answer Cache: ヒットした場合はスレッドへの保存だけ行い、3-4 を省略します)
+        3. 以下を並列に実行 (Run concurrently):
+           - Thread Management + User Message
+           - Vector Search (RAG): Embedding -> Hybrid Search -> Document Fetch
+           - Plan Lookup -> Web Search (Optional)
+        4. Generate Answer
+        5. Save Assistant Message
         """
-        if tags is None:
-            tags = []
-        logger.info(f"ChatService: Received ask request from {user_id}")
+        timer = StageTimer()
 
         try:
-            # 1. Resolve User ID (Handle Provider ID)
-            resolved_user_id = await UserService.resolve_user_id(user_id)
-            # Log with masking
-            safe_user_id = user_id[:6] + "..." if len(user_id) > 6 else user_id
-            safe_resolved = resolved_user_id[:6] + "..." if len(resolved_user_id) > 6 else resolved_user_id
-            logger.info(f"User Resolved: {safe_user_id} -> {safe_resolved}")
-            
-            # 2. Check Limits & Get Plan
-            await UserService.check_and_increment_chat_limit(resolved_user_id)
-            current_plan = await UserService.get_user_plan(resolved_user_id)
-            logger.info(f"User {resolved_user_id} is on plan: {current_plan}")
-
-            # 3. Thread/Message Management
-            if not thread_id:
-                title = query[:30] + "..." if len(query) > 30 else query
-                thread = await db.thread.create(
-                    data={'userId': resolved_user_id, 'title': title}
-                )
-                thread_id = thread.id
-            else:
-                thread = await db.thread.find_unique(where={'id': thread_id})
-                if not thread or thread.userId != resolved_user_id:
-                     thread = await db.thread.create(
-                        data={'userId': resolved_user_id, 'title': query[:30]}
-                    )
-                     thread_id = thread.id
-                else:
-                    await db.thread.update(where={'id': thread_id}, data={'updatedAt': datetime.now(JST)})
-
-            # Save User Message
-            await db.message.create(
-                data={
-                    'content': query,
-                    'role': 'user',
-                    'userId': resolved_user_id,
-                    'threadId': thread_id
-                }
-            )
-
-            # 4. RAG Logic (Vector Search)
-            query_embedding = VectorService.get_embedding(query)
-            logger.info(f"Generated embedding for query: '{query}'")
-            
-            filter_dict = {"userId": resolved_user_id}
-            if tags:
-                 filter_dict["tags"] = {"$in": tags}
-                 
-            search_results = await VectorService.search_vectors(
-                query_embedding=query_embedding,
-                top_k=20,
-                filter=filter_dict
-            )
-            
-            context_parts = []
-            seen_ids = set()
-            
+            prepared = await self._prepare(query, user_id, thread_id, tags, timer)
 
-            if search_results and 'matches' in search_results:
-                # --- N+1 Solution: Batch Fetch ---
-                doc_ids_to_fetch = set()
-                
-                # 1. Collect all valid doc IDs
-                for match in search_results['matches']:
-                    meta = match['metadata']
-                    doc_id = meta.get('dbId') or meta.get('fileId') or match['id']
-                    if doc_id:
-                        doc_ids_to_fetch.add(doc_id)
-                
-                # 2. Batch Fetch
-                fetched_docs = await db.document.find_many(
-                    where={"id": {"in": list(doc_ids_to_fetch)}}
-                )
-                
-                # 3. Create Map for O(1) Access
-                docs_map = {doc.id: doc for doc in fetched_docs}
-                
-                # 4. Construct Context
-                for match in search_results['matches']:
-                    meta = match['metadata']
-                    doc_id = meta.get('dbId') or meta.get('fileId') or match['id']
-                    
-                    content = None
-                    if doc_id and doc_id not in seen_ids:
-                        doc = docs_map.get(doc_id)
-                        if doc and doc.content:
-                            content = doc.content
-                            context_parts.append(f"Source: {doc.title}\n\n{content}")
-                            seen_ids.add(doc_id)
-                    
-                    if not content:
-                        excerpt = meta.get('text', '')
-                        context_parts.append(f"Source: {meta.get('fileName')} (Excerpt)\n\n{excerpt}")
-
-            # Filename Match Backup
-            file_matches = await self.search_documents_by_filename(resolved_user_id, query)
-            for doc in file_matches:
-                if doc['id'] not in seen_ids:
-                     context_parts.append(f"Source: {doc['title']} (Filename Match)\n\n{doc['content']}")
-                     seen_ids.add(doc['id'])
-
-            if not context_parts:
-                context = "関連する学習データは見つかりませんでした。"
+            if prepared.cached_answer is not None:
+                answer = prepared.cached_answer
             else:
-                context = "\n\n---\n\n".join(context_parts)
-                
-            # 5. Web Search logic
-            internal_keywords = ["登録", "ファイル", "要約", "データ", "registered", "file", "data"]
-            is_internal = any(k in query for k in internal_keywords)
+                # 4. Generate Answer
+                model = get_chat_model()
+                # Run blocking Gemini call on the LLM gateway's thread pool
+                response = await timer.run("generation", llm_gateway.generate(prepared.prompt, op="chat", model=model))
+                answer = response.text
+                self._store_answer(prepared, answer)
             
-            web_result = ""
-            context_missing = context == "関連する学習データは見つかりませんでした。"
+            # 5. Save Assistant Message
+            await timer.run("assistant_message", self._save_assistant_message(answer, prepared.user_id, prepared.thread_id))
+            logger.info(f"ChatService ask timings: {timer.summary()}")
+            logger.info(f"LLM gateway: {llm_gateway.stats()}")
             
-            if is_internal and context_missing:
-                 web_result = "(Skipped Web Search)"
-            else:
-                 # Run blocking Search in thread
-                 web_result = await asyncio.to_thread(self.search_service.search, query, current_plan)
+            return {
+                "answer": answer,
+                "sources": [],
+                "threadId": prepared.thread_id
+            }
+
+        except Exception as e:
+            logger.error(f"ChatService Ask Error: {e}")
+            logger.error(traceback.format_exc())
+            raise e
+
+    async def ask_stream(
+        self,
+        query: str,
+        user_id: str,
+        thread_id: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Streaming version of ask.
+        Steps 1-3 (limits, thread, retrieval, web search) run before this returns,
+        so errors there still surface as normal HTTP errors. The returned iterator
+        yields Server-Sent Events:
+          event: meta   {"threadId": ...}
+          event: delta  {"text": ...}       (one per streamed chunk; one delta for a cached answer)
+          event: done   {"threadId": ...}   (after the assistant message is saved)
+          event: error  {"detail": ...}
+        """
+        timer = StageTimer()
+        try:
+            prepared = await self._prepare(query, user_id, thread_id, tags, timer)
+        except Exception as e:
+            logger.error(f"ChatService Ask Stream Error: {e}")
+            logger.error(traceback.format_exc())
+            raise e
+        return self._stream_answer(prepared, timer)
+
+    async def _stream_answer(self, prepared: PreparedAsk, timer: "StageTimer") -> AsyncIterator[str]:
+        user_id, thread_id = prepared.user_id, prepared.thread_id
+        yield format_sse("meta", {"threadId": thread_id})
+
+        try:
+            if prepared.cached_answer is not None:
+                yield format_sse("delta", {"text": prepared.cached_answer})
+                await timer.run("assistant_message", self._save_assistant_message(prepared.cached_answer, user_id, thread_id))
+                logger.info(f"ChatService ask_stream timings: {timer.summary()}")
+                yield format_sse("done", {"threadId": thread_id})
+                return
+        except Exception as e:
+            logger.error(f"ChatService Ask Stream Error: {e}")
+            logger.error(traceback.format_exc())
+            yield format_sse("error", {"detail": "Internal Server Error"})
+            return
+
+        parts: List[str] = []
+        generation_start = time.perf_counter()
+        try:
+            model = get_chat_model()
+            async for chunk in llm_gateway.stream(prepared.prompt, op="chat_stream", model=model):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # ブロックされたチャンクなど、テキストを持たない場合
+                    continue
+                if not text:
+                    continue
+                if not parts:
+                    timer.timings["first_token"] = (time.perf_counter() - generation_start) * 1000
+                parts.append(text)
+                yield format_sse("delta", {"text": text})
+            timer.timings["generation"] = (time.perf_counter() - generation_start) * 1000
+
+            # ストリームが完了してから回答全体を1件のメッセージとして保存します
+            answer = "".join(parts)
+            self._store_answer(prepared, answer)
+            await timer.run("assistant_message", self._save_assistant_message(answer, user_id, thread_id))
+            logger.info(f"ChatService ask_stream timings: {timer.summary()}")
+            yield format_sse("done", {"threadId": thread_id})
+
+        except Exception as e:
+            logger.error(f"ChatService Ask Stream Error: {e}")
+            logger.error(traceback.format_exc())
+            yield format_sse("error", {"detail": "Internal Server Error"})
+
+    async def _prepare(
+        self,
+        query: str,
+        user_id: str,
+        thread_id: Optional[str],
+        tags: Optional[List[str]],
+        timer: "StageTimer"
+    ) -> PreparedAsk:
+        """
+        Steps 1-3 of ask.
+        On an answer cache hit only the thread and user message are handled,
+        and the result carries the cached answer instead of a prompt.
+        """
+        if tags is None:
+            tags = []
+        logger.info(f"ChatService: Received ask request from {user_id}")
+
+        # 1. Resolve User ID (Handle Provider ID)
+        resolved_user_id = await timer.run("resolve_user", UserService.resolve_user_id(user_id))
+        # Log with masking
+        safe_user_id = user_id[:6] + "..." if len(user_id) > 6 else user_id
+        safe_resolved = resolved_user_id[:6] + "..." if len(resolved_user_id) > 6 else resolved_user_id
+        logger.info(f"User Resolved: {safe_user_id} -> {safe_resolved}")
+        
+        # 2. Check Limits (制限超過ならここで例外。以降の処理は行いません)
+        await timer.run("limit_check", UserService.check_and_increment_chat_limit(resolved_user_id))
+
+        # Answer Cache (同じユーザー・質問・タグ・コーパスバージョンの回答があれば再利用します)
+        cache_key, query_embedding, cached_answer = await timer.run(
+            "answer_cache", self._lookup_answer(query, resolved_user_id, tags)
+        )
+        if cached_answer is not None:
+            logger.info(f"Answer cache hit: {answer_cache.stats()}")
+            thread_id = await timer.run("thread", self._prepare_thread(query, resolved_user_id, thread_id))
+            return PreparedAsk(resolved_user_id, thread_id, None, cached_answer, cache_key, query_embedding)
+
+        # 3. 依存関係のない処理を並列に実行します
+        thread_task = asyncio.create_task(
+            timer.run("thread", self._prepare_thread(query, resolved_user_id, thread_id))
+        )
+        context_task = asyncio.create_task(
+            timer.run("retrieval", self._retrieve_context(query, resolved_user_id, tags, timer, query_embedding))
+        )
+        web_task = asyncio.create_task(
+            timer.run("web", self._web_search(query, resolved_user_id, context_task, timer))
+        )
+        try:
+            thread_id, retrieval, web_result = await asyncio.gather(thread_task, context_task, web_task)
+        except BaseException:
+            for task in (thread_task, context_task, web_task):
+                task.cancel()
+            raise
 
-            # 6. Generate Answer
-            model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=CHAT_SYSTEM_PROMPT)
-            prompt = f"""
+        prompt = f"""
             Context:
-            {context}
+            {retrieval.context}
             
             Web Search:
             {web_result}
@@ -219,46 +415,152 @@ class ChatService:
             
             Answer (Japanese):
             """
-            
-            # Run blocking Gemini call in thread
-            response = await asyncio.to_thread(model.generate_content, prompt)
-            answer = response.text
-            
-            # Save Assistant Message
-            await db.message.create(
-                data={
-                    'content': answer,
-                    'role': 'assistant',
-                    'userId': resolved_user_id,
-                    'threadId': thread_id
-                }
+        return PreparedAsk(resolved_user_id, thread_id, prompt, None, cache_key, query_embedding)
+
+    @staticmethod
+    async def _lookup_answer(query: str, user_id: str, tags: List[str]):
+        # Returns (cache key, query embedding, cached answer). キャッシュの失敗で質問処理は止めません
+        try:
+            cache_key = await answer_cache.make_key(user_id, query, tags)
+            query_embedding = None
+            if answer_cache.uses_similarity:
+                # 類似度判定に使った埋め込みは、そのままRAG検索にも使います
+                query_embedding = await VectorService.get_embedding_async(query)
+            return cache_key, query_embedding, answer_cache.get(cache_key, query_embedding)
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {e}")
+            return None, None, None
+
+    @staticmethod
+    def _store_answer(prepared: PreparedAsk, answer: str):
+        if prepared.cache_key is not None:
+            answer_cache.put(prepared.cache_key, answer, prepared.query_embedding)
+        logger.info(f"Answer cache stats: {answer_cache.stats()}")
+
+    @staticmethod
+    async def _save_assistant_message(answer: str, user_id: str, thread_id: str):
+        await db.message.create(
+            data={
+                'content': answer,
+                'role': 'assistant',
+                'userId': user_id,
+                'threadId': thread_id
+            }
+        )
+
+    @staticmethod
+    async def _prepare_thread(query: str, user_id: str, thread_id: Optional[str]) -> str:
+        # スレッドの作成/更新とユーザーメッセージの保存 (回答生成とは独立)
+        if not thread_id:
+            title = query[:30] + "..." if len(query) > 30 else query
+            thread = await db.thread.create(
+                data={'userId': user_id, 'title': title}
             )
-            
-            return {
-                "answer": answer,
-                "sources": [],
-                "threadId": thread_id
+            thread_id = thread.id
+        else:
+            thread = await db.thread.find_unique(where={'id': thread_id})
+            if not thread or thread.userId != user_id:
+                 thread = await db.thread.create(
+                    data={'userId': user_id, 'title': query[:30]}
+                )
+                 thread_id = thread.id
+            else:
+                await db.thread.update(where={'id': thread_id}, data={'updatedAt': datetime.now(JST)})
+
+        # Save User Message
+        await db.message.create(
+            data={
+                'content': query,
+                'role': 'user',
+                'userId': user_id,
+                'threadId': thread_id
             }
+        )
+        return thread_id
 
-        except Exception as e:
-            logger.error(f"ChatService Ask Error: {e}")
-            logger.error(traceback.format_exc())
-            raise e
+    @staticmethod
+    async def _retrieve_context(
+        query: str,
+        user_id: str,
+        tags: List[str],
+        timer: "StageTimer",
+        query_embedding: Optional[List[float]] = None
+    ) -> RetrievalResult:
+        # RAG Logic (Embedding -> Hybrid Search -> Filename Match -> Chunk Fetch)
+        # ファイル名の照合はキャッシュ済みのタイトルだけを使うので、検索と並行して行います
+        title_task = asyncio.create_task(timer.run("title_match", title_index.match(user_id, query)))
+        try:
+            if query_embedding is None:
+                query_embedding = await timer.run("embedding", VectorService.get_embedding_async(query))
+                logger.info(f"Generated embedding for query: '{query}'")
+            
+            filter_dict = {"userId": user_id}
+            if tags:
+                 filter_dict["tags"] = {"$in": tags}
+                 
+            # 語句一致 (固有名詞・科目コード・ファイル名) とベクトル検索を並列に実行し、RRFで統合します
+            search_results = await timer.run("vector_search", VectorService.search_vectors(
+                query_embedding=query_embedding,
+                top_k=20,
+                filter=filter_dict,
+                query_text=query,
+                mode="hybrid"
+            ))
+            title_hits = await title_task
+        finally:
+            title_task.cancel()
+        
+        matches = search_results.get('matches', []) if search_results else []
 
-    async def search_documents_by_filename(self, user_id: str, query: str):
-        query_sql = """
-            SELECT id, title, content FROM "Document"
-            WHERE "userId" = $1
-        """
-        docs = await db.query_raw(query_sql, user_id)
-        matches = []
-        norm_query = query.lower().replace("_", " ")
-        for doc in docs:
-            title = doc['title']
-            if not title: continue
-            base = os.path.splitext(title)[0]
-            norm_title = base.lower().replace("_", " ")
-            if len(norm_title) < 2: continue
-            if norm_title in norm_query:
-                matches.append(doc)
-        return matches
+        # Filename Match Backup: 質問文にファイル名が含まれるドキュメントは先頭のチャンクを最後に追加します
+        seen_ids = {key[0] for key in (match_chunk_key(match) for match in matches) if key}
+        for doc in title_hits:
+            if doc['id'] not in seen_ids:
+                matches.append({
+                    'id': doc['id'],
+                    'score': 0.0,
+                    'metadata': {
+                        'dbId': doc['id'],
+                        'fileName': f"{doc['title']} (Filename Match)",
+                        'chunkIndex': 0,
+                    }
+                })
+                seen_ids.add(doc['id'])
+
+        # ドキュメント全文ではなく、ヒットしたチャンクとその前後のチャンクだけを取得します
+        hits = [key for key in (match_chunk_key(match) for match in matches) if key]
+        chunks = await timer.run("chunk_fetch", VectorService.fetch_chunk_windows(
+            user_id, hits, CONTEXT_NEIGHBOR_CHUNKS
+        ))
+
+        # スコア順にトークン予算内でコンテキストを組み立てます
+        context = ContextPacker().pack(matches, chunks)
+        return RetrievalResult(context or NO_CONTEXT_MESSAGE, matches)
+
+    async def _web_search(self, query: str, user_id: str, context_task: "asyncio.Task", timer: "StageTimer") -> str:
+        # Web Search logic
+        # RAG検索の結果 (ベクトル類似度) を見て、Web検索が不要ならスキップします
+        current_plan = await timer.run("plan_lookup", UserService.get_user_plan(user_id))
+        logger.info(f"User {user_id} is on plan: {current_plan}")
+
+        search_task = None
+        if WEB_SEARCH_SPECULATIVE:
+            # キャッシュ済み / 実行中の同じ検索があれば再利用します (Tavily 呼び出し自体はスレッドで実行)
+            search_task = asyncio.create_task(self.search_service.search_async(query, current_plan))
+        try:
+            retrieval = await asyncio.shield(context_task)
+            reason = web_search_gate.skip_reason(query, retrieval, search_started=search_task is not None)
+        except BaseException:
+            if search_task:
+                search_task.cancel()
+            raise
+
+        if reason:
+            if search_task:
+                # 待つのをやめるだけで、送信済みの Tavily 呼び出しは止まりません (結果はキャッシュされます)
+                search_task.cancel()
+            logger.info(f"Web search skipped ({reason}): {web_search_gate.stats()}")
+            return WEB_SEARCH_SKIPPED_MESSAGE
+        if search_task:
+            return await search_task
+        return await self.search_service.search_async(query, current_plan)
@@ -0,0 +1,131 @@
+# RAGプロンプト用のコンテキストをトークン予算内で組み立てるサービス
+# ドキュメント全文ではなく、ヒットしたチャンクとその前後のチャンク (chunkIndex) だけを使います。
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# プロンプトに含めるコンテキストの上限トークン数
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "12000"))
+# ヒットしたチャンクの前後何チャンクまで広げるか
+CONTEXT_NEIGHBOR_CHUNKS = int(os.getenv("CONTEXT_NEIGHBOR_CHUNKS", "2"))
+# 隣接チャンクの重なりの最大文字数 (VectorService.chunk_text の overlap=50 と同じ)
+_MAX_OVERLAP_CHARS = 50
+# これより短い一致は偶然の一致とみなし、重なりとして扱いません
+_MIN_OVERLAP_CHARS = 10
+
+ChunkKey = Tuple[str, int]
+
+
+@lru_cache(maxsize=1)
+def _token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        # エンコーディングを取得できない環境では文字数で代用します (日本語ではほぼ上限値になります)
+        logger.warning(f"tiktoken unavailable, counting characters instead: {e}")
+        return len
+
+
+def count_tokens(text: str) -> int:
+    return _token_counter()(text)
+
+
+def match_chunk_key(match: Dict[str, Any]) -> Optional[ChunkKey]:
+    # 検索結果1件の (documentId, chunkIndex)。ドキュメントに紐付かない古いチャンクは None
+    meta = match['metadata']
+    doc_id = meta.get('dbId') or meta.get('fileId')
+    if not doc_id:
+        return None
+    return doc_id, meta.get('chunkIndex', 0)
+
+
+class ContextPacker:
+    """
+    Packs search hits into a prompt context under a token budget.
+
+    Hits are taken in score order. Each hit is expanded outwards to its
+    neighbouring chunks (idx, idx+1, idx-1, idx+2, ...) while the budget allows.
+    Chunks are then grouped per document, and consecutive chunks are joined
+    with their overlap removed.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, neighbors: int = CONTEXT_NEIGHBOR_CHUNKS):
+        self.token_budget = token_budget
+        self.neighbors = neighbors
+
+    def pack(self, matches: List[Dict[str, Any]], chunks: Dict[ChunkKey, str]) -> str:
+        """
+        matches: search_vectors() matches
+        chunks: {(documentId, chunkIndex): content} for the hits and their neighbours
+        Returns the context text ("" if nothing fits).
+        """
+        used = 0
+        selected: Dict[str, Dict[int, str]] = {}
+        titles: Dict[str, str] = {}
+
+        for match in sorted(matches, key=lambda m: m.get('score', 0.0), reverse=True):
+            if used >= self.token_budget:
+                break
+            meta = match['metadata']
+            key = match_chunk_key(match)
+            doc_key, index = key if key else (match['id'], 0)
+            titles.setdefault(doc_key, meta.get('fileName') or "Unknown")
+            doc_chunks = selected.setdefault(doc_key, {})
+
+            for candidate in self._expansion_order(index):
+                if candidate in doc_chunks:
+                    continue
+                text = chunks.get((doc_key, candidate))
+                if text is None and candidate == index:
+                    text = meta.get('text', '')
+                if not text:
+                    continue
+                cost = count_tokens(text)
+                if used + cost > self.token_budget:
+                    # これ以上広げると予算を超えるので、このヒットの展開は終了します
+                    break
+                doc_chunks[candidate] = text
+                used += cost
+
+        parts = []
+        for doc_key, doc_chunks in selected.items():
+            if doc_chunks:
+                parts.append(f"Source: {titles[doc_key]}\n\n{self._render(doc_chunks)}")
+        logger.info(f"ContextPacker: {used}/{self.token_budget} tokens from {len(parts)} documents")
+        return "\n\n---\n\n".join(parts)
+
+    def _expansion_order(self, index: int) -> Iterator[int]:
+        yield index
+        # 要約チャンク (chunkIndex -1) は前後に広げません
+        if index < 0:
+            return
+        for distance in range(1, self.neighbors + 1):
+            yield index + distance
+            if index - distance >= 0:
+                yield index - distance
+
+    @staticmethod
+    def _render(doc_chunks: Dict[int, str]) -> str:
+        # 連続するチャンクは重なりを除いて結合し、離れている箇所は "..." で区切ります
+        runs: List[str] = []
+        previous_index = None
+        for index in sorted(doc_chunks):
+            text = doc_chunks[index]
+            if previous_index is not None and previous_index >= 0 and index == previous_index + 1:
+                runs[-1] = ContextPacker._join_overlapping(runs[-1], text)
+            else:
+                runs.append(text)
+            previous_index = index
+        return "\n...\n".join(runs)
+
+    @staticmethod
+    def _join_overlapping(left: str, right: str) -> str:
+        for size in range(min(_MAX_OVERLAP_CHARS, len(left), len(right)), _MIN_OVERLAP_CHARS - 1, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        return left + right
@@ -1,5 +1,6 @@
 from database.db import db
 from schemas.course import CourseCreate, CourseUpdate
+from services.knowledge_service import KnowledgeService
 from typing import List, Optional
 import logging
 from datetime import datetime, timezone, timedelta
@@ -81,5 +82,6 @@ class CourseService:
             where={"courseId": course_id},
             data={"deletedAt": now, "courseId": None}
         )
+        await KnowledgeService.mark_corpus_changed(user_id, titles_changed=True)
         
         return await prisma.course.delete(where={"id": course_id})
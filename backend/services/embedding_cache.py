@@ -0,0 +1,162 @@
+# 同一テキストの再ベクトル化を避けるための埋め込みキャッシュ
+# 1段目: プロセス内LRU (メモリ上限つき) / 2段目: Postgres ("EmbeddingCache" テーブル)
+import hashlib
+import logging
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from database.db import get_pg_pool
+from database.vector_codec import Vector
+
+logger = logging.getLogger(__name__)
+
+# メモリ上のキャッシュ上限 (バイト)。768次元のfloat32で1件あたり約3KB
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Postgres側を使うかどうか (ローカル開発などで無効化できるように)
+EMBEDDING_CACHE_PERSISTENT = os.getenv("EMBEDDING_CACHE_PERSISTENT", "true").lower() == "true"
+# Postgres側の保持期間 (日)。prune で古いものから削除します
+EMBEDDING_CACHE_TTL_DAYS = int(os.getenv("EMBEDDING_CACHE_TTL_DAYS", "90"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    # 改行や連続する空白を1つのスペースにまとめます (ベクトル化するのもこの正規化後のテキストです)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def make_key(normalized_text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalized_text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache.
+    Keys are sha256(model + normalized text). Lookups try the in-process LRU
+    first and then Postgres. Postgres hits are copied into the LRU.
+    """
+
+    def __init__(self, max_bytes: int, persistent: bool = True):
+        self.max_bytes = max_bytes
+        self.persistent = persistent
+        self._entries: "OrderedDict[str, array]" = OrderedDict()
+        self._bytes = 0
+        # スレッドプール上の処理から呼ばれても壊れないようロックで保護します
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    # --- In-process LRU tier ---
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return entry.tolist()
+
+    def put(self, key: str, embedding: List[float]):
+        # list[float] ではなく array('f') で保持し、メモリ使用量を抑えます
+        entry = array("f", embedding)
+        size = entry.itemsize * len(entry)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.itemsize * len(old)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.itemsize * len(evicted)
+
+    def record_misses(self, count: int):
+        with self._lock:
+            self.misses += count
+
+    # --- Two-tier batch API ---
+
+    async def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Look up keys in memory, then in Postgres for the rest.
+        Returns {key: embedding} for hits only.
+        """
+        found: Dict[str, List[float]] = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            embedding = self.get(key)
+            if embedding is not None:
+                found[key] = embedding
+            else:
+                missing.append(key)
+
+        if missing and self.persistent:
+            try:
+                pool = await get_pg_pool()
+                rows = await pool.fetch(
+                    'SELECT "key", "embedding" FROM "EmbeddingCache" WHERE "key" = ANY($1::text[])',
+                    missing
+                )
+                for row in rows:
+                    found[row['key']] = row['embedding']
+                    self.put(row['key'], row['embedding'])
+                with self._lock:
+                    self.db_hits += len(rows)
+            except Exception as e:
+                # キャッシュの失敗で本処理を止めないようにします
+                logger.warning(f"EmbeddingCache: persistent lookup failed: {e}")
+
+        return found
+
+    async def put_many(self, items: Dict[str, List[float]], model: str):
+        for key, embedding in items.items():
+            self.put(key, embedding)
+
+        if not items or not self.persistent:
+            return
+        try:
+            pool = await get_pg_pool()
+            await pool.execute(
+                """
+                INSERT INTO "EmbeddingCache" ("key", "model", "embedding", "createdAt")
+                SELECT k, $2, e, NOW() FROM unnest($1::text[], $3::vector[]) AS r(k, e)
+                ON CONFLICT ("key") DO NOTHING
+                """,
+                list(items.keys()),
+                model,
+                [Vector(embedding) for embedding in items.values()]
+            )
+        except Exception as e:
+            logger.warning(f"EmbeddingCache: persistent write failed: {e}")
+
+    async def prune(self, ttl_days: int = EMBEDDING_CACHE_TTL_DAYS) -> str:
+        # Postgres側の古いエントリを削除します (メンテナンス用)
+        pool = await get_pg_pool()
+        result = await pool.execute(
+            """DELETE FROM "EmbeddingCache" WHERE "createdAt" < NOW() - make_interval(days => $1)""",
+            ttl_days
+        )
+        logger.info(f"EmbeddingCache: pruned entries older than {ttl_days} days ({result})")
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            hits = self.memory_hits + self.db_hits
+            return {
+                "memoryHits": self.memory_hits,
+                "dbHits": self.db_hits,
+                "misses": self.misses,
+                "hitRate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_MAX_BYTES, persistent=EMBEDDING_CACHE_PERSISTENT)
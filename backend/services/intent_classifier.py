@@ -0,0 +1,197 @@
+# /classify 用のローカル事前分類器
+# 明らかな入力はキーワードルールと埋め込みの最近傍重心で判定し、自信がない場合だけ Gemini に回します。
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.embedding_cache import normalize_text
+from services.vector_service import VectorService
+
+logger = logging.getLogger(__name__)
+
+# 埋め込みの重心による判定を使うかどうか (埋め込みAPIを1回呼びます)。既定はルールのみ
+# 例文が少なく STORE の取りこぼしが起きやすいため、有効にする場合は CHAT / REVIEW の判定だけに使います
+INTENT_CENTROID_ENABLED = os.getenv("INTENT_CENTROID_ENABLED", "false").lower() == "true"
+# CHAT / REVIEW のうち近い方との類似度がこの値以上で、もう一方・STORE の両方と INTENT_CENTROID_MARGIN 以上離れていれば確定します
+INTENT_CENTROID_MIN_SCORE = float(os.getenv("INTENT_CENTROID_MIN_SCORE", "0.70"))
+INTENT_CENTROID_MARGIN = float(os.getenv("INTENT_CENTROID_MARGIN", "0.10"))
+# 分類結果のLRUキャッシュの件数
+INTENT_CACHE_MAX_ENTRIES = int(os.getenv("INTENT_CACHE_MAX_ENTRIES", "1000"))
+
+DEFAULT_TAGS = ["General"]
+
+# INTENT_CLASSIFICATION_PROMPT の3分類 (STORE / REVIEW / CHAT) のキーワード
+_RULES: Dict[str, "re.Pattern"] = {
+    "STORE": re.compile(
+        r"覚えて(おいて|といて|ください|て)?$|覚えといて|覚えておいて(くれ|もら|ほし|ね)|メモして|メモ[:：]|記録して|保存して|登録して"
+        r"|^remember\b|\bremember (this|that)\b|^note[:：]|\bsave this\b",
+        re.IGNORECASE
+    ),
+    "REVIEW": re.compile(
+        r"復習|振り返|思い出|覚えてる|覚えている|覚えたこと|前に(保存|登録|覚え)|クイズ|問題を出して"
+        r"|\breview\b|\brecall\b|\bquiz me\b|what did i (save|store|note)",
+        re.IGNORECASE
+    ),
+    "CHAT": re.compile(
+        r"[?？]$|とは$|とは[?？]|教えて|なぜ|どうして|どうやって|って何|ってなに|について"
+        r"|^(what|why|how|when|where|who|can|could|is|are|do|does)\b|\bexplain\b",
+        re.IGNORECASE
+    ),
+}
+
+# 最近傍重心用のラベル付き例文 (INTENT_CLASSIFICATION_PROMPT の定義に沿ったもの)
+_EXAMPLES: Dict[str, List[str]] = {
+    "STORE": [
+        "明日の10時に歯医者の予約があることを覚えておいて",
+        "メモして: 線形代数の期末試験は7月20日",
+        "このレシピを保存して",
+        "パスタは塩を多めに入れると美味しい、と記録しておいて",
+        "Remember that the meeting moved to Friday",
+        "Note: buy printer ink",
+    ],
+    "REVIEW": [
+        "前に覚えたことを復習したい",
+        "先週保存したメモを振り返りたい",
+        "統計学で覚えたことをクイズにして",
+        "私が登録した内容を思い出させて",
+        "What did I save about the project last week?",
+        "Quiz me on what I stored about Python",
+    ],
+    "CHAT": [
+        "微分と積分の違いは何ですか？",
+        "おすすめの勉強方法を教えて",
+        "今日はちょっと疲れたな",
+        "機械学習とはどういうものですか",
+        "How does TCP handshake work?",
+        "Can you explain recursion simply?",
+    ],
+}
+
+
+class IntentPreClassifier:
+    """
+    First stage in front of the Gemini intent classifier.
+
+    1. LRU cache of recent results (Gemini results included)
+    2. Keyword rules: exactly one intent matched -> confident
+    3. Nearest centroid over embeddings of the labelled examples (off by
+       default). It only chooses between CHAT and REVIEW, and falls
+       through whenever STORE is within the margin of the best score.
+
+    STORE also needs content tags, which only Gemini extracts, so STORE
+    decisions still fall through. CHAT and REVIEW are answered locally
+    with the default tags.
+    """
+
+    def __init__(
+        self,
+        centroid_enabled: bool = INTENT_CENTROID_ENABLED,
+        min_score: float = INTENT_CENTROID_MIN_SCORE,
+        margin: float = INTENT_CENTROID_MARGIN,
+        max_entries: int = INTENT_CACHE_MAX_ENTRIES
+    ):
+        self.centroid_enabled = centroid_enabled
+        self.min_score = min_score
+        self.margin = margin
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._centroids: Optional[Tuple[List[str], np.ndarray]] = None
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {"cache": 0, "rules": 0, "centroid": 0, "fallthrough": 0}
+
+    async def classify(self, text: str) -> Optional[Dict[str, Any]]:
+        """Return a ClassifyResponse-shaped dict, or None to fall through to Gemini."""
+        key = normalize_text(text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.counts["cache"] += 1
+                return dict(cached)
+
+        intent = self._classify_by_rules(key)
+        if intent is not None:
+            stage, confidence = "rules", 0.9
+        else:
+            intent, confidence = await self._classify_by_centroid(key)
+            stage = "centroid"
+
+        if intent is None or intent == "STORE":
+            self._count("fallthrough")
+            return None
+        self._count(stage)
+        result = {"intent": intent, "tags": list(DEFAULT_TAGS), "confidence": confidence}
+        self.remember(text, result)
+        return result
+
+    def remember(self, text: str, result: Dict[str, Any]):
+        with self._lock:
+            self._cache[normalize_text(text)] = dict(result)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _classify_by_rules(text: str) -> Optional[str]:
+        matched = [intent for intent, pattern in _RULES.items() if pattern.search(text)]
+        if len(matched) == 2 and "CHAT" in matched:
+            # "覚えてる？" のように疑問形の REVIEW/STORE は、より具体的な方を採用します
+            matched.remove("CHAT")
+        return matched[0] if len(matched) == 1 else None
+
+    async def _classify_by_centroid(self, text: str) -> Tuple[Optional[str], Optional[float]]:
+        if not self.centroid_enabled:
+            return None, None
+        try:
+            labels, centroids = await self._get_centroids()
+            query = np.asarray(await VectorService.get_embedding_async(text), dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+        except Exception as e:
+            logger.warning(f"Intent centroid stage unavailable: {e}")
+            return None, None
+
+        return self._decide_by_scores(dict(zip(labels, (float(score) for score in centroids @ query))))
+
+    def _decide_by_scores(self, scores: Dict[str, float]) -> Tuple[Optional[str], Optional[float]]:
+        # STORE を CHAT / REVIEW と取り違えると保存されないので、STORE の可能性が少しでもあれば Gemini に任せます
+        store = scores.pop("STORE")
+        best_label = max(scores, key=scores.get)
+        best = scores.pop(best_label)
+        runner_up = max([store, *scores.values()])
+        if best >= self.min_score and best - runner_up >= self.margin:
+            return best_label, best
+        return None, None
+
+    async def _get_centroids(self) -> Tuple[List[str], np.ndarray]:
+        if self._centroids is None:
+            labels = list(_EXAMPLES)
+            texts = [example for label in labels for example in _EXAMPLES[label]]
+            embeddings = np.asarray(await VectorService.get_embeddings(texts), dtype=np.float32)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            rows, start = [], 0
+            for label in labels:
+                centroid = embeddings[start:start + len(_EXAMPLES[label])].mean(axis=0)
+                rows.append(centroid / np.linalg.norm(centroid))
+                start += len(_EXAMPLES[label])
+            self._centroids = (labels, np.stack(rows))
+        return self._centroids
+
+    def _count(self, stage: str):
+        with self._lock:
+            self.counts[stage] += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                **self.counts,
+                "fallthroughRate": self.counts["fallthrough"] / total if total else 0.0,
+                "entries": len(self._cache),
+            }
+
+
+intent_classifier = IntentPreClassifier()
@@ -0,0 +1,409 @@
+# 重い取り込み処理 (音声処理・ファイルインポート) を HTTP リクエストの外で実行する Postgres ジョブキュー
+# ワーカーは SELECT ... FOR UPDATE SKIP LOCKED でジョブを取得し、実行中は lockedUntil (可視性タイムアウト) を延長し続けます。
+# ワーカーが落ちて延長が止まったジョブは、タイムアウト後に別のワーカーが再取得します。
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from fastapi import HTTPException
+
+from database.db import get_pg_pool
+from services.knowledge_service import KnowledgeService
+from services.voice_service import VoiceService
+from utils.upload_stream import SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+# 実行中ジョブのロック期間 (秒)。ワーカーはこの 1/3 ごとに延長します
+JOB_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+# 1ジョブあたりの最大試行回数
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# リトライまでの待ち時間 (秒)。試行ごとに2倍になります
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30"))
+# キューが空のときのポーリング間隔 (秒)
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+# 1ワーカーで同時に実行するジョブ数
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+# ジョブ用にアップロードを保存するディレクトリ。別プロセスのワーカーとは共有されている必要があります
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "jibun-jobs"))
+
+# ハンドラーは claim したジョブ (id, payload, attempts など) を受け取り、結果 (JSON) を返します
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that a retry cannot fix."""
+
+
+class JobQueue:
+    """
+    Enqueue / claim / complete operations on the "Job" table.
+    Status flow: QUEUED -> RUNNING -> SUCCEEDED | FAILED. A failed attempt
+    goes back to QUEUED with a backoff until maxAttempts is reached.
+    complete/fail/heartbeat only apply while the caller still holds the lease.
+    """
+
+    @staticmethod
+    async def enqueue(
+        user_id: str,
+        kind: str,
+        payload: Dict[str, Any],
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        job_id: Optional[str] = None
+    ) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        pool = await get_pg_pool()
+        await pool.execute(
+            """
+            INSERT INTO "Job" ("id", "userId", "kind", "payload", "maxAttempts")
+            VALUES ($1, $2, $3, $4::jsonb, $5)
+            """,
+            job_id, user_id, kind, json.dumps(payload), max_attempts
+        )
+        logger.info(f"Enqueued job {job_id} ({kind}) for user {user_id}")
+        return job_id
+
+    @classmethod
+    async def enqueue_upload(
+        cls,
+        user_id: str,
+        kind: str,
+        upload: SpooledUpload,
+        payload: Dict[str, Any]
+    ) -> str:
+        """
+        Move a spooled upload into JOB_SPOOL_DIR (so it outlives the request
+        and survives retries) and enqueue a job that points at it.
+        """
+        job_id = uuid.uuid4().hex
+        os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+        spool_path = os.path.join(JOB_SPOOL_DIR, job_id + os.path.splitext(upload.path)[1])
+        await asyncio.to_thread(shutil.move, upload.path, spool_path)
+        upload.path = spool_path
+        payload = {
+            **payload,
+            "upload": {
+                "path": spool_path,
+                "filename": upload.filename,
+                "contentType": upload.content_type,
+                "size": upload.size,
+                "sha256": upload.sha256,
+                "sniffedMime": upload.sniffed_mime,
+            },
+        }
+        try:
+            return await cls.enqueue(user_id, kind, payload, job_id=job_id)
+        except Exception:
+            upload.cleanup()
+            raise
+
+    @staticmethod
+    async def claim(worker_id: str) -> Optional[Dict[str, Any]]:
+        # 実行待ちのジョブか、ロック期限が切れた実行中ジョブを1件取得します (他のワーカーがロック中の行は飛ばす)
+        pool = await get_pg_pool()
+        row = await pool.fetchrow(
+            """
+            UPDATE "Job" AS j
+            SET "status" = 'RUNNING',
+                "attempts" = j."attempts" + 1,
+                "lockedBy" = $1,
+                "lockedUntil" = CURRENT_TIMESTAMP + make_interval(secs => $2),
+                "updatedAt" = CURRENT_TIMESTAMP
+            FROM (
+                SELECT "id" FROM "Job"
+                WHERE ("status" = 'QUEUED' AND "runAt" <= CURRENT_TIMESTAMP)
+                   OR ("status" = 'RUNNING' AND "lockedUntil" < CURRENT_TIMESTAMP)
+                ORDER BY "runAt"
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            ) AS next
+            WHERE j."id" = next."id"
+            RETURNING j."id", j."userId", j."kind", j."payload", j."attempts", j."maxAttempts"
+            """,
+            worker_id, float(JOB_VISIBILITY_TIMEOUT_SECONDS)
+        )
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    @staticmethod
+    async def heartbeat(job_id: str, worker_id: str) -> bool:
+        """Extend the lease. Returns False if the job is no longer ours."""
+        pool = await get_pg_pool()
+        status = await pool.execute(
+            """
+            UPDATE "Job"
+            SET "lockedUntil" = CURRENT_TIMESTAMP + make_interval(secs => $3), "updatedAt" = CURRENT_TIMESTAMP
+            WHERE "id" = $1 AND "lockedBy" = $2 AND "status" = 'RUNNING'
+            """,
+            job_id, worker_id, float(JOB_VISIBILITY_TIMEOUT_SECONDS)
+        )
+        # asyncpg の execute は "UPDATE <n>" を返します
+        return status.split()[-1] != "0"
+
+    @staticmethod
+    async def update_payload(job_id: str, fields: Dict[str, Any]):
+        """
+        Merge `fields` into the job's payload. Used by handlers to remember
+        side effects that must not be repeated on a retry (e.g. usage recorded).
+        """
+        pool = await get_pg_pool()
+        await pool.execute(
+            """
+            UPDATE "Job" SET "payload" = "payload" || $2::jsonb, "updatedAt" = CURRENT_TIMESTAMP
+            WHERE "id" = $1
+            """,
+            job_id, json.dumps(fields)
+        )
+
+    @staticmethod
+    async def complete(job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        pool = await get_pg_pool()
+        status = await pool.execute(
+            """
+            UPDATE "Job"
+            SET "status" = 'SUCCEEDED', "result" = $3::jsonb, "error" = NULL,
+                "lockedBy" = NULL, "lockedUntil" = NULL,
+                "updatedAt" = CURRENT_TIMESTAMP, "finishedAt" = CURRENT_TIMESTAMP
+            WHERE "id" = $1 AND "lockedBy" = $2 AND "status" = 'RUNNING'
+            """,
+            job_id, worker_id, json.dumps(result, default=str)
+        )
+        return status.split()[-1] != "0"
+
+    @staticmethod
+    async def fail(job_id: str, worker_id: str, error: str, retryable: bool = True) -> Optional[str]:
+        """
+        Record a failed attempt. Goes back to QUEUED (after an exponential
+        backoff) while attempts remain and the error is retryable, otherwise
+        FAILED. Returns the new status, or None if the lease was lost.
+        """
+        pool = await get_pg_pool()
+        return await pool.fetchval(
+            """
+            UPDATE "Job"
+            SET "status" = CASE WHEN $4 AND "attempts" < "maxAttempts" THEN 'QUEUED' ELSE 'FAILED' END,
+                "error" = $3,
+                "runAt" = CURRENT_TIMESTAMP + make_interval(secs => $5 * power(2, GREATEST("attempts" - 1, 0))),
+                "lockedBy" = NULL, "lockedUntil" = NULL,
+                "updatedAt" = CURRENT_TIMESTAMP,
+                "finishedAt" = CASE WHEN $4 AND "attempts" < "maxAttempts" THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE "id" = $1 AND "lockedBy" = $2 AND "status" = 'RUNNING'
+            RETURNING "status"
+            """,
+            job_id, worker_id, error[:2000], retryable, JOB_RETRY_BACKOFF_SECONDS
+        )
+
+    @staticmethod
+    async def get_job(job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        pool = await get_pg_pool()
+        row = await pool.fetchrow(
+            """
+            SELECT "id", "kind", "status", "result", "error", "attempts", "maxAttempts",
+                   "createdAt", "updatedAt", "finishedAt"
+            FROM "Job"
+            WHERE "id" = $1 AND "userId" = $2
+            """,
+            job_id, user_id
+        )
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+class JobWorker:
+    """
+    Polls the job table and runs claimed jobs with the registered handlers,
+    at most `concurrency` at a time. Works in-process (start()/stop() from
+    the FastAPI lifecycle) or standalone (worker.py calls run()).
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, JobHandler],
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL_SECONDS
+    ):
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stopping = asyncio.Event()
+        self._running: Set[asyncio.Task] = set()
+        self._loop_task: Optional[asyncio.Task] = None
+        self.counts: Dict[str, int] = {"claimed": 0, "succeeded": 0, "retried": 0, "failed": 0, "leaseLost": 0}
+
+    def start(self):
+        if self._loop_task is None:
+            self._stopping.clear()
+            self._loop_task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 10.0):
+        # 実行中のジョブは timeout まで待ち、それでも終わらなければキャンセルします (ロック切れ後に再実行されます)
+        self._stopping.set()
+        if self._running:
+            _, pending = await asyncio.wait(set(self._running), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._loop_task is not None:
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+    async def run(self):
+        logger.info(f"JobWorker {self.worker_id} started (concurrency={self.concurrency})")
+        while not self._stopping.is_set():
+            job = None
+            if len(self._running) < self.concurrency:
+                try:
+                    job = await JobQueue.claim(self.worker_id)
+                except Exception as e:
+                    logger.error(f"JobWorker: claim failed: {e}")
+            if job is not None:
+                self.counts["claimed"] += 1
+                task = asyncio.create_task(self._execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                continue
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        logger.info(f"JobWorker {self.worker_id} stopped: {self.stats()}")
+
+    async def _execute(self, job: Dict[str, Any]):
+        job_id, kind = job["id"], job["kind"]
+        logger.info(f"JobWorker: running job {job_id} ({kind}), attempt {job['attempts']}/{job['maxAttempts']}")
+        handler = self.handlers.get(kind)
+        if handler is None:
+            await self._record_failure(job, f"Unknown job kind: {kind}", retryable=False)
+            return
+        if job["attempts"] > job["maxAttempts"]:
+            # 最後の試行中にワーカーごと落ち、ロック切れで再取得されたジョブ
+            await self._record_failure(job, "Visibility timeout expired on the final attempt", retryable=False)
+            return
+
+        work = asyncio.create_task(handler(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, work))
+        try:
+            result = await work
+        except asyncio.CancelledError:
+            if self._stopping.is_set() or not heartbeat.done():
+                raise
+            # ロックを失った (他のワーカーが再取得した) ので結果は記録しません
+            self.counts["leaseLost"] += 1
+            logger.warning(f"JobWorker: lost the lease on job {job_id}, abandoned")
+            return
+        except (PermanentJobError, FileNotFoundError) as e:
+            await self._record_failure(job, str(e), retryable=False)
+            return
+        except HTTPException as e:
+            # 4xx (入力不正・上限超過など) は再試行しても結果が変わりません
+            await self._record_failure(job, f"{e.status_code}: {e.detail}", retryable=e.status_code >= 500)
+            return
+        except Exception as e:
+            await self._record_failure(job, str(e) or type(e).__name__, retryable=True)
+            return
+        finally:
+            heartbeat.cancel()
+
+        if await JobQueue.complete(job_id, self.worker_id, result):
+            self.counts["succeeded"] += 1
+            logger.info(f"JobWorker: job {job_id} succeeded")
+            self._cleanup_upload(job)
+        else:
+            self.counts["leaseLost"] += 1
+            logger.warning(f"JobWorker: job {job_id} finished after its lease was lost, result discarded")
+
+    async def _heartbeat(self, job_id: str, work: asyncio.Task):
+        while True:
+            await asyncio.sleep(JOB_VISIBILITY_TIMEOUT_SECONDS / 3)
+            try:
+                if not await JobQueue.heartbeat(job_id, self.worker_id):
+                    work.cancel()
+                    return
+            except Exception as e:
+                # 一時的なDBエラーでは中断せず、次の延長で再試行します
+                logger.warning(f"JobWorker: heartbeat for job {job_id} failed: {e}")
+
+    async def _record_failure(self, job: Dict[str, Any], error: str, retryable: bool):
+        logger.error(f"JobWorker: job {job['id']} failed (attempt {job['attempts']}/{job['maxAttempts']}): {error}")
+        try:
+            status = await JobQueue.fail(job["id"], self.worker_id, error, retryable=retryable)
+        except Exception as e:
+            # 記録できなくてもロック切れ後に再取得されます
+            logger.error(f"JobWorker: could not record failure of job {job['id']}: {e}")
+            return
+        if status == "QUEUED":
+            self.counts["retried"] += 1
+        elif status == "FAILED":
+            self.counts["failed"] += 1
+            self._cleanup_upload(job)
+
+    @staticmethod
+    def _cleanup_upload(job: Dict[str, Any]):
+        # 成功・最終失敗したジョブのスプールファイルは不要になります
+        path = (job["payload"].get("upload") or {}).get("path")
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, "running": len(self._running), "workerId": self.worker_id}
+
+
+# --- Handlers ---
+
+def _spooled_upload(payload: Dict[str, Any]) -> SpooledUpload:
+    info = payload["upload"]
+    if not os.path.exists(info["path"]):
+        # 別プロセスのワーカーと JOB_SPOOL_DIR を共有していない場合など
+        raise FileNotFoundError(f"Spooled upload not found: {info['path']}")
+    upload = SpooledUpload(info["path"], info["filename"], info.get("contentType"))
+    upload.size = info.get("size", 0)
+    upload.sha256 = info.get("sha256", "")
+    upload.sniffed_mime = info.get("sniffedMime", "")
+    return upload
+
+
+async def run_voice_process_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    payload = job["payload"]
+
+    async def usage_recorded():
+        # 利用時間の記録は1ジョブにつき1回だけ (リトライで二重に課金・上限チェックしないように)
+        try:
+            await JobQueue.update_payload(job["id"], {"usageRecorded": True})
+        except Exception as e:
+            logger.error(f"Could not mark usage as recorded for job {job['id']}: {e}")
+
+    return await VoiceService.process_voice_memo(
+        _spooled_upload(payload),
+        payload["metadata"],
+        payload.get("save", True),
+        record_usage=not payload.get("usageRecorded", False),
+        on_usage_recorded=usage_recorded
+    )
+
+
+async def run_import_file_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    # metadata["dbId"] は投入時に決めてあるので、リトライしても同じ Document に保存されます
+    payload = job["payload"]
+    upload = _spooled_upload(payload)
+    return await KnowledgeService.import_uploaded_file(upload.path, upload.filename, payload["mimeType"], payload["metadata"])
+
+
+JOB_HANDLERS: Dict[str, JobHandler] = {
+    "voice_process": run_voice_process_job,
+    "import_file": run_import_file_job,
+}
+
+job_worker = JobWorker(JOB_HANDLERS)
@@ -9,7 +9,6 @@ import re
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timezone, timedelta
 
-import google.generativeai as genai
 from pypdf import PdfReader
 from pptx import Presentation
 from docx import Document as DocxDocument
@@ -19,7 +18,11 @@ from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_excep
 
 from database.db import db
 from services.vector_service import VectorService
+from services.llm_gateway import llm_gateway
+from services.title_index import title_index
+from services.answer_cache import answer_cache, bump_corpus_version
 from utils.validators import validate_course_access
+from utils.upload_stream import detect_mime_type
 from services.user_service import UserService
 from services.prompts import (
     PDF_TRANSCRIPTION_PROMPT,
@@ -32,11 +35,6 @@ logger = logging.getLogger(__name__)
 # Timezone Definition
 JST = timezone(timedelta(hours=9))
 
-# Initialize Clients
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
 
 class KnowledgeService:
 
@@ -46,16 +44,7 @@ class KnowledgeService:
         python-magicを使用してファイルのMIMEタイプを検出します。
         Security: クライアントからのMIMEタイプを信頼せず、マジックバイトから判定します。
         """
-        try:
-            import magic
-            mime = magic.Magic(mime=True)
-            return mime.from_buffer(content)
-        except ImportError:
-            logger.warning("python-magic not installed, falling back to default behavior (returning empty string or handle upstream)")
-            return ""
-        except Exception as e:
-            logger.error(f"Error detecting mime type: {e}")
-            return ""
+        return detect_mime_type(content)
 
     @staticmethod
     def extract_text_from_pdf(file_content: bytes) -> str:
@@ -83,12 +72,11 @@ class KnowledgeService:
         try:
             
             logger.info("Uploading PDF to Gemini for OCR...")
-            uploaded_file = genai.upload_file(temp_filename, mime_type="application/pdf")
+            uploaded_file = await llm_gateway.upload_file(temp_filename, mime_type="application/pdf")
             
             logger.info("Generating PDF transcript...")
-            model = genai.GenerativeModel('gemini-2.0-flash')
             prompt = PDF_TRANSCRIPTION_PROMPT
-            response = model.generate_content([prompt, uploaded_file])
+            response = await llm_gateway.generate([prompt, uploaded_file], op="pdf_ocr")
             
             # Check if we have a valid response
             if not response.candidates:
@@ -134,12 +122,11 @@ class KnowledgeService:
         
         try:
             logger.info("Uploading image to Gemini...")
-            uploaded_file = genai.upload_file(temp_filename, mime_type=mime_type)
+            uploaded_file = await llm_gateway.upload_file(temp_filename, mime_type=mime_type)
             
             logger.info("Generating image description...")
-            model = genai.GenerativeModel('gemini-2.0-flash')
             prompt = IMAGE_DESCRIPTION_PROMPT
-            response = model.generate_content([prompt, uploaded_file])
+            response = await llm_gateway.generate([prompt, uploaded_file], op="image_description")
             return response.text
         finally:
             if os.path.exists(temp_filename):
@@ -176,6 +163,42 @@ class KnowledgeService:
     async def process_csv(content: bytes) -> str:
         return content.decode("utf-8")
 
+    @classmethod
+    async def extract_text(cls, content: bytes, mime_type: Optional[str], filename: str) -> str:
+        # MIMEタイプに応じてテキスト抽出処理を振り分けます (import-file の同期版・ジョブ版で共通)
+        if mime_type == "application/pdf":
+            return await cls.process_pdf(content)
+        elif mime_type and mime_type.startswith("image/"):
+            return await cls.process_image(content, mime_type, filename)
+        elif mime_type == "application/vnd.google-apps.presentation":
+            return await cls.process_pptx(content)
+        elif mime_type == "application/vnd.openxmlformats-officedocument.presentationml.presentation":
+            return await cls.process_pptx(content)
+        elif mime_type == "application/vnd.google-apps.document":
+            return await cls.process_docx(content)
+        elif mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+            return await cls.process_docx(content)
+        elif mime_type == "application/vnd.google-apps.spreadsheet":
+            return await cls.process_xlsx(content)
+        elif mime_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
+            return await cls.process_xlsx(content)
+        elif mime_type == "text/csv":
+            return await cls.process_csv(content)
+        elif mime_type and mime_type.startswith("text/"):
+            return content.decode("utf-8")
+        else:
+            # Fallback
+            return content.decode("utf-8", errors="ignore")
+
+    @classmethod
+    async def import_uploaded_file(cls, path: str, filename: str, mime_type: Optional[str], metadata: Dict[str, Any]) -> Dict[str, Any]:
+        # スプールされたアップロードからテキストを抽出して保存します (import-file の同期版・ジョブ版で共通)
+        # 各形式のパーサーはバイト列を受け取るため、ここで読み込みます
+        with open(path, "rb") as f:
+            content = f.read()
+        text = await cls.extract_text(content, mime_type, filename)
+        return await cls.process_and_save_content(text, metadata)
+
     @staticmethod
     async def process_text_file(content: bytes) -> str:
          # Fallback decode
@@ -215,6 +238,7 @@ class KnowledgeService:
                     # Prisma schema probably has @default(now())
                 }
             )
+            await KnowledgeService.mark_corpus_changed(user_id, titles_changed=True)
             logger.info(f"Created Document record (Prisma): {doc_id} in Course: {course_id}")
         except Exception as e:
             logger.error(f"Error creating Document record: {e}")
@@ -305,33 +329,14 @@ class KnowledgeService:
         logger.info(f"Generated {len(chunks)} chunks for file {file_name}")
 
         # ベクトル化とPgvectorへの保存
-        vectors = []
-        for i, chunk in enumerate(chunks):
-            vector_id = f"{user_id}#{db_id}#{i}"
-            embedding = VectorService.get_embedding(chunk)
-            
-            metadata_payload = {
-                "userId": user_id,
-                "fileId": db_id, # Use dbId as fileId for consistency
-                "dbId": db_id,   # Explicit documentId
-                "fileName": file_name,
-                "text": chunk,
-                "chunkIndex": i,
-                "tags": tags
-            }
-            
-            vectors.append({
-                "id": vector_id,
-                "values": embedding,
-                "metadata": metadata_payload
-            })
-            
-            if len(vectors) >= 100:
-                await VectorService.upsert_vectors(vectors)
-                vectors = []
-
-        if vectors:
-            await VectorService.upsert_vectors(vectors)
+        # 既存のチャンクと比較し、追加・変更されたチャンクだけをベクトル化します (新規ドキュメントなら全件)
+        await cls.reindex_document(
+            doc_id=db_id,
+            user_id=user_id,
+            chunks=chunks,
+            file_name=file_name,
+            tags=tags
+        )
 
         # 全文コンテンツをDBに保存 (UPDATE)
         # create_document_recordで作成済みなので、ここではcontent, summaryを更新
@@ -349,6 +354,103 @@ class KnowledgeService:
             "fileId": file_id
         }
 
+    @staticmethod
+    async def reindex_document(
+        doc_id: str,
+        user_id: str,
+        chunks: List[str],
+        file_name: str,
+        tags: Optional[List[str]] = None,
+        summary: Optional[str] = None
+    ) -> Dict[str, int]:
+        """
+        差分再インデックス: 保存済みチャンクと contentHash を比較し、
+        変更のないチャンクはそのまま残し、消えたチャンクは削除し、
+        新規・変更チャンクだけをベクトル化して1トランザクションで反映します。
+        Diff-based reindex: only new or modified chunks are embedded.
+        summary を渡すと要約チャンク (chunkIndex -1) も同じトランザクションで置き換えます。
+        何度実行しても結果は同じなので、ジョブのリトライでもチャンクは重複しません。
+        """
+        if tags is None:
+            tags = []
+
+        existing = await VectorService.get_chunk_hashes(doc_id, user_id)
+        # 同じ内容のチャンクが複数ある場合に備え、ハッシュごとに既存IDのリストを持ちます
+        reusable: Dict[str, List[str]] = {}
+        for row in existing:
+            if row["contentHash"]:
+                reusable.setdefault(row["contentHash"], []).append(row["id"])
+
+        keep: Dict[str, int] = {}
+        to_embed = []
+        for i, chunk in enumerate(chunks):
+            ids = reusable.get(VectorService.content_hash(chunk))
+            if ids:
+                keep[ids.pop(0)] = i
+            else:
+                to_embed.append((i, chunk))
+
+        # 要約も同じバッチに含めてまとめてベクトル化します
+        texts_to_embed = [chunk for _, chunk in to_embed] + ([summary] if summary else [])
+        embeddings = await VectorService.get_embeddings(texts_to_embed)
+        new_vectors = []
+        for (i, chunk), embedding in zip(to_embed, embeddings):
+            new_vectors.append({
+                "id": f"{user_id}#{doc_id}#{i}",
+                "values": embedding,
+                "metadata": {
+                    "userId": user_id,
+                    "fileId": doc_id, # Use dbId as fileId for consistency
+                    "dbId": doc_id,   # Explicit documentId
+                    "fileName": file_name,
+                    "text": chunk,
+                    "chunkIndex": i,
+                    "tags": tags
+                }
+            })
+        if summary:
+            new_vectors.append({
+                "id": f"{user_id}#{doc_id}#summary",
+                "values": embeddings[-1],
+                "metadata": {
+                    "userId": user_id,
+                    "fileId": doc_id,
+                    "dbId": doc_id,
+                    "fileName": file_name,
+                    "text": summary,
+                    "chunkIndex": -1,
+                    "tags": tags,
+                    "type": "summary"
+                }
+            })
+
+        result = await VectorService.apply_chunk_diff(
+            doc_id, user_id, keep, new_vectors, file_name=file_name, tags=tags,
+            replace_summary=summary is not None
+        )
+        await KnowledgeService.mark_corpus_changed(user_id)
+        logger.info(
+            f"Reindex {doc_id}: {len(chunks)} chunks, {len(new_vectors)} embedded, "
+            f"{len(keep)} unchanged, {result['deleted']} removed"
+        )
+        return result
+
+    @staticmethod
+    async def mark_corpus_changed(user_id: str, titles_changed: bool = False):
+        """
+        Call after any change to a user's searchable documents (ingestion,
+        tag/title update, delete, restore). Bumps the corpus version so cached
+        answers are no longer used, and drops the cached titles on rename.
+        """
+        if titles_changed:
+            title_index.invalidate(user_id)
+        answer_cache.invalidate_user(user_id)
+        try:
+            await bump_corpus_version(user_id)
+        except Exception as e:
+            # キャッシュの無効化に失敗しても本処理は止めません (回答キャッシュはTTLで期限切れになります)
+            logger.warning(f"Failed to bump corpus version for {user_id}: {e}")
+
     @staticmethod
     async def get_categories(user_id: str) -> List[str]:
         try:
@@ -394,6 +496,7 @@ class KnowledgeService:
                 where={"id": doc_id, "userId": user_id},
                 data={"deletedAt": None}
             )
+            await KnowledgeService.mark_corpus_changed(user_id, titles_changed=True)
             logger.info(f"Restored Document: {doc_id}")
         except Exception as e:
             logger.error(f"Error restoring document {doc_id}: {e}")
@@ -415,6 +518,7 @@ class KnowledgeService:
                 where={"id": doc_id, "userId": user_id},
                 data={"deletedAt": datetime.now(JST)}
             )
+            await KnowledgeService.mark_corpus_changed(user_id, titles_changed=True)
             logger.info(f"Soft Deleted Document: {doc_id}")
         except Exception as e:
             logger.error(f"Error soft deleting document {doc_id}: {e}")
@@ -437,6 +541,7 @@ class KnowledgeService:
             # Legacy fileId might differ, but in new logic fileId == dbId.
             # Assuming doc_id is the key used for vectors as well.
             await VectorService.delete_vectors(file_id=doc_id, user_id=user_id)
+            await KnowledgeService.mark_corpus_changed(user_id, titles_changed=True)
             
         except Exception as e:
             logger.error(f"Error deleting document {doc_id}: {e}")
@@ -471,6 +576,7 @@ class KnowledgeService:
             if tags is not None:
                 # Update Vectors
                 await VectorService.update_tags(file_id=doc_id, user_id=user_id, tags=tags)
+            await KnowledgeService.mark_corpus_changed(user_id, titles_changed=title is not None)
                 
             logger.info(f"Updated knowledge for document {doc_id}")
             
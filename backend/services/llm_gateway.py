@@ -0,0 +1,226 @@
+# Gemini (google.generativeai) 呼び出しの共通窓口
+# APIキーの設定・モデルインスタンスの再利用・ブロッキング呼び出し用のスレッドプールをここに集約し、
+# 外向きのLLM呼び出しの同時実行数と所要時間を1か所で計測・調整できるようにします。
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from services.rate_governor import RateGovernor, embedding_governor, generation_governor, is_rate_limit_error
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+if GOOGLE_API_KEY:
+    genai.configure(api_key=GOOGLE_API_KEY)
+else:
+    logger.warning("GOOGLE_API_KEY not found in environment. Gemini calls will fail.")
+
+# 回答生成・OCR・文字起こしに使うモデル
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# ブロッキングなSDK呼び出しを実行するスレッド数 (= 同時に実行される同期呼び出しの上限)
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "8"))
+# TPM バケット用の見積もり: 出力トークン数と、テキスト以外のパート (PDF・画像など) 1つあたりのトークン数
+LLM_OUTPUT_TOKEN_ESTIMATE = int(os.getenv("LLM_OUTPUT_TOKEN_ESTIMATE", "1000"))
+LLM_FILE_TOKEN_ESTIMATE = int(os.getenv("LLM_FILE_TOKEN_ESTIMATE", "2000"))
+
+
+def estimate_tokens(contents: Any) -> int:
+    # 日本語はほぼ1文字1トークンなので文字数で見積もります (実際の値は応答の usage_metadata で補正)
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    tokens = LLM_OUTPUT_TOKEN_ESTIMATE
+    for part in parts:
+        tokens += len(part) if isinstance(part, str) else LLM_FILE_TOKEN_ESTIMATE
+    return tokens
+
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) or None
+
+
+class _OpStats:
+    __slots__ = ("calls", "errors", "total_ms", "queue_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.queue_ms = 0.0
+
+
+class LLMGateway:
+    """
+    Single entry point for outbound Gemini calls.
+
+    - GenerativeModel instances are created once per (model, system
+      instruction) and reused, so they share the SDK's client.
+    - Blocking SDK calls (generate_content, upload_file, ...) run on one
+      bounded thread pool instead of the event loop or ad-hoc to_thread.
+    - Generation and embedding calls first await a permit from the RPM/TPM
+      rate governors, which slow down when Gemini answers 429.
+    - Every call is counted per operation name (calls, errors, time spent,
+      time waiting for a worker), plus current/peak in-flight calls.
+    """
+
+    def __init__(self, max_workers: int = LLM_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._models: Dict[Tuple[str, Optional[str]], genai.GenerativeModel] = {}
+        self._lock = threading.Lock()
+        self._ops: Dict[str, _OpStats] = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def model(self, system_instruction: Optional[str] = None, model_name: str = GEMINI_MODEL) -> genai.GenerativeModel:
+        key = (model_name, system_instruction)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+                self._models[key] = model
+            return model
+
+    async def run(self, op: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking SDK call on the LLM thread pool."""
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        started: List[float] = []
+
+        def call():
+            started.append(time.perf_counter())
+            return fn(*args, **kwargs)
+
+        self._enter()
+        try:
+            result = await loop.run_in_executor(self._executor, call)
+        except BaseException:
+            self._record(op, submitted, started, error=True)
+            raise
+        finally:
+            self._exit()
+        self._record(op, submitted, started)
+        return result
+
+    async def generate(
+        self,
+        contents: Any,
+        op: str = "generate",
+        system_instruction: Optional[str] = None,
+        model: Optional[Any] = None,
+        tokens: Optional[int] = None
+    ) -> Any:
+        """
+        generate_content on the pool. `model` overrides the shared instance
+        (e.g. a local fake). `tokens` overrides the TPM estimate, for parts
+        whose size the estimator cannot see (e.g. uploaded audio).
+        """
+        model = model or self.model(system_instruction)
+        estimated = tokens or estimate_tokens(contents)
+        await generation_governor.acquire(estimated)
+        try:
+            response = await self.run(op, model.generate_content, contents)
+        except Exception as e:
+            self._report_failure(generation_governor, e)
+            raise
+        generation_governor.on_success()
+        generation_governor.settle(estimated, _usage_tokens(response))
+        return response
+
+    async def stream(self, contents: Any, op: str = "stream", model: Optional[Any] = None) -> AsyncIterator[Any]:
+        """Stream generate_content_async chunks (native async, no pool thread)."""
+        model = model or self.model()
+        estimated = estimate_tokens(contents)
+        await generation_governor.acquire(estimated)
+        submitted = time.perf_counter()
+        last_chunk = None
+        self._enter()
+        try:
+            response = await model.generate_content_async(contents, stream=True)
+            async for chunk in response:
+                last_chunk = chunk
+                yield chunk
+        except BaseException as e:
+            self._record(op, submitted, [submitted], error=True)
+            if isinstance(e, Exception):
+                self._report_failure(generation_governor, e)
+            raise
+        finally:
+            self._exit()
+        self._record(op, submitted, [submitted])
+        generation_governor.on_success()
+        # 最後のチャンクに応答全体の usage_metadata が入ります
+        generation_governor.settle(estimated, _usage_tokens(last_chunk))
+
+    async def upload_file(self, path: str, mime_type: str, op: str = "upload_file") -> Any:
+        return await self.run(op, genai.upload_file, path, mime_type=mime_type)
+
+    async def embed(self, model_name: str, content: Any, task_type: str, op: str = "embed") -> Dict[str, Any]:
+        """embed_content_async (native async). `content` may be one text or a batch."""
+        await embedding_governor.acquire(estimate_tokens(content) - LLM_OUTPUT_TOKEN_ESTIMATE)
+        submitted = time.perf_counter()
+        self._enter()
+        try:
+            result = await genai.embed_content_async(model=model_name, content=content, task_type=task_type)
+        except BaseException as e:
+            self._record(op, submitted, [submitted], error=True)
+            if isinstance(e, Exception):
+                self._report_failure(embedding_governor, e)
+            raise
+        finally:
+            self._exit()
+        self._record(op, submitted, [submitted])
+        embedding_governor.on_success()
+        return result
+
+    @staticmethod
+    def _report_failure(governor: RateGovernor, error: Exception):
+        if is_rate_limit_error(error):
+            governor.on_rate_limited()
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _record(self, op: str, submitted: float, started: List[float], error: bool = False):
+        now = time.perf_counter()
+        with self._lock:
+            stats = self._ops.setdefault(op, _OpStats())
+            stats.calls += 1
+            stats.total_ms += (now - submitted) * 1000
+            if started:
+                stats.queue_ms += (started[0] - submitted) * 1000
+            if error:
+                stats.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "generationGovernor": generation_governor.stats(),
+                "embeddingGovernor": embedding_governor.stats(),
+                "maxWorkers": self.max_workers,
+                "inFlight": self.in_flight,
+                "peakInFlight": self.peak_in_flight,
+                "ops": {
+                    op: {
+                        "calls": s.calls,
+                        "errors": s.errors,
+                        "avgMs": round(s.total_ms / s.calls) if s.calls else 0,
+                        "avgQueueMs": round(s.queue_ms / s.calls) if s.calls else 0,
+                    }
+                    for op, s in self._ops.items()
+                },
+            }
+
+
+llm_gateway = LLMGateway()
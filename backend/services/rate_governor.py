@@ -0,0 +1,178 @@
+# Gemini のクォータ (RPM / TPM) に合わせて呼び出しを流量制御するトークンバケット
+# 固定の sleep の代わりに、呼び出し側は acquire() で許可を待ちます。429 が返ると自動的に流量を絞ります。
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 生成モデル (gemini-2.0-flash) のクォータ。0 はその制限なし
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "2000"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "4000000"))
+# 埋め込みモデル (text-embedding-004) のクォータ
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "1500"))
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "0"))
+# 429 を受けたときに新規の許可を止める秒数
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv("RATE_LIMIT_COOLDOWN_SECONDS", "5"))
+# バケットに溜められる量 (何秒分のクォータまで一度に使えるか)。1分分溜めると429直後にも一気に流れてしまうため数秒分に抑えます
+RATE_BURST_SECONDS = float(os.getenv("RATE_BURST_SECONDS", "5"))
+# 429 のたびに流量をこの倍率に下げ (下限 _MIN_RATE_FACTOR)、成功のたびに _RECOVERY_STEP ずつ戻します
+_BACKOFF_FACTOR = 0.5
+_MIN_RATE_FACTOR = 0.1
+_RECOVERY_STEP = 0.02
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    # google.api_core.exceptions.ResourceExhausted (HTTP 429) など
+    text = str(error)
+    return type(error).__name__ == "ResourceExhausted" or "429" in text or "Resource exhausted" in text
+
+
+class _Bucket:
+    def __init__(self, per_minute: int, burst_seconds: float = RATE_BURST_SECONDS):
+        self.rate = max(per_minute, 0) / 60.0
+        # 最低でも1回分 (RPM なら1リクエスト) は溜められるようにします
+        self.capacity = max(self.rate * burst_seconds, 1.0) if per_minute > 0 else 0.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float, rate_factor: float):
+        if self.unlimited or now <= self.updated_at:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate * rate_factor)
+        self.updated_at = now
+
+    def drain(self, resume_at: float):
+        # 429 の後は溜まっていた分を捨て、停止が明けてから補充を再開します (借り越し分はそのまま)
+        if self.unlimited:
+            return
+        self.level = min(self.level, 0.0)
+        self.updated_at = max(self.updated_at, resume_at)
+
+    def seconds_until(self, amount: float, rate_factor: float) -> float:
+        if self.unlimited or self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.rate * rate_factor)
+
+
+class RateGovernor:
+    """
+    Process-wide governor with a requests-per-minute and a
+    tokens-per-minute bucket.
+
+    acquire(tokens) waits in FIFO order until both buckets can pay for the
+    call. Token counts are estimates; settle() corrects the TPM bucket once
+    the real usage is known. Buckets hold at most `burst_seconds` of quota.
+    A 429 empties both buckets, halves the refill rate and pauses new
+    permits for a cooldown, after which permits resume at the reduced rate
+    with no burst. Each success restores the rate a little (AIMD).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm: int,
+        tpm: int,
+        cooldown_seconds: float = RATE_LIMIT_COOLDOWN_SECONDS,
+        burst_seconds: float = RATE_BURST_SECONDS
+    ):
+        self.name = name
+        self.requests = _Bucket(rpm, burst_seconds)
+        self.tokens = _Bucket(tpm, burst_seconds)
+        self.cooldown_seconds = cooldown_seconds
+        self.rate_factor = 1.0
+        self.blocked_until = 0.0
+        # asyncio.Lock は最初に待たせたイベントループに結び付くので、ループごとに作り直します
+        # (API・別プロセスのワーカー・CLI の asyncio.run など、同じガバナーを別のループから使うため)
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.waiting = 0
+        self.granted = 0
+        self.rate_limited = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Wait for a permit. Returns the time waited in ms."""
+        lock = self._get_lock()
+        # バケット容量より大きい呼び出しは満杯になるまで待ち、超過分は借り越します (永久に待たないように)
+        needed = min(tokens, self.tokens.capacity) if not self.tokens.unlimited else 0
+
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            # 先に待っている呼び出しから順に許可します (FIFO)
+            async with lock:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now, self.rate_factor)
+                    self.tokens.refill(now, self.rate_factor)
+                    delay = max(
+                        self.blocked_until - now,
+                        self.requests.seconds_until(1, self.rate_factor),
+                        self.tokens.seconds_until(needed, self.rate_factor),
+                    )
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                if not self.requests.unlimited:
+                    self.requests.level -= 1
+                if not self.tokens.unlimited:
+                    self.tokens.level -= tokens
+        finally:
+            self.waiting -= 1
+
+        waited_ms = (time.monotonic() - start) * 1000
+        self.granted += 1
+        self.total_wait_ms += waited_ms
+        self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+        if waited_ms > 1000:
+            logger.info(f"RateGovernor[{self.name}]: waited {waited_ms:.0f}ms for a permit ({self.waiting} still queued)")
+        return waited_ms
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        # 見積もりと実際のトークン数の差を TPM バケットに反映します (不足分は借り越し)
+        if actual_tokens is None or self.tokens.unlimited:
+            return
+        self.tokens.level -= actual_tokens - estimated_tokens
+
+    def on_success(self):
+        self.rate_factor = min(1.0, self.rate_factor + _RECOVERY_STEP)
+
+    def on_rate_limited(self):
+        self.rate_limited += 1
+        self.rate_factor = max(_MIN_RATE_FACTOR, self.rate_factor * _BACKOFF_FACTOR)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + self.cooldown_seconds)
+        self.requests.drain(self.blocked_until)
+        self.tokens.drain(self.blocked_until)
+        logger.warning(
+            f"RateGovernor[{self.name}]: 429 received, rate factor -> {self.rate_factor:.2f}, "
+            f"pausing {self.cooldown_seconds:.0f}s"
+        )
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queueDepth": self.waiting,
+            "granted": self.granted,
+            "rateLimited": self.rate_limited,
+            "rateFactor": round(self.rate_factor, 2),
+            "avgWaitMs": round(self.total_wait_ms / self.granted) if self.granted else 0,
+            "maxWaitMs": round(self.max_wait_ms),
+        }
+
+
+generation_governor = RateGovernor("generation", GEMINI_RPM, GEMINI_TPM)
+embedding_governor = RateGovernor("embedding", EMBEDDING_RPM, EMBEDDING_TPM)
@@ -1,11 +1,93 @@
 # Web検索機能（Tavily API）を担当するサービス
 import os
-from typing import List, Optional
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from tavily import TavilyClient
 import logging
 
+from services.embedding_cache import normalize_text
+
 logger = logging.getLogger(__name__)
 
+# 検索結果キャッシュの有効期限 (秒)。同じ授業の学生が同じ日に同じ話題を検索することが多いため
+WEB_SEARCH_CACHE_TTL_SECONDS = int(os.getenv("WEB_SEARCH_CACHE_TTL_SECONDS", "21600"))
+# キャッシュする検索結果の上限 (LRU)
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "1000"))
+
+SearchKey = Tuple[str, str]
+
+
+class WebSearchCache:
+    """
+    TTL + LRU cache of formatted Tavily results, keyed by
+    (normalized query, search depth). Each entry remembers how long the
+    upstream call took, so hits can report the latency they saved.
+    """
+
+    def __init__(self, ttl_seconds: int = WEB_SEARCH_CACHE_TTL_SECONDS, max_entries: int = WEB_SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[SearchKey, Tuple[float, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_ms = 0.0
+
+    def get(self, key: SearchKey) -> Optional[Tuple[str, float]]:
+        # Returns (result, upstream latency ms) or None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result, latency_ms = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_ms += latency_ms
+                    return result, latency_ms
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: SearchKey, result: str, latency_ms: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result, latency_ms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_coalesced(self):
+        with self._lock:
+            self.coalesced += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "savedMs": round(self.saved_ms),
+                "entries": len(self._entries),
+            }
+
+
+web_search_cache = WebSearchCache()
+# 実行中の検索 (同じキーの同時リクエストは1回の Tavily 呼び出しにまとめます)
+_in_flight: Dict[SearchKey, "asyncio.Task"] = {}
+
+
+def _finish_in_flight(key: SearchKey, task: "asyncio.Task"):
+    _in_flight.pop(key, None)
+    # 待っていた呼び出し元がすべてキャンセルされた場合でも、例外を回収して警告を出さないようにします
+    if not task.cancelled():
+        task.exception()
+
+
 class SearchService:
     def __init__(self):
         self.tavily_api_key = os.getenv("TAVILY_API_KEY")
@@ -15,42 +97,94 @@ class SearchService:
             logger.warning("[SearchService] Warning: TAVILY_API_KEY not set. Search will fail.")
             self.tavily = None
 
+    @staticmethod
+    def _search_depth(plan: str) -> str:
+        # Determine search depth based on plan
+        # FREE: basic (1 credit), OTHERS: advanced (2 credits)
+        return "basic" if plan == "FREE" else "advanced"
+
     def search(self, query: str, plan: str = "FREE") -> str:
         """
         Executes a search using Tavily (Unified for all plans).
         """
         logger.info(f"[SearchService] Searching for '{query}' with plan '{plan}' (Using Tavily)")
-        
+
         if not self.tavily:
             return "Error: TAVILY_API_KEY is missing. Please set it in .env."
 
         try:
-            # Determine search depth based on plan
-            # FREE: basic (1 credit), OTHERS: advanced (2 credits)
-            search_depth = "basic" if plan == "FREE" else "advanced"
+            search_depth = self._search_depth(plan)
             logger.info(f"[SearchService] Using search_depth='{search_depth}' for plan '{plan}'")
+            return self._fetch(query, search_depth)
+
+        except Exception as e:
+            logger.error(f"[SearchService] Error during search: {e}")
+            # セキュリティのため、詳細なエラー内容はクライアントに返却せず、汎用的なメッセージとする
+            return "Search failed due to an internal error."
+
+    async def search_async(self, query: str, plan: str = "FREE") -> str:
+        """
+        Cached, coalesced version of search for the event loop.
+        Concurrent identical searches share one upstream call. The call runs
+        in its own task, so a caller that is cancelled does not cancel it
+        for the others, and its result is still cached.
+        Errors are returned as messages (as in search) and are not cached.
+        """
+        if not self.tavily:
+            return "Error: TAVILY_API_KEY is missing. Please set it in .env."
 
-            # Tavily Search
-            # max_results=5 default
-            response = self.tavily.search(query=query, search_depth=search_depth, max_results=5)
-            
-            # Format results for RAG
-            # Response is a dict with "results": [{"title":..., "content":..., "url":...}]
-            # Tavily "content" is usually a good summary/snippet.
-            
-            results = response.get("results", [])
-            formatted_results = []
-            
-            for i, res in enumerate(results):
-                title = res.get("title", "No Title")
-                url = res.get("url", "#")
-                content = res.get("content", "")
-                formatted_results.append(f"Source {i+1}: {title} ({url})\n{content}")
-                
-            return "\n\n".join(formatted_results)
+        search_depth = self._search_depth(plan)
+        key = (normalize_text(query).lower(), search_depth)
 
+        cached = web_search_cache.get(key)
+        if cached is not None:
+            result, latency_ms = cached
+            logger.info(f"[SearchService] Cache hit ({search_depth}), saved {latency_ms:.0f}ms: {web_search_cache.stats()}")
+            return result
+
+        task = _in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_and_store(key, query, search_depth))
+            _in_flight[key] = task
+            task.add_done_callback(lambda done: _finish_in_flight(key, done))
+        else:
+            web_search_cache.record_coalesced()
+            logger.info(f"[SearchService] Joined in-flight search ({search_depth})")
+
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"[SearchService] Error during search: {e}")
             # セキュリティのため、詳細なエラー内容はクライアントに返却せず、汎用的なメッセージとする
             return "Search failed due to an internal error."
 
+    async def _fetch_and_store(self, key: SearchKey, query: str, search_depth: str) -> str:
+        logger.info(f"[SearchService] Searching for '{query}' with search_depth='{search_depth}' (Using Tavily)")
+        start = time.perf_counter()
+        result = await asyncio.to_thread(self._fetch, query, search_depth)
+        latency_ms = (time.perf_counter() - start) * 1000
+        web_search_cache.put(key, result, latency_ms)
+        logger.info(f"[SearchService] Tavily search took {latency_ms:.0f}ms: {web_search_cache.stats()}")
+        return result
+
+    def _fetch(self, query: str, search_depth: str) -> str:
+        # Tavily Search
+        # max_results=5 default
+        response = self.tavily.search(query=query, search_depth=search_depth, max_results=5)
+
+        # Format results for RAG
+        # Response is a dict with "results": [{"title":..., "content":..., "url":...}]
+        # Tavily "content" is usually a good summary/snippet.
+
+        results = response.get("results", [])
+        formatted_results: List[str] = []
+
+        for i, res in enumerate(results):
+            title = res.get("title", "No Title")
+            url = res.get("url", "#")
+            content = res.get("content", "")
+            formatted_results.append(f"Source {i+1}: {title} ({url})\n{content}")
+
+        return "\n\n".join(formatted_results)
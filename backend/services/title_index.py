@@ -0,0 +1,139 @@
+# 質問文に含まれるファイル名 (Document.title) を探すためのユーザー別インデックス
+# 毎回 Document を全件 (本文つき) 読み込む代わりに、id とタイトルだけをキャッシュして照合します。
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from database.db import get_pg_pool
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの有効期限 (秒)。フロントエンドなど他プロセスでの変更もこの時間で反映されます
+TITLE_INDEX_TTL_SECONDS = int(os.getenv("TITLE_INDEX_TTL_SECONDS", "300"))
+# キャッシュするユーザー数の上限 (LRU)
+TITLE_INDEX_MAX_USERS = int(os.getenv("TITLE_INDEX_MAX_USERS", "1000"))
+# これより短いタイトルは偶然の一致が多いので照合しません
+_MIN_TITLE_LENGTH = 2
+
+
+def normalize_title(text: str) -> str:
+    # 大文字小文字と "_" / " " の違いを無視します
+    return text.lower().replace("_", " ")
+
+
+class _UserTitles:
+    """
+    Titles of one user's documents, bucketed by their first two characters.
+    A query is matched by looking up the bucket at each position, so the
+    cost depends on the query length, not on the number of documents.
+    """
+
+    def __init__(self, rows: List[Tuple[str, str]]):
+        self.loaded_at = time.monotonic()
+        self.buckets: Dict[str, List[Tuple[str, str, str]]] = {}
+        for doc_id, title in rows:
+            if not title:
+                continue
+            norm = normalize_title(os.path.splitext(title)[0])
+            if len(norm) < _MIN_TITLE_LENGTH:
+                continue
+            self.buckets.setdefault(norm[:_MIN_TITLE_LENGTH], []).append((norm, doc_id, title))
+
+    def match(self, query: str) -> List[Dict[str, str]]:
+        norm_query = normalize_title(query)
+        hits: Dict[str, Dict[str, str]] = {}
+        for start in range(len(norm_query) - _MIN_TITLE_LENGTH + 1):
+            for norm, doc_id, title in self.buckets.get(norm_query[start:start + _MIN_TITLE_LENGTH], ()):
+                if doc_id not in hits and norm_query.startswith(norm, start):
+                    hits[doc_id] = {"id": doc_id, "title": title}
+        return list(hits.values())
+
+
+class TitleIndex:
+    """
+    Per-user cache of (id, title) for live documents.
+    Entries expire after TITLE_INDEX_TTL_SECONDS and are dropped explicitly
+    (invalidate) when this process creates, renames or deletes a document.
+    """
+
+    def __init__(self, ttl_seconds: int = TITLE_INDEX_TTL_SECONDS, max_users: int = TITLE_INDEX_MAX_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._entries: "OrderedDict[str, _UserTitles]" = OrderedDict()
+        # 読み込み中に invalidate された場合、古い結果をキャッシュしないための世代番号
+        # 読み込み中のユーザーの分だけ保持し、最後の読み込みが終わったら削除します (無制限に増えないように)
+        self._generations: Dict[str, int] = {}
+        self._loading: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    async def match(self, user_id: str, query: str) -> List[Dict[str, str]]:
+        """Return [{"id", "title"}] of documents whose title appears in the query."""
+        titles = self._get(user_id)
+        if titles is None:
+            titles = await self._load(user_id)
+        return titles.match(query)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            if user_id in self._loading:
+                self._generations[user_id] += 1
+
+    def _get(self, user_id: str):
+        with self._lock:
+            titles = self._entries.get(user_id)
+            if titles is None:
+                return None
+            if time.monotonic() - titles.loaded_at > self.ttl_seconds:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return titles
+
+    async def _load(self, user_id: str) -> _UserTitles:
+        with self._lock:
+            generation = self._generations.setdefault(user_id, 0)
+            self._loading[user_id] = self._loading.get(user_id, 0) + 1
+            self.loads += 1
+
+        try:
+            pool = await get_pg_pool()
+            rows = await pool.fetch(
+                'SELECT "id", "title" FROM "Document" WHERE "userId" = $1 AND "deletedAt" IS NULL',
+                user_id
+            )
+            titles = _UserTitles([(row['id'], row['title']) for row in rows])
+
+            with self._lock:
+                if self._generations[user_id] == generation:
+                    self._entries[user_id] = titles
+                    self._entries.move_to_end(user_id)
+                    while len(self._entries) > self.max_users:
+                        self._entries.popitem(last=False)
+        finally:
+            with self._lock:
+                self._loading[user_id] -= 1
+                if not self._loading[user_id]:
+                    del self._loading[user_id]
+                    del self._generations[user_id]
+        logger.info(f"TitleIndex: loaded {len(rows)} titles for user {user_id[:6]}...")
+        return titles
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.loads
+            return {
+                "hits": self.hits,
+                "loads": self.loads,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "users": len(self._entries),
+            }
+
+
+title_index = TitleIndex()
@@ -0,0 +1,121 @@
+# 音声の文字起こし結果をセグメントごとに保存するチェックポイント ("TranscriptSegment" テーブル)
+# key = (アップロードの SHA-256, 分割方法, セグメント番号)。
+# セグメントが終わるたびに保存し、リトライや同じ音声の再送信では保存済みのセグメントを再利用します。
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict
+
+from database.db import get_pg_pool
+
+logger = logging.getLogger(__name__)
+
+# チェックポイントを使うかどうか (ローカル開発などで無効化できるように)
+TRANSCRIPT_CHECKPOINT_ENABLED = os.getenv("TRANSCRIPT_CHECKPOINT_ENABLED", "true").lower() == "true"
+# 保存したセグメントの保持期間 (日)。prune で古いものから削除します
+TRANSCRIPT_CHECKPOINT_TTL_DAYS = int(os.getenv("TRANSCRIPT_CHECKPOINT_TTL_DAYS", "30"))
+
+
+class TranscriptCheckpoints:
+    """
+    Per-segment transcript store, content-addressed by the upload hash.
+    `layout` describes how the audio was split (e.g. "fixed:600:t1200"), so
+    segment i is only reused when it covers the same span of the same audio.
+    Only successful transcripts are stored. Failed segments are transcribed
+    again next time. Store failures never fail the transcription itself.
+    """
+
+    def __init__(self, enabled: bool = TRANSCRIPT_CHECKPOINT_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.saved = 0
+        self.errors = 0
+
+    async def load(self, upload_hash: str, layout: str) -> Dict[int, str]:
+        """Return {segment index: transcript} for the stored segments."""
+        if not self.enabled or not upload_hash:
+            return {}
+        try:
+            pool = await get_pg_pool()
+            rows = await pool.fetch(
+                """
+                SELECT "segmentIndex", "transcript" FROM "TranscriptSegment"
+                WHERE "uploadHash" = $1 AND "layout" = $2
+                """,
+                upload_hash, layout
+            )
+        except Exception as e:
+            self._count_error()
+            logger.warning(f"TranscriptCheckpoints: lookup failed: {e}")
+            return {}
+        with self._lock:
+            self.reused += len(rows)
+        return {row["segmentIndex"]: row["transcript"] for row in rows}
+
+    async def save(self, upload_hash: str, layout: str, segment_index: int, transcript: str):
+        if not self.enabled or not upload_hash:
+            return
+        try:
+            pool = await get_pg_pool()
+            await pool.execute(
+                """
+                INSERT INTO "TranscriptSegment" ("uploadHash", "layout", "segmentIndex", "transcript", "createdAt")
+                VALUES ($1, $2, $3, $4, NOW())
+                ON CONFLICT ("uploadHash", "layout", "segmentIndex")
+                DO UPDATE SET "transcript" = EXCLUDED."transcript", "createdAt" = EXCLUDED."createdAt"
+                """,
+                upload_hash, layout, segment_index, transcript
+            )
+        except Exception as e:
+            self._count_error()
+            logger.warning(f"TranscriptCheckpoints: write failed for segment {segment_index}: {e}")
+            return
+        with self._lock:
+            self.saved += 1
+
+    async def prune(self, ttl_days: int = TRANSCRIPT_CHECKPOINT_TTL_DAYS) -> str:
+        # 古いチェックポイントを削除します (メンテナンス用)
+        pool = await get_pg_pool()
+        result = await pool.execute(
+            """DELETE FROM "TranscriptSegment" WHERE "createdAt" < NOW() - make_interval(days => $1)""",
+            ttl_days
+        )
+        logger.info(f"TranscriptCheckpoints: pruned segments older than {ttl_days} days ({result})")
+        return result
+
+    def _count_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"reused": self.reused, "saved": self.saved, "errors": self.errors}
+
+
+transcript_checkpoints = TranscriptCheckpoints()
+
+
+if __name__ == "__main__":
+    # メンテナンスコマンド:
+    #   python -m services.transcript_checkpoint prune [--ttl-days N]
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="TranscriptSegment checkpoint maintenance")
+    parser.add_argument("command", choices=["prune"])
+    parser.add_argument("--ttl-days", type=int, default=TRANSCRIPT_CHECKPOINT_TTL_DAYS)
+    args = parser.parse_args()
+
+    async def _main():
+        from database.db import close_pg_pool
+        try:
+            await transcript_checkpoints.prune(args.ttl_days)
+        finally:
+            await close_pg_pool()
+
+    asyncio.run(_main())
@@ -187,6 +187,20 @@ class UserService:
         if count >= limit:
              raise HTTPException(status_code=403, detail=f"Storage limit reached for {plan} plan. Limit: {limit} files.")
 
+    @staticmethod
+    def get_upload_size_limit(plan: str, kind: str = "file") -> int:
+        """
+        アップロード1件あたりのサイズ上限 (バイト) を返します。kind は "voice" または "file"。
+        Returns the per-upload size limit in bytes for the plan.
+        """
+        # MB 単位。音声はプランの録音時間上限 (20分 / 90分 / 180分) に見合う大きさ
+        LIMITS = {
+            "voice": {"FREE": 100, "STANDARD": 300, "STANDARD_TRIAL": 300, "PREMIUM": 600},
+            "file": {"FREE": 20, "STANDARD": 50, "STANDARD_TRIAL": 50, "PREMIUM": 100},
+        }
+        limits = LIMITS.get(kind, LIMITS["file"])
+        return limits.get(plan, limits["FREE"]) * 1024 * 1024
+
     @staticmethod
     async def process_referral_reward(user_id: str):
         """
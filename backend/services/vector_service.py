@@ -1,18 +1,65 @@
 # データのベクトル化、保存・検索を担当するサービス
+import asyncio
+import hashlib
+import json
 import logging
 import os
-from typing import List, Dict, Any, Optional
-import google.generativeai as genai
+import re
+import time
+from functools import lru_cache
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from database.db import db
+from database.db import db, get_pg_pool
+from database.vector_codec import Vector, VectorLike
+from services.embedding_cache import embedding_cache, make_key, normalize_text
+from services.llm_gateway import llm_gateway
+from utils.text_chunker import TextChunker
 
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini for Embeddings
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
+# 接続先の pgvector が hnsw.iterative_scan に対応しているか (初回の検索で確認)
+_iterative_scan_supported: Optional[bool] = None
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+# batchEmbedContents は1リクエストあたり最大100件まで受け付けます
+EMBEDDING_BATCH_SIZE = min(int(os.getenv("EMBEDDING_BATCH_SIZE", "100")), 100)
+# 同時に投げるバッチ数の上限 (クォータに合わせて調整)
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# 1回のINSERT文で書き込むチャンク数
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "500"))
+
+# ANNインデックス (prisma/migrations/*_add_document_chunk_hnsw_index)
+VECTOR_INDEX_NAME = "DocumentChunk_embedding_hnsw_idx"
+# 検索時の精度/速度のトレードオフ。未設定ならサーバーのデフォルト (hnsw.ef_search=40)
+VECTOR_EF_SEARCH = int(os.getenv("VECTOR_EF_SEARCH", "100")) or None
+VECTOR_PROBES = int(os.getenv("VECTOR_PROBES", "0")) or None
+# "relaxed_order" / "strict_order" (pgvector 0.8+)。"off" または空なら無効
+# userId で絞り込むと HNSW の候補 (ef_search 件) の大半が除外され、top_k 件に満たず再現率が落ちるため既定で有効にします
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "relaxed_order")
+# iterative scan が使えない (無効・pgvector 0.8 未満) ときに、絞り込み付きの検索で使う ef_search
+VECTOR_FILTERED_EF_SEARCH = int(os.getenv("VECTOR_FILTERED_EF_SEARCH", "400"))
+
+# ハイブリッド検索 (語句一致 + ベクトル) の設定
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_MIN_TERM_LENGTH = 2
+# pg_trgm の GIN インデックスが ILIKE '%term%' に使えるのは3文字以上の語句だけです。
+# 2文字の語句 (「行列」「微分」など) は絞り込みには使わず、絞り込んだ行のスコアにだけ加えます (全件走査を避けるため)
+LEXICAL_MIN_INDEXED_TERM_LENGTH = 3
+LEXICAL_MAX_TERMS = 8
+LEXICAL_TERM_PATTERN = re.compile(r"[\u4e00-\u9fff\u3005\u3006\u30f5\u30f6]+|[\u30a0-\u30ff]+|[A-Za-z0-9][A-Za-z0-9_.\-]*")
+
+BULK_INSERT_CHUNKS_SQL = """
+    INSERT INTO "DocumentChunk"
+    ("id", "userId", "fileId", "fileName", "content", "chunkIndex", "tags", "type", "documentId", "embedding", "contentHash", "createdAt")
+    SELECT
+        gen_random_uuid(), r.user_id, r.file_id, r.file_name, r.content, r.chunk_index,
+        ARRAY(SELECT jsonb_array_elements_text(r.tags)), r.type, r.document_id, r.embedding, r.content_hash, NOW()
+    FROM unnest(
+        $1::text[], $2::text[], $3::text[], $4::text[], $5::int[],
+        $6::jsonb[], $7::text[], $8::text[], $9::vector[], $10::text[]
+    ) AS r(user_id, file_id, file_name, content, chunk_index, tags, type, document_id, embedding, content_hash)
+"""
 
 
 class VectorService:
@@ -20,180 +67,528 @@ class VectorService:
     データのベクトル化と保存・検索を担当するサービス
     """
 
+    @staticmethod
+    async def get_embedding_async(text: str) -> List[float]:
+        """
+        Embed one text (query embedding for search and intent classification).
+        Uses the SDK's async client, and tenacity awaits asyncio.sleep between
+        retries, so a slow or failing call never blocks the event loop.
+        Checks the embedding cache (memory, then Postgres) first.
+        """
+        embeddings = await VectorService.get_embeddings([text])
+        return embeddings[0]
+
     @staticmethod
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=2, max=10),
         retry=retry_if_exception_type(Exception)
     )
-    def get_embedding(text: str) -> List[float]:
-        # 与えられたテキストのベクトル埋め込み (Embedding) をGeminiを使って生成します。
-        # ベクトル化することで、テキストの意味に基づいた検索 (Semantic Search) が可能になります。
+    async def _embed_batch(clean_texts: List[str]) -> List[List[float]]:
+        # 1回のAPI呼び出しで複数チャンクをまとめてベクトル化します (batchEmbedContents)
         try:
-            # テキストを少しクリーニングして、改行コードによる不具合を防ぎます
-            clean_text = text.replace("\n", " ")
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=clean_text,
+            result = await llm_gateway.embed(
+                EMBEDDING_MODEL,
+                clean_texts,
                 task_type="retrieval_document"
             )
             return result['embedding']
         except Exception as e:
-            logger.error(f"Error generating embedding: {e}")
+            logger.error(f"Error generating batch embedding ({len(clean_texts)} texts): {e}")
             raise e
 
+    @staticmethod
+    async def get_embeddings(texts: List[str], concurrency: Optional[int] = None) -> List[List[float]]:
+        """
+        Embed many texts at once.
+        Cached texts are served from the embedding cache. The rest are
+        de-duplicated, packed into batches of EMBEDDING_BATCH_SIZE and the
+        batches run concurrently (up to `concurrency`, default EMBEDDING_CONCURRENCY).
+        Returns embeddings in the same order as `texts`.
+        """
+        if not texts:
+            return []
+
+        clean_texts = [normalize_text(text) for text in texts]
+        keys = [make_key(clean_text, EMBEDDING_MODEL) for clean_text in clean_texts]
+        found = await embedding_cache.get_many(keys)
+
+        # キャッシュに無いテキストだけを (重複を除いて) ベクトル化します
+        pending: Dict[str, str] = {}
+        for key, clean_text in zip(keys, clean_texts):
+            if key not in found and key not in pending:
+                pending[key] = clean_text
+
+        if pending:
+            embedding_cache.record_misses(len(pending))
+            pending_keys = list(pending.keys())
+            pending_texts = list(pending.values())
+            batches = [
+                pending_texts[i:i + EMBEDDING_BATCH_SIZE]
+                for i in range(0, len(pending_texts), EMBEDDING_BATCH_SIZE)
+            ]
+            semaphore = asyncio.Semaphore(concurrency or EMBEDDING_CONCURRENCY)
+
+            async def embed(batch: List[str]) -> List[List[float]]:
+                async with semaphore:
+                    return await VectorService._embed_batch(batch)
+
+            results = await asyncio.gather(*(embed(batch) for batch in batches))
+            new_embeddings = dict(zip(pending_keys, (e for batch in results for e in batch)))
+            await embedding_cache.put_many(new_embeddings, EMBEDDING_MODEL)
+            found.update(new_embeddings)
+            logger.info(f"Generated {len(pending)} embeddings in {len(batches)} batches")
+
+        stats = embedding_cache.stats()
+        logger.info(
+            f"Embedding cache: {len(texts) - len(pending)}/{len(texts)} hits this call, "
+            f"hit rate {stats['hitRate']:.1%} (memory {stats['memoryHits']}, db {stats['dbHits']}, miss {stats['misses']})"
+        )
+        return [found[key] for key in keys]
+
     @staticmethod
     async def upsert_vectors(vectors: List[Dict[str, Any]]):
         """
         Upsert vectors and metadata to Supabase (Postgres) via DocumentChunk table.
         vectors: List of dicts with 'values' (embedding), 'metadata' (dict)
+
+        Rows are sent UPSERT_BATCH_SIZE at a time as one multi-row INSERT
+        (column arrays + unnest) over a pooled asyncpg connection, all inside
+        a single transaction.
         """
         if not vectors:
             return
 
         try:
-           
-            values_list = []
-            params = []
-            
-          
-            count = 0
-            for vec in vectors:
-                embedding = vec['values'] # List[float]
-                meta = vec['metadata']
-                
-                # Extract metadata fields
-                user_id = meta.get('userId')
-                file_id = meta.get('fileId')
-                file_name = meta.get('fileName')
-                text = meta.get('text', '')
-                chunk_index = meta.get('chunkIndex', 0)
-                tags = meta.get('tags', [])
-                doc_type = meta.get('type', 'transcript')
-                
-                # dbId in metadata -> documentId
-                document_id = meta.get('dbId') 
-                
-                # Format vector for Postgres pgvector: '[1,2,3]'
-                vector_str = f"[{','.join(map(str, embedding))}]"
-                
-                # Insert
-                query = """
-                    INSERT INTO "DocumentChunk" 
-                    ("id", "userId", "fileId", "fileName", "content", "chunkIndex", "tags", "type", "documentId", "embedding", "createdAt")
-                    VALUES (gen_random_uuid(), $1, $2, $3, $4, $5, $6, $7, $8, $9::vector, NOW())
-                """
-                
-                # tags (List[str]) -> Postgres Array
-                # Prisma execute_raw params handling: List[str] usually maps to ARRAY.
-                
-                await db.execute_raw(
-                    query,
-                    user_id,
-                    file_id,
-                    file_name,
-                    text,
-                    chunk_index,
-                    tags,
-                    doc_type,
-                    document_id,
-                    vector_str 
-                )
-                count += 1
-                
-            logger.info(f"Successfully inserted {count} chunks to Supabase Vector.")
+            start_time = time.perf_counter()
+            pool = await get_pg_pool()
+
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    count = await VectorService._insert_vectors(conn, vectors)
+
+            elapsed = time.perf_counter() - start_time
+            rows_per_sec = count / elapsed if elapsed > 0 else float(count)
+            logger.info(
+                f"Successfully inserted {count} chunks to Supabase Vector "
+                f"in {elapsed * 1000:.1f}ms ({rows_per_sec:.0f} rows/s)."
+            )
 
         except Exception as e:
             logger.error(f"Error upserting vectors to Supabase: {e}")
             raise e
 
+    @staticmethod
+    async def _insert_vectors(conn, vectors: List[Dict[str, Any]]) -> int:
+        # 呼び出し側のトランザクション内で UPSERT_BATCH_SIZE 件ずつ一括INSERTします
+        count = 0
+        for offset in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            batch = vectors[offset:offset + UPSERT_BATCH_SIZE]
+            columns = VectorService._to_chunk_columns(batch)
+            await conn.execute(BULK_INSERT_CHUNKS_SQL, *columns)
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        # チャンク本文のハッシュ (差分再インデックスで変更有無の判定に使用)
+        # migration の sha256(convert_to(content, 'UTF8')) と同じ値になります
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    async def get_chunk_hashes(document_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """
+        Return id / chunkIndex / contentHash of a document's body chunks
+        (the summary chunk, chunkIndex -1, is not included).
+        """
+        pool = await get_pg_pool()
+        rows = await pool.fetch(
+            """
+            SELECT id, "chunkIndex", "contentHash" FROM "DocumentChunk"
+            WHERE "documentId" = $1 AND "userId" = $2 AND "chunkIndex" >= 0
+            ORDER BY "chunkIndex"
+            """,
+            document_id,
+            user_id
+        )
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    async def apply_chunk_diff(
+        document_id: str,
+        user_id: str,
+        keep: Dict[str, int],
+        new_vectors: List[Dict[str, Any]],
+        file_name: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        replace_summary: bool = False
+    ) -> Dict[str, int]:
+        """
+        Apply a chunk diff for one document in a single transaction.
+        keep: {chunk id: new chunkIndex} for unchanged chunks to keep.
+        Kept chunks also get the current file_name / tags (when given).
+        Body chunks not in `keep` are deleted and `new_vectors` are inserted.
+        With replace_summary, the summary chunk (chunkIndex -1) is deleted too
+        (new_vectors then carries the new one).
+        """
+        try:
+            pool = await get_pg_pool()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    # 同じドキュメントへの同時再インデックスを直列化します
+                    await conn.execute('SELECT 1 FROM "Document" WHERE id = $1 FOR UPDATE', document_id)
+
+                    deleted = await conn.execute(
+                        """
+                        DELETE FROM "DocumentChunk"
+                        WHERE "documentId" = $1 AND "userId" = $2
+                          AND (("chunkIndex" >= 0 AND NOT (id = ANY($3::text[])))
+                               OR ($4 AND "chunkIndex" < 0))
+                        """,
+                        document_id,
+                        user_id,
+                        list(keep.keys()),
+                        replace_summary
+                    )
+                    if keep:
+                        # 残すチャンクは chunkIndex と、ファイル名・タグを最新の値に揃えます (変わった行だけ更新)
+                        await conn.execute(
+                            """
+                            UPDATE "DocumentChunk" AS c
+                            SET "chunkIndex" = k.idx,
+                                "fileName" = COALESCE($3, c."fileName"),
+                                "tags" = COALESCE($4::text[], c."tags")
+                            FROM unnest($1::text[], $2::int[]) AS k(id, idx)
+                            WHERE c.id = k.id
+                              AND (c."chunkIndex" <> k.idx
+                                   OR c."fileName" IS DISTINCT FROM COALESCE($3, c."fileName")
+                                   OR c."tags" IS DISTINCT FROM COALESCE($4::text[], c."tags"))
+                            """,
+                            list(keep.keys()),
+                            list(keep.values()),
+                            file_name,
+                            tags
+                        )
+                    inserted = await VectorService._insert_vectors(conn, new_vectors)
+
+            # asyncpg の execute は "DELETE <n>" を返します
+            deleted_count = int(deleted.split()[-1])
+            logger.info(
+                f"Reindexed document {document_id}: kept {len(keep)}, "
+                f"deleted {deleted_count}, inserted {inserted} chunks."
+            )
+            return {"kept": len(keep), "deleted": deleted_count, "inserted": inserted}
+
+        except Exception as e:
+            logger.error(f"Error applying chunk diff for document {document_id}: {e}")
+            raise e
+
+    @staticmethod
+    def _to_chunk_columns(vectors: List[Dict[str, Any]]) -> List[List[Any]]:
+        # 行のリストを列ごとの配列に変換します (unnest で一括INSERTするため)
+        user_ids, file_ids, file_names, texts, hashes = [], [], [], [], []
+        chunk_indexes, tags_json, doc_types, document_ids, embeddings = [], [], [], [], []
+
+        for vec in vectors:
+            meta = vec['metadata']
+            user_ids.append(meta.get('userId'))
+            file_ids.append(meta.get('fileId'))
+            file_names.append(meta.get('fileName'))
+            texts.append(meta.get('text', ''))
+            hashes.append(VectorService.content_hash(meta.get('text', '')))
+            chunk_indexes.append(meta.get('chunkIndex', 0))
+            # tags は行ごとに長さが違うため、2次元配列ではなくJSONで渡します
+            tags_json.append(json.dumps(meta.get('tags', []), ensure_ascii=False))
+            doc_types.append(meta.get('type', 'transcript'))
+            # dbId in metadata -> documentId
+            document_ids.append(meta.get('dbId'))
+            # list / np.ndarray / array('f') のまま渡し、バイナリコーデックでエンコードします
+            embeddings.append(Vector(vec['values']))
+
+        return [
+            user_ids, file_ids, file_names, texts, chunk_indexes,
+            tags_json, doc_types, document_ids, embeddings, hashes
+        ]
+
     @staticmethod
     async def search_vectors(
-        query_embedding: List[float], 
+        query_embedding: VectorLike, 
         top_k: int = 20, 
-        filter: Optional[Dict[str, Any]] = None
+        filter: Optional[Dict[str, Any]] = None,
+        ef_search: Optional[int] = VECTOR_EF_SEARCH,
+        probes: Optional[int] = VECTOR_PROBES,
+        query_text: Optional[str] = None,
+        mode: str = "vector"
     ) -> Dict[str, Any]:
         """
         Search vectors in DocumentChunk using cosine distance.
+        query_embedding may be a list of floats, a NumPy array or an array('f');
+        it is sent in pgvector's binary format.
+        ef_search (HNSW) / probes (IVFFlat) trade speed for recall on this query
+        only; None keeps the server default.
+        mode="hybrid" also runs a pg_trgm lexical query for query_text at the same
+        time and merges both rankings with reciprocal rank fusion (RRF).
         Returns: { 'matches': [ {'id': ..., 'score': ..., 'metadata': ...} ] }
         """
         try:
-            vector_str = f"[{','.join(map(str, query_embedding))}]"
-            
-            # Construct Filter Clause
-            
-            where_clauses = []
-            params = [vector_str, top_k] # $1=vector, $2=limit
-            param_idx = 3
-            
-            if filter:
-                if 'userId' in filter:
-                    where_clauses.append(f'"userId" = ${param_idx}')
-                    params.append(filter['userId'])
-                    param_idx += 1
-                    
-                if 'tags' in filter:
-                    # Handle MongoDB-style "$in" if present
-                    tag_filter = filter['tags']
-                    if isinstance(tag_filter, dict) and '$in' in tag_filter:
-                        # Postgres array overlap: "tags" && ARRAY[...]
-                        # If query tags is ['a', 'b'], we want docs that have 'a' OR 'b'.
-                        tags_list = tag_filter['$in']
-                        where_clauses.append(f'"tags" && ${param_idx}')
-                        params.append(tags_list)
-                        param_idx += 1
-                    elif isinstance(tag_filter, list):
-                        # Simple list usually implies exact match or containment? 
-                        # Let's assume overlap for array column.
-                        where_clauses.append(f'"tags" && ${param_idx}')
-                        params.append(tag_filter)
-                        param_idx += 1
-            
-            where_sql = ""
-            if where_clauses:
-                where_sql = "WHERE " + " AND ".join(where_clauses)
-            
-            # Query ordering by cosine distance (<=>)
-            # 1 - (embedding <=> query) is cosine similarity if normalized?
-            # pgvector <=> operator returns cosine distance (0..2). 
-            # Similarity = 1 - distance (approx).
-            
-            sql = f"""
-                SELECT 
-                    id, 
-                    "userId", "fileId", "fileName", "content", "chunkIndex", "tags", "type", "documentId",
-                    1 - (embedding <=> $1::vector) as score
-                FROM "DocumentChunk"
-                {where_sql}
-                ORDER BY embedding <=> $1::vector
-                LIMIT $2
-            """
-            
-            # Execute
-            rows = await db.query_raw(sql, *params)
-            
+            if mode == "hybrid" and query_text:
+                vector_rows, lexical_rows = await asyncio.gather(
+                    VectorService._search_vector_rows(query_embedding, top_k, filter, ef_search, probes),
+                    VectorService._search_lexical_rows(query_text, top_k, filter)
+                )
+                return {"matches": VectorService._fuse_rankings(vector_rows, lexical_rows, top_k)}
+
+            rows = await VectorService._search_vector_rows(query_embedding, top_k, filter, ef_search, probes)
             matches = []
             for row in rows:
-                matches.append({
-                    "id": row['id'],
-                    "score": float(row['score']),
-                    "metadata": {
-                        "userId": row['userId'],
-                        "fileId": row['fileId'],
-                        "fileName": row['fileName'],
-                        "text": row['content'],
-                        "chunkIndex": row['chunkIndex'],
-                        "tags": row['tags'],
-                        "type": row['type'],
-                        "dbId": row['documentId']
-                    }
-                })
+                match = VectorService._row_to_match(row)
+                match["score"] = float(row['score'])
+                match["vectorScore"] = match["score"]
+                matches.append(match)
                 
             return {"matches": matches}
 
         except Exception as e:
             logger.error(f"Error searching vectors in Supabase: {e}")
             raise e
+
+    @staticmethod
+    def _build_filter_sql(filter: Optional[Dict[str, Any]], params: List[Any]) -> str:
+        # filter から WHERE 句を組み立て、パラメータを params に追加します
+        where_clauses = []
+        
+        if filter:
+            if 'userId' in filter:
+                params.append(filter['userId'])
+                where_clauses.append(f'"userId" = ${len(params)}')
+                
+            if 'tags' in filter:
+                # Handle MongoDB-style "$in" if present
+                tag_filter = filter['tags']
+                if isinstance(tag_filter, dict) and '$in' in tag_filter:
+                    # Postgres array overlap: "tags" && ARRAY[...]
+                    # If query tags is ['a', 'b'], we want docs that have 'a' OR 'b'.
+                    params.append(tag_filter['$in'])
+                    where_clauses.append(f'"tags" && ${len(params)}')
+                elif isinstance(tag_filter, list):
+                    # Simple list usually implies exact match or containment? 
+                    # Let's assume overlap for array column.
+                    params.append(tag_filter)
+                    where_clauses.append(f'"tags" && ${len(params)}')
+        
+        return " AND ".join(where_clauses)
+
+    @staticmethod
+    async def _search_vector_rows(
+        query_embedding: VectorLike,
+        top_k: int,
+        filter: Optional[Dict[str, Any]],
+        ef_search: Optional[int],
+        probes: Optional[int]
+    ) -> List[Any]:
+        params = [query_embedding, top_k] # $1=vector, $2=limit
+        filter_sql = VectorService._build_filter_sql(filter, params)
+        where_sql = f"WHERE {filter_sql}" if filter_sql else ""
+        
+        # Query ordering by cosine distance (<=>)
+        # pgvector <=> operator returns cosine distance (0..2). 
+        # Similarity = 1 - distance (approx).
+        sql = f"""
+            SELECT 
+                id, 
+                "userId", "fileId", "fileName", "content", "chunkIndex", "tags", "type", "documentId",
+                1 - (embedding <=> $1::vector) as score
+            FROM "DocumentChunk"
+            {where_sql}
+            ORDER BY embedding <=> $1::vector
+            LIMIT $2
+        """
+        
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            # SET LOCAL 相当の設定はトランザクション内でのみ有効なので、検索ごとに囲みます
+            async with conn.transaction():
+                await VectorService._apply_search_settings(conn, ef_search, probes, filtered=bool(filter_sql))
+                rows = await conn.fetch(sql, *params)
+        # relaxed_order では距離の順序が多少前後することがあるので並べ直します
+        return sorted(rows, key=lambda row: row["score"], reverse=True)
+
+    @staticmethod
+    def extract_search_terms(text: str) -> List[str]:
+        """
+        Pull lexical search terms out of a Japanese/English query without a
+        morphological analyzer: runs of kanji, katakana and ASCII words/codes
+        (e.g. "線形代数", "フーリエ", "MATH101"). Hiragana runs are mostly
+        particles and are dropped.
+        """
+        terms = []
+        for term in LEXICAL_TERM_PATTERN.findall(text or ""):
+            term = term.lower()
+            if len(term) >= LEXICAL_MIN_TERM_LENGTH and term not in terms:
+                terms.append(term)
+        return terms[:LEXICAL_MAX_TERMS]
+
+    @staticmethod
+    async def _search_lexical_rows(
+        query_text: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]]
+    ) -> List[Any]:
+        terms = VectorService.extract_search_terms(query_text)
+        indexed_terms = [term for term in terms if len(term) >= LEXICAL_MIN_INDEXED_TERM_LENGTH]
+        if not indexed_terms:
+            # 短い語句だけの質問はベクトル検索に任せます
+            return []
+
+        params: List[Any] = [terms, top_k] # $1=terms, $2=limit
+        filter_sql = VectorService._build_filter_sql(filter, params)
+
+        # 3文字以上の語句を ILIKE '%term%' の OR 条件に展開し、pg_trgm の GIN インデックスを使わせます
+        term_clauses = []
+        for term in indexed_terms:
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+            term_clauses.append(f'"content" ILIKE ${len(params)} OR "fileName" ILIKE ${len(params)}')
+        where_sql = f"WHERE ({' OR '.join(term_clauses)})"
+        if filter_sql:
+            where_sql += f" AND {filter_sql}"
+
+        # スコア: 本文に含まれる語句数 + ファイル名に含まれる語句数 (2文字の語句も数えます)
+        sql = f"""
+            SELECT 
+                id, 
+                "userId", "fileId", "fileName", "content", "chunkIndex", "tags", "type", "documentId",
+                (
+                    SELECT count(*) FROM unnest($1::text[]) AS t(term)
+                    WHERE strpos(lower("content"), t.term) > 0
+                ) + (
+                    SELECT count(*) FROM unnest($1::text[]) AS t(term)
+                    WHERE strpos(lower(coalesce("fileName", '')), t.term) > 0
+                ) as score
+            FROM "DocumentChunk"
+            {where_sql}
+            ORDER BY score DESC, "chunkIndex"
+            LIMIT $2
+        """
+
+        pool = await get_pg_pool()
+        return await pool.fetch(sql, *params)
+
+    @staticmethod
+    def _fuse_rankings(vector_rows: List[Any], lexical_rows: List[Any], top_k: int) -> List[Dict[str, Any]]:
+        # Reciprocal Rank Fusion: score = Σ 1 / (k + rank)
+        fused: Dict[str, Dict[str, Any]] = {}
+        for source, rows in (("vectorScore", vector_rows), ("lexicalScore", lexical_rows)):
+            for rank, row in enumerate(rows, start=1):
+                match = fused.get(row['id'])
+                if match is None:
+                    match = VectorService._row_to_match(row)
+                    match["score"] = 0.0
+                    fused[row['id']] = match
+                match["score"] += 1.0 / (RRF_K + rank)
+                match[source] = float(row['score'])
+
+        ranked = sorted(fused.values(), key=lambda m: m["score"], reverse=True)
+        return ranked[:top_k]
+
+    @staticmethod
+    def _row_to_match(row: Any) -> Dict[str, Any]:
+        return {
+            "id": row['id'],
+            "metadata": {
+                "userId": row['userId'],
+                "fileId": row['fileId'],
+                "fileName": row['fileName'],
+                "text": row['content'],
+                "chunkIndex": row['chunkIndex'],
+                "tags": row['tags'],
+                "type": row['type'],
+                "dbId": row['documentId']
+            }
+        }
+
+    @staticmethod
+    async def fetch_chunk_windows(
+        user_id: str,
+        hits: List[Tuple[str, int]],
+        window: int
+    ) -> Dict[Tuple[str, int], str]:
+        """
+        Fetch the content of each hit chunk and its neighbours
+        (chunkIndex - window .. chunkIndex + window of the same document)
+        in one query. hits: [(documentId, chunkIndex)]
+        Returns {(documentId, chunkIndex): content}.
+        """
+        if not hits:
+            return {}
+        pool = await get_pg_pool()
+        rows = await pool.fetch(
+            """
+            SELECT DISTINCT c."documentId", c."chunkIndex", c."content"
+            FROM "DocumentChunk" AS c
+            JOIN unnest($1::text[], $2::int[]) AS h(document_id, chunk_index)
+              ON c."documentId" = h.document_id
+             AND c."chunkIndex" BETWEEN h.chunk_index - $3 AND h.chunk_index + $3
+            WHERE c."userId" = $4
+            """,
+            [doc_id for doc_id, _ in hits],
+            [index for _, index in hits],
+            window,
+            user_id
+        )
+        return {(row['documentId'], row['chunkIndex']): row['content'] for row in rows}
+
+    @staticmethod
+    async def _apply_search_settings(
+        conn,
+        ef_search: Optional[int],
+        probes: Optional[int],
+        filtered: bool = False
+    ):
+        # ANNインデックスの検索パラメータをこのトランザクションだけに適用します
+        iterative = await VectorService._iterative_scan_available(conn)
+        if filtered and not iterative:
+            # 絞り込みで候補が減る分、最初から多めに候補を集めます
+            ef_search = max(ef_search or 0, VECTOR_FILTERED_EF_SEARCH)
+        if ef_search:
+            await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef_search))
+        if probes:
+            await conn.execute("SELECT set_config('ivfflat.probes', $1, true)", str(probes))
+        if iterative:
+            # pgvector 0.8+: userId などで絞り込んだ結果が top_k 未満にならないよう走査を継続します
+            await conn.execute("SELECT set_config('hnsw.iterative_scan', $1, true)", VECTOR_ITERATIVE_SCAN)
+
+    @staticmethod
+    async def _iterative_scan_available(conn) -> bool:
+        global _iterative_scan_supported
+        if VECTOR_ITERATIVE_SCAN in ("", "off"):
+            return False
+        if _iterative_scan_supported is None:
+            version = await conn.fetchval("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            parts = tuple(int(p) for p in re.findall(r"\d+", version or "")[:2])
+            _iterative_scan_supported = parts >= (0, 8)
+            if not _iterative_scan_supported:
+                logger.warning(
+                    f"pgvector {version} has no hnsw.iterative_scan; filtered searches use "
+                    f"ef_search={VECTOR_FILTERED_EF_SEARCH} instead"
+                )
+        return _iterative_scan_supported
+
+    @staticmethod
+    async def rebuild_index(concurrently: bool = True):
+        """
+        Rebuild the ANN index on DocumentChunk.embedding (maintenance).
+        CONCURRENTLY keeps reads and writes running, at the cost of a slower rebuild.
+        """
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            mode = "CONCURRENTLY " if concurrently else ""
+            logger.info(f"Rebuilding index {VECTOR_INDEX_NAME} ({'concurrently' if concurrently else 'blocking'})...")
+            start_time = time.perf_counter()
+            await conn.execute(f'REINDEX INDEX {mode}"{VECTOR_INDEX_NAME}"')
+            await conn.execute('ANALYZE "DocumentChunk"')
+            logger.info(f"Rebuilt {VECTOR_INDEX_NAME} in {time.perf_counter() - start_time:.1f}s")
+
     @staticmethod
     async def delete_vectors(file_id: str, user_id: str):
         """
@@ -226,15 +621,52 @@ class VectorService:
     @staticmethod
     def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
         """
-        Split long text into chunks using LangChain's RecursiveCharacterTextSplitter.
+        Split long text into chunks (same boundaries as LangChain's RecursiveCharacterTextSplitter).
         """
         if not text:
             return []
-        
-        # Optimized separators for Japanese and English
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=overlap,
-            separators=["\n\n", "\n", "。", "、", " ", ""] 
-        )
-        return text_splitter.split_text(text)
+        return list(VectorService.iter_chunks(text, chunk_size, overlap))
+
+    @staticmethod
+    def iter_chunks(text: str, chunk_size: int = 500, overlap: int = 50, size_unit: str = "chars") -> Iterator[str]:
+        """
+        Yield chunks lazily. size_unit="tokens" measures chunk_size/overlap in tiktoken tokens.
+        """
+        return _get_chunker(chunk_size, overlap, size_unit).iter_chunks(text)
+
+
+@lru_cache(maxsize=8)
+def _get_chunker(chunk_size: int, overlap: int, size_unit: str) -> TextChunker:
+    # チャンカーは設定ごとに1度だけ構築して使い回します
+    return TextChunker(chunk_size=chunk_size, chunk_overlap=overlap, size_unit=size_unit)
+
+
+if __name__ == "__main__":
+    # メンテナンスコマンド:
+    #   python -m services.vector_service reindex [--blocking]
+    #   python -m services.vector_service prune-embedding-cache [--ttl-days N]
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="DocumentChunk vector index maintenance")
+    parser.add_argument("command", choices=["reindex", "prune-embedding-cache"])
+    parser.add_argument("--blocking", action="store_true", help="REINDEX without CONCURRENTLY (locks writes)")
+    parser.add_argument("--ttl-days", type=int, default=None, help="Delete cached embeddings older than N days")
+    args = parser.parse_args()
+
+    async def _main():
+        from database.db import close_pg_pool
+        try:
+            if args.command == "reindex":
+                await VectorService.rebuild_index(concurrently=not args.blocking)
+            elif args.ttl_days is not None:
+                await embedding_cache.prune(args.ttl_days)
+            else:
+                await embedding_cache.prune()
+        finally:
+            await close_pg_pool()
+
+    asyncio.run(_main())
@@ -1,28 +1,36 @@
 
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple, Callable, Awaitable
 import os
 import shutil
 import uuid
 import json
+import hashlib
+import math
+import random
+import re
 import logging
 import subprocess
 import asyncio
+import time
 import tempfile
 from datetime import datetime, timezone, timedelta
 
 from pydub import AudioSegment
-import google.generativeai as genai
-from fastapi import HTTPException, UploadFile
+from fastapi import HTTPException
 
 from database.db import db
 from services.vector_service import VectorService
 from services.user_service import UserService
 from services.knowledge_service import KnowledgeService
+from services.llm_gateway import llm_gateway
+from services.rate_governor import is_rate_limit_error
+from services.transcript_checkpoint import transcript_checkpoints
 from services.prompts import (
     AUDIO_CHUNK_PROMPT,
     SUMMARY_FROM_TEXT_PROMPT
 )
 from schemas.common import clean_json_response
+from utils.upload_stream import SpooledUpload
 
 # Setup Logger
 logger = logging.getLogger(__name__)
@@ -30,58 +38,363 @@ logger = logging.getLogger(__name__)
 # Timezone Definition
 JST = timezone(timedelta(hours=9))
 
-# Initialize GenAI
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-else:
-    logger.warning("GOOGLE_API_KEY not found in environment for VoiceService.")
+# Gemini は音声1秒あたり32トークンとして課金・カウントします (TPM の見積もりに使用)
+AUDIO_TOKENS_PER_SECOND = 32
+# 同時に文字起こしするセグメント数の上限 (実際の流量は RateGovernor が制御します)
+VOICE_TRANSCRIBE_CONCURRENCY = int(os.getenv("VOICE_TRANSCRIBE_CONCURRENCY", "4"))
+# セグメントごとの最大試行回数
+VOICE_SEGMENT_MAX_ATTEMPTS = int(os.getenv("VOICE_SEGMENT_MAX_ATTEMPTS", "5"))
+# 429 のときのセグメント再試行の待ち時間 (秒)。試行ごとに2倍 (上限あり) にし、ジッターで各セグメントの再試行をずらします
+VOICE_RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("VOICE_RATE_LIMIT_BACKOFF_SECONDS", "30"))
+VOICE_RATE_LIMIT_BACKOFF_MAX_SECONDS = float(os.getenv("VOICE_RATE_LIMIT_BACKOFF_MAX_SECONDS", "120"))
+# ffmpeg の再試行回数
+MAX_FFMPEG_RETRIES = 3
+# 分割方法: "fixed" (既定。10分ごとに機械的に区切る) / "silence" (無音付近で区切る。明示的に指定した場合のみ)
+VOICE_SEGMENTATION = os.getenv("VOICE_SEGMENTATION", "fixed").lower()
+# 目標の区切り位置 (10分) の前後この秒数以内にある無音を区切りに使います
+VOICE_SEGMENT_WINDOW_SECONDS = float(os.getenv("VOICE_SEGMENT_WINDOW_SECONDS", "60"))
+# silencedetect の閾値: この音量 (dB) 以下がこの秒数以上続いた区間を無音とみなします
+VOICE_SILENCE_NOISE_DB = float(os.getenv("VOICE_SILENCE_NOISE_DB", "-35"))
+VOICE_SILENCE_MIN_SECONDS = float(os.getenv("VOICE_SILENCE_MIN_SECONDS", "0.5"))
+# この秒数以上の無音は Gemini に送らずに落とします (0 で無効)
+VOICE_DROP_SILENCE_SECONDS = float(os.getenv("VOICE_DROP_SILENCE_SECONDS", "0"))
+# 無音を落とすときに前後に残す余白 (秒)。発話の頭と末尾を切らないように
+_SILENCE_PADDING_SECONDS = 0.5
+
+_SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
 
 class VoiceService:
     
     @staticmethod
     async def get_audio_duration(file_path: str) -> float:
-        """Get the duration of an audio file in seconds."""
+        """Get the duration of an audio file in seconds (one ffprobe call, JSON output)."""
         try:
-            # ffmpeg -i input 2>&1 | grep "Duration"
-            # Logic from main.py
-            cmd = ["ffmpeg", "-i", file_path]
-            
-            # Use asyncio subprocess
+            cmd = [
+                "ffprobe", "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "json", file_path
+            ]
             process = await asyncio.create_subprocess_exec(
                 *cmd,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
             )
             stdout, stderr = await process.communicate()
-            stderr_text = stderr.decode()
-
-            import re
-            match = re.search(r"Duration: (\d{2}):(\d{2}):(\d{2}\.\d{2})", stderr_text)
-            if match:
-                hours, minutes, seconds = map(float, match.groups())
-                return hours * 3600 + minutes * 60 + seconds
-            return 0.0
+            if process.returncode != 0:
+                logger.error(f"ffprobe failed ({process.returncode}): {stderr.decode(errors='ignore')[:200]}")
+                return 0.0
+            duration = json.loads(stdout or b"{}").get("format", {}).get("duration")
+            return float(duration) if duration else 0.0
         except Exception as e:
             logger.error(f"Error getting audio duration: {e}")
             return 0.0
 
+    @staticmethod
+    async def segment_audio(
+        file_path: str,
+        output_dir: str,
+        file_ext: str,
+        segment_seconds: int,
+        max_seconds: Optional[float] = None
+    ) -> List[str]:
+        """
+        Truncate (optional) and split in a single ffmpeg pass: `-t` on the
+        input plus the segment muxer, stream copy. Only the segment files are
+        written, never a truncated full copy. Returns the segment paths in order.
+        """
+        split_pattern = os.path.join(output_dir, "part%03d" + file_ext)
+        cmd = ["ffmpeg", "-y", "-i", file_path]
+        if max_seconds:
+            cmd += ["-t", str(max_seconds)]
+        cmd += [
+            "-f", "segment", "-segment_time", str(segment_seconds),
+            "-c", "copy", split_pattern
+        ]
+
+        for attempt in range(MAX_FFMPEG_RETRIES):
+            try:
+                logger.info(f"FFmpeg Segmenting Attempt {attempt + 1}/{MAX_FFMPEG_RETRIES}")
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                await process.communicate()
+
+                if process.returncode == 0:
+                    break
+                else:
+                    raise Exception(f"FFmpeg return code {process.returncode}")
+            except Exception as e:
+                logger.error(f"Segmenting failure (Attempt {attempt+1}): {e}")
+                # 途中まで書かれたセグメントを消してからやり直します
+                for f in os.listdir(output_dir):
+                    if f.startswith("part"):
+                        os.remove(os.path.join(output_dir, f))
+                if attempt == MAX_FFMPEG_RETRIES - 1:
+                    raise HTTPException(status_code=500, detail="Failed to process audio chunks after retries.")
+                await asyncio.sleep(1)
+
+        return sorted([os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.startswith("part")])
+
+    @staticmethod
+    async def detect_silences(file_path: str, max_seconds: Optional[float] = None) -> List[Tuple[float, float]]:
+        """
+        Run ffmpeg silencedetect (decode only, nothing written) and return
+        the silent spans as (start, end) seconds. Raises if ffmpeg fails.
+        """
+        cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", file_path]
+        if max_seconds:
+            cmd += ["-t", str(max_seconds)]
+        cmd += [
+            "-af", f"silencedetect=noise={VOICE_SILENCE_NOISE_DB}dB:d={VOICE_SILENCE_MIN_SECONDS}",
+            "-f", "null", "-"
+        ]
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"silencedetect failed with return code {process.returncode}")
+
+        silences: List[Tuple[float, float]] = []
+        start = None
+        for line in stderr.decode(errors="ignore").splitlines():
+            match = _SILENCE_START.search(line)
+            if match:
+                start = max(0.0, float(match.group(1)))
+                continue
+            match = _SILENCE_END.search(line)
+            if match and start is not None:
+                silences.append((start, float(match.group(1))))
+                start = None
+        if start is not None:
+            # 末尾まで無音のまま終わった場合
+            silences.append((start, float("inf")))
+        return silences
 
+    @staticmethod
+    def plan_segments(
+        duration: float,
+        silences: List[Tuple[float, float]],
+        target_seconds: float,
+        window_seconds: float = VOICE_SEGMENT_WINDOW_SECONDS,
+        drop_silence_seconds: float = VOICE_DROP_SILENCE_SECONDS
+    ) -> List[Tuple[float, float]]:
+        """
+        Choose segment spans (start, end) covering [0, duration].
+        A cut is placed in the longest silence that overlaps the window of
+        +/- window_seconds around the target length (at its point closest to
+        the target), or at the target itself if there is none. With drop_silence_seconds > 0, silences at least that
+        long are left out (except a short padding) and always end a segment.
+        """
+        silences = [(start, min(end, duration)) for start, end in silences if start < duration]
+
+        regions = [(0.0, duration)]
+        if drop_silence_seconds > 0:
+            regions, position = [], 0.0
+            for start, end in silences:
+                if end - start < drop_silence_seconds:
+                    continue
+                if start + _SILENCE_PADDING_SECONDS > position:
+                    regions.append((position, start + _SILENCE_PADDING_SECONDS))
+                position = max(position, end - _SILENCE_PADDING_SECONDS)
+            if duration > position:
+                regions.append((position, duration))
+
+        spans: List[Tuple[float, float]] = []
+        for region_start, region_end in regions:
+            start = region_start
+            while region_end - start > target_seconds + window_seconds:
+                ideal = start + target_seconds
+                # 窓に掛かる無音のうち最も長いものを選び、その中で目標に最も近い位置で区切ります
+                candidates = [
+                    (silence_end - silence_start, min(max(ideal, silence_start), silence_end))
+                    for silence_start, silence_end in silences
+                    if silence_end >= ideal - window_seconds and silence_start <= ideal + window_seconds
+                    and silence_end > start + 1.0
+                ]
+                cut = min(max(max(candidates)[1], ideal - window_seconds), ideal + window_seconds) if candidates else ideal
+                spans.append((start, cut))
+                start = cut
+            # 余白だけの短すぎる区間は送りません
+            if region_end - start >= 1.0:
+                spans.append((start, region_end))
+        return spans or [(0.0, duration)]
+
+    @staticmethod
+    async def cut_segments(file_path: str, output_dir: str, file_ext: str, spans: List[Tuple[float, float]]) -> List[str]:
+        """
+        Write each span to its own file in one ffmpeg invocation (one output
+        per span, `-ss`/`-to` + stream copy). Returns the paths in order.
+        """
+        paths = [os.path.join(output_dir, f"part{i:03d}{file_ext}") for i in range(len(spans))]
+        cmd = ["ffmpeg", "-y", "-i", file_path]
+        for (start, end), path in zip(spans, paths):
+            cmd += ["-ss", f"{start:.3f}", "-to", f"{end:.3f}", "-map", "0:a", "-c", "copy", path]
+
+        for attempt in range(MAX_FFMPEG_RETRIES):
+            try:
+                logger.info(f"FFmpeg Cutting Attempt {attempt + 1}/{MAX_FFMPEG_RETRIES}")
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                await process.communicate()
+
+                if process.returncode == 0:
+                    break
+                else:
+                    raise Exception(f"FFmpeg return code {process.returncode}")
+            except Exception as e:
+                logger.error(f"Cutting failure (Attempt {attempt+1}): {e}")
+                if attempt == MAX_FFMPEG_RETRIES - 1:
+                    raise HTTPException(status_code=500, detail="Failed to process audio chunks after retries.")
+                await asyncio.sleep(1)
+
+        return paths
+
+    @classmethod
+    async def segment_audio_on_silence(
+        cls,
+        file_path: str,
+        output_dir: str,
+        file_ext: str,
+        target_seconds: int,
+        duration: float,
+        max_seconds: Optional[float] = None
+    ) -> Optional[Tuple[List[str], List[Tuple[float, float]]]]:
+        """
+        Silence-aware alternative to segment_audio. Returns (paths, spans),
+        or None when silence detection is unavailable (caller falls back to
+        the fixed split).
+        """
+        if duration <= 0:
+            return None
+        try:
+            silences = await cls.detect_silences(file_path, max_seconds)
+        except Exception as e:
+            logger.warning(f"Silence detection failed, falling back to fixed split: {e}")
+            return None
+        spans = cls.plan_segments(duration, silences, target_seconds)
+        paths = await cls.cut_segments(file_path, output_dir, file_ext, spans)
+        return paths, spans
+
+    @classmethod
+    async def transcribe_segments(
+        cls,
+        segment_paths: List[str],
+        mime_type: str,
+        segment_seconds: float,
+        upload_hash: str = "",
+        layout: str = ""
+    ) -> List[str]:
+        """
+        Transcribe audio segments concurrently, at most VOICE_TRANSCRIBE_CONCURRENCY
+        at a time. Results are returned in segment order. Each segment retries
+        on its own, and pacing comes from the rate governor, not fixed sleeps.
+        With an upload_hash, each finished segment is checkpointed, and segments
+        already stored for (upload_hash, layout) are reused instead of re-sent.
+        If any segment still fails after its retries, the other segments are
+        allowed to finish (and checkpoint) and then HTTPException(500) is raised,
+        so a job retry only re-sends the failed segments.
+        """
+        semaphore = asyncio.Semaphore(VOICE_TRANSCRIBE_CONCURRENCY)
+        started = time.perf_counter()
+        stored = await transcript_checkpoints.load(upload_hash, layout)
+        if stored:
+            logger.info(f"Reusing {len(stored)}/{len(segment_paths)} checkpointed chunks for upload {upload_hash[:12]}")
+
+        async def run(index: int, path: str) -> str:
+            if index in stored:
+                return stored[index]
+            async with semaphore:
+                logger.info(f"Processing chunk {index+1}/{len(segment_paths)}: {path}")
+                transcript = await cls._transcribe_segment(index, path, mime_type, segment_seconds)
+            await transcript_checkpoints.save(upload_hash, layout, index, transcript)
+            return transcript
+
+        # 1つのセグメントが失敗しても他のセグメントは最後まで実行して保存します
+        transcripts = await asyncio.gather(
+            *(run(i, path) for i, path in enumerate(segment_paths)), return_exceptions=True
+        )
+        failed = [i for i, result in enumerate(transcripts) if isinstance(result, BaseException)]
+        if failed:
+            # 失敗したセグメントは保存しないので、ジョブのリトライでそのセグメントだけ再度文字起こしされます
+            # (欠けた文字起こしを要約・保存しないよう、ここで処理全体を失敗させます)
+            for index in failed:
+                logger.error(f"Failed to transcribe chunk {index}: {transcripts[index]}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to transcribe {len(failed)}/{len(segment_paths)} audio chunks."
+            )
+        logger.info(
+            f"Transcribed {len(segment_paths) - len(stored)} chunks ({len(stored)} reused) "
+            f"in {time.perf_counter() - started:.1f}s (concurrency {VOICE_TRANSCRIBE_CONCURRENCY}): "
+            f"{transcript_checkpoints.stats()}"
+        )
+        return list(transcripts)
+
+    @staticmethod
+    def rate_limit_backoff(attempt: int) -> float:
+        # 30s, 60s, 120s, 120s ... の半分〜全量 (equal jitter)。同時に 429 を受けたセグメントが一斉に再試行しないように
+        delay = min(VOICE_RATE_LIMIT_BACKOFF_SECONDS * 2 ** (attempt - 1), VOICE_RATE_LIMIT_BACKOFF_MAX_SECONDS)
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    async def _transcribe_segment(index: int, path: str, mime_type: str, segment_seconds: float) -> str:
+        # 最後の試行でも失敗した場合は例外をそのまま送出します
+        upload = None
+        for attempt in range(1, VOICE_SEGMENT_MAX_ATTEMPTS + 1):
+            try:
+                if upload is None:
+                    upload = await llm_gateway.upload_file(path, mime_type=mime_type)
+                response = await llm_gateway.generate(
+                    [AUDIO_CHUNK_PROMPT, upload],
+                    op="transcribe_segment",
+                    tokens=int(segment_seconds * AUDIO_TOKENS_PER_SECOND) + len(AUDIO_CHUNK_PROMPT)
+                )
+                text_resp = response.text
+                if "[TRANSCRIPT]" in text_resp:
+                    return text_resp.split("[TRANSCRIPT]")[1].strip()
+                return text_resp.strip()
+
+            except Exception as e:
+                if attempt == VOICE_SEGMENT_MAX_ATTEMPTS:
+                    raise
+                if is_rate_limit_error(e):
+                    # RateGovernor が全体の流量を絞るのに加えて、このセグメントも指数バックオフ (ジッター付き) で待ちます
+                    backoff = VoiceService.rate_limit_backoff(attempt)
+                    logger.warning(f"Rate limit hit for chunk {index}. Retrying in {backoff:.0f}s... ({attempt}/{VOICE_SEGMENT_MAX_ATTEMPTS})")
+                    await asyncio.sleep(backoff)
+                else:
+                    backoff = min(2 ** attempt, 30)
+                    logger.warning(f"Chunk {index} failed ({e}). Retrying in {backoff}s... ({attempt}/{VOICE_SEGMENT_MAX_ATTEMPTS})")
+                    await asyncio.sleep(backoff)
 
     @classmethod
     async def process_voice_memo(
         cls, 
-        file: UploadFile, 
+        file: SpooledUpload,
         metadata: Dict[str, Any],
-        save: bool = True
+        save: bool = True,
+        record_usage: bool = True,
+        on_usage_recorded: Optional[Callable[[], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """
         Process voice memo with robust logic ported from main.py:
         1. Limit Checks & Truncation
-        2. FFMPEG Chunking
-        3. Gemini Transcription with Retry
+        2. FFMPEG Chunking (near silences, optionally dropping long silences)
+        3. Gemini Transcription (bounded-parallel, per-segment retry, checkpointed per segment)
         4. Summarization
-        5. Storage via KnowledgeService
+        5. Storage via KnowledgeService (diff reindex, safe to repeat)
+        Job retries pass record_usage=False once on_usage_recorded has been
+        called, so the voice limit is checked and billed only once per job.
         """
         logger.info(f"Processing voice memo for: {file.filename}")
         
@@ -100,25 +413,22 @@ class VoiceService:
         # Storage Limit
         await UserService.check_storage_limit(user_id)
         
-        # 1. Save Temporary
-        content = await file.read()
+        # 1. Temporary File
+        # アップロードはルーターで受信しながらディスクに書き出し済み (メモリには読み込みません)
         file_ext = os.path.splitext(file.filename)[1].lower()
         allowed_exts = {".mp3", ".m4a", ".wav", ".aac", ".caf", ".ogg", ".flac", ".webm"}
         if file_ext not in allowed_exts:
             file_ext = ".mp3"
-            
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-            tmp.write(content)
-            temp_filename = tmp.name
-            
-        current_temp_file = temp_filename
-        temp_files_to_cleanup = [temp_filename]
+
+        temp_filename = file.path
+        logger.info(f"Voice upload spooled: {file.size} bytes (sha256 {file.sha256[:12]})")
+
+        # アップロードされたファイル自体は呼び出し側が削除します (ジョブのリトライで再利用するため)
+        temp_dir = tempfile.mkdtemp()
 
         try:
             # --- Plan-Based Logic: Truncation & Usage Recording ---
             
-            MAX_FFMPEG_RETRIES = 3
-            
             # 1. Truncation
             needs_truncation = False
             truncate_seconds = 0
@@ -136,127 +446,67 @@ class VoiceService:
                 truncate_seconds = 10800 # 180 mins (3 hours)
                 logger.info("Premium Plan detected: Truncating to 180 mins.")
 
-            
-            if needs_truncation:
-                actual_duration = await cls.get_audio_duration(temp_filename)
-                
-                if actual_duration > truncate_seconds:
-                    # Create temp file for truncated version
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_truncated{file_ext}") as trunc_tmp:
-                            truncated_filename = trunc_tmp.name
-                    
-                    # ffmpeg: -t duration, -acodec copy
-                    cmd = ["ffmpeg", "-y", "-i", temp_filename, "-t", str(truncate_seconds), "-acodec", "copy", truncated_filename]
-                    
-                    for attempt in range(MAX_FFMPEG_RETRIES):
-                        try:
-                            logger.info(f"FFmpeg Truncation Attempt {attempt + 1}/{MAX_FFMPEG_RETRIES}")
-                            process = await asyncio.create_subprocess_exec(
-                                *cmd,
-                                stdout=asyncio.subprocess.PIPE,
-                                stderr=asyncio.subprocess.PIPE
-                            )
-                            await process.communicate()
-                            
-                            if process.returncode == 0:
-                                current_temp_file = truncated_filename
-                                temp_files_to_cleanup.append(truncated_filename)
-                                logger.info(f"Truncated from {actual_duration:.1f}s to {truncate_seconds}s")
-                                break
-                            else:
-                                raise Exception(f"FFmpeg return code {process.returncode}")
-                        except Exception as e:
-                            logger.error(f"Truncation failure (Attempt {attempt+1}): {e}")
-                            if attempt == MAX_FFMPEG_RETRIES - 1:
-                                raise HTTPException(status_code=500, detail="Failed to limit audio duration after retries.")
-                            await asyncio.sleep(1) # Wait before retry
+            # 長さは ffprobe で1回だけ取得し、切り詰め後の長さはそこから計算します
+            # (切り詰め自体はセグメント分割と同じ ffmpeg 1回で行います)
+            actual_duration = await cls.get_audio_duration(temp_filename)
+            max_seconds = None
+            final_duration = actual_duration
+            if needs_truncation and actual_duration > truncate_seconds:
+                max_seconds = truncate_seconds
+                final_duration = float(truncate_seconds)
+                logger.info(f"Truncating from {actual_duration:.1f}s to {truncate_seconds}s")
             
             # 2. Record Usage
-            try:
-                final_duration = await cls.get_audio_duration(current_temp_file)
-                sub = await UserService.get_or_create_subscription(user_id)
-                await cls.check_and_update_voice_limit(user_id, sub, final_duration)
-            except Exception as e:
-                logger.error(f"Recording usage failed: {e}")
-                raise e
-
-            # --- Chunking & Segmentation ---
-            chunk_duration = 600 # 10 minutes
-            temp_dir = tempfile.mkdtemp()
-            
-            split_pattern = os.path.join(temp_dir, "part%03d" + file_ext)
-            logger.info(f"Splitting audio into {chunk_duration}s chunks...")
-            
-            cmd = [
-                "ffmpeg", "-y", "-i", current_temp_file, 
-                "-f", "segment", "-segment_time", str(chunk_duration), 
-                "-c", "copy", split_pattern
-            ]
-            
-            for attempt in range(MAX_FFMPEG_RETRIES):
+            if record_usage:
                 try:
-                    logger.info(f"FFmpeg Splitting Attempt {attempt + 1}/{MAX_FFMPEG_RETRIES}")
-                    process_split = await asyncio.create_subprocess_exec(
-                        *cmd,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    await process_split.communicate()
-                    
-                    if process_split.returncode == 0:
-                        break
-                    else:
-                        raise Exception(f"FFmpeg return code {process_split.returncode}")
+                    sub = await UserService.get_or_create_subscription(user_id)
+                    await cls.check_and_update_voice_limit(user_id, sub, final_duration)
                 except Exception as e:
-                    logger.error(f"Splitting failure (Attempt {attempt+1}): {e}")
-                    if attempt == MAX_FFMPEG_RETRIES - 1:
-                        raise HTTPException(status_code=500, detail="Failed to process audio chunks after retries.")
-                    await asyncio.sleep(1)
-            
-            chunks_files = sorted([os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.startswith("part")])
+                    logger.error(f"Recording usage failed: {e}")
+                    raise e
+                if on_usage_recorded is not None:
+                    await on_usage_recorded()
+            else:
+                logger.info("Usage already recorded for this job, skipping the voice limit check")
+
+            # --- Chunking & Segmentation (truncation included) ---
+            chunk_duration = 600 # 10 minutes
+            segmented = None
+            if VOICE_SEGMENTATION == "silence":
+                logger.info(f"Splitting audio near silences (~{chunk_duration}s chunks)...")
+                segmented = await cls.segment_audio_on_silence(
+                    temp_filename, temp_dir, file_ext, chunk_duration, final_duration, max_seconds=max_seconds
+                )
+
+            if segmented is not None:
+                chunks_files, spans = segmented
+                seconds_sent = sum(end - start for start, end in spans)
+                # 区切り位置が同じときだけチェックポイントを再利用できるよう、区切り位置を分割方法に含めます
+                layout = "silence:" + hashlib.sha256(
+                    ",".join(f"{start:.3f}-{end:.3f}" for start, end in spans).encode()
+                ).hexdigest()[:16]
+                segment_seconds = max(end - start for start, end in spans)
+                logger.info(
+                    f"Audio sent to Gemini: {seconds_sent:.0f}s in {len(spans)} chunks "
+                    f"(fixed split: {final_duration:.0f}s in {math.ceil(final_duration / chunk_duration)} chunks, "
+                    f"saved {final_duration - seconds_sent:.0f}s)"
+                )
+            else:
+                logger.info(f"Splitting audio into {chunk_duration}s chunks...")
+                chunks_files = await cls.segment_audio(
+                    temp_filename, temp_dir, file_ext, chunk_duration, max_seconds=max_seconds
+                )
+                layout = f"fixed:{chunk_duration}:t{max_seconds or 0}"
+                segment_seconds = chunk_duration
+                logger.info(f"Audio sent to Gemini: {final_duration:.0f}s in {len(chunks_files)} chunks (fixed split)")
             logger.info(f"Created {len(chunks_files)} chunks: {chunks_files}")
             
-            full_transcript = []
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            
-            for i, chunk_path in enumerate(chunks_files):
-                logger.info(f"Processing chunk {i+1}/{len(chunks_files)}: {chunk_path}")
-                
-                chunk_file_upload = genai.upload_file(chunk_path, mime_type=file.content_type or "audio/mpeg")
-                
-                retry_count = 0
-                max_retries = 5
-                
-                while retry_count < max_retries:
-                    try:
-                        response = model.generate_content(
-                            [AUDIO_CHUNK_PROMPT, chunk_file_upload],
-                        )
-                        
-                        text_resp = response.text
-                        chunk_transcript = ""
-                        if "[TRANSCRIPT]" in text_resp:
-                            chunk_transcript = text_resp.split("[TRANSCRIPT]")[1].strip()
-                        else:
-                            chunk_transcript = text_resp.strip()
-                        
-                        full_transcript.append(chunk_transcript)
-                        break 
-                        
-                    except Exception as e:
-                        if "429" in str(e) or "Resource exhausted" in str(e):
-                            retry_count += 1
-                            wait_time = 30 * retry_count 
-                            logger.warning(f"Rate limit hit for chunk {i}. Retrying in {wait_time}s... ({retry_count}/{max_retries})")
-                            await asyncio.sleep(wait_time)
-                        else:
-                            logger.error(f"Failed to transcribe chunk {i}: {e}")
-                            full_transcript.append(f"(Chunk {i} failed: {e})")
-                            break 
-
-                logger.info("Sleeping 10s to respect rate limits...")
-                await asyncio.sleep(10)
-                # chunk_file_upload.delete() # Clean up remote file if needed
+            # セグメントを並列に文字起こしします (順序は維持)
+            # 完了したセグメントは (アップロードのハッシュ, 分割方法, 番号) で保存され、リトライ時に再利用されます
+            full_transcript = await cls.transcribe_segments(
+                chunks_files, file.content_type or "audio/mpeg", segment_seconds,
+                upload_hash=file.sha256, layout=layout
+            )
 
             # Summarization
             final_transcript = "\n\n".join(full_transcript)
@@ -267,7 +517,7 @@ class VoiceService:
             
             try:
                 summary_prompt = SUMMARY_FROM_TEXT_PROMPT.format(text=final_transcript[:500000])
-                summary_resp = model.generate_content([summary_prompt])
+                summary_resp = await llm_gateway.generate([summary_prompt], op="voice_summary")
                 summary_text = summary_resp.text
                 if "[SUMMARY]" in summary_text:
                     final_summary = summary_text.split("[SUMMARY]")[1].strip()
@@ -276,9 +526,6 @@ class VoiceService:
             except Exception as e:
                 logger.error(f"Summary generation failed: {e}")
 
-            # Cleanup Chunks
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            
             if not final_transcript:
                  raise HTTPException(status_code=500, detail="Failed to generate transcript")
 
@@ -299,47 +546,16 @@ class VoiceService:
                 )
                 
                 chunks = VectorService.chunk_text(final_transcript)
-                vectors = []
-                
-                for i, chunk in enumerate(chunks):
-                    vector_id = f"{user_id}#{db_id}#{i}"
-                    embedding = VectorService.get_embedding(chunk)
-                    
-                    vectors.append({
-                        "id": vector_id,
-                        "values": embedding,
-                        "metadata": {
-                            "userId": user_id,
-                            "fileId": db_id,
-                            "dbId": db_id,
-                            "fileName": file.filename,
-                            "text": chunk,
-                            "chunkIndex": i,
-                            "tags": tags,
-                            "type": "transcript"
-                        }
-                    })
-                
-                if final_summary:
-                    summary_id = f"{user_id}#{db_id}#summary"
-                    summary_embedding = VectorService.get_embedding(final_summary)
-                    vectors.append({
-                        "id": summary_id,
-                        "values": summary_embedding,
-                        "metadata": {
-                            "userId": user_id,
-                            "fileId": db_id,
-                            "dbId": db_id,
-                            "fileName": file.filename,
-                            "text": final_summary,
-                            "chunkIndex": -1,
-                            "tags": tags,
-                            "type": "summary"
-                        }
-                    })
-                
-                if vectors:
-                    await VectorService.upsert_vectors(vectors)
+                # 保存済みチャンクとの差分を1トランザクションで反映します (要約チャンクも置き換え)
+                # ジョブがリトライされてもチャンクは重複しません
+                await KnowledgeService.reindex_document(
+                    doc_id=db_id,
+                    user_id=user_id,
+                    chunks=chunks,
+                    file_name=file.filename,
+                    tags=tags,
+                    summary=final_summary
+                )
 
                 # Save Content to DB
                 await KnowledgeService.save_document_content(db_id, final_transcript, summary=final_summary)
@@ -354,13 +570,15 @@ class VoiceService:
                 "chunks_count": len(chunks) if save else 0
             }
 
+        except HTTPException:
+            # 上限超過 (403) などはそのまま返します (ジョブでは再試行しない扱いになります)
+            raise
         except Exception as e:
             logger.error(f"Error processing voice memo: {e}")
             raise HTTPException(status_code=500, detail="Voice processing failed due to an internal error.")
         finally:
-            for f in temp_files_to_cleanup:
-                if os.path.exists(f):
-                    os.remove(f)
+            # Cleanup Chunks
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
     @staticmethod
     async def check_and_update_voice_limit(user_id: str, sub, duration_sec: float):
@@ -473,11 +691,12 @@ class VoiceService:
             # Mirroring process_voice_memo logic:
             
             chunks = VectorService.chunk_text(transcript)
+            texts_to_embed = chunks + ([summary] if summary else [])
+            embeddings = await VectorService.get_embeddings(texts_to_embed)
             vectors = []
             
-            for i, chunk in enumerate(chunks):
+            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
                 vector_id = f"{user_id}#{doc_id}#{i}"
-                embedding = VectorService.get_embedding(chunk)
                 vectors.append({
                     "id": vector_id,
                     "values": embedding,
@@ -495,7 +714,7 @@ class VoiceService:
             
             if summary:
                 s_id = f"{user_id}#{doc_id}#summary"
-                s_emb = VectorService.get_embedding(summary)
+                s_emb = embeddings[-1]
                 vectors.append({
                     "id": s_id,
                     "values": s_emb,
@@ -513,6 +732,7 @@ class VoiceService:
             
             if vectors:
                 await VectorService.upsert_vectors(vectors)
+                await KnowledgeService.mark_corpus_changed(user_id)
 
             logger.info(f"Saved manual voice memo {doc_id} for user {user_id}")
             return {"id": doc_id, "status": "saved"}
@@ -0,0 +1,112 @@
+# backend/ をインポートパスに追加します (リポジトリのルートから pytest を実行した場合でも services.* を読み込めるように)
+# テストは Gemini・DB に接続しません。外部呼び出しは各テストで llm_gateway などを差し替えます。
+import asyncio
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+class _FakeTable:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def _row(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        return types.SimpleNamespace(id="thread-1", userId="user-1")
+
+    async def create(self, data):
+        return await self._row()
+
+    async def find_unique(self, where):
+        return await self._row()
+
+    async def update(self, where, data):
+        return await self._row()
+
+
+@pytest.fixture
+def chat_backend(monkeypatch):
+    """
+    ChatService with every external dependency replaced by a fake with a
+    configurable latency (seconds). Embedding goes through the real
+    VectorService / embedding cache / llm_gateway path with only
+    llm_gateway.embed stubbed. Answers come from FakeStreamingModel
+    (CHAT_MODEL_BACKEND=fake).
+    """
+    import services.chat_service as chat_service
+    from services.embedding_cache import embedding_cache
+    from services.llm_gateway import llm_gateway
+    from services.search_service import SearchService
+    from services.user_service import UserService
+    from services.vector_service import VectorService
+
+    latency = types.SimpleNamespace(
+        embed=0.0, search=0.0, chunk_fetch=0.0, db=0.0, plan=0.0, web=0.0, limit=0.0, stream_chunk=0.01
+    )
+    calls = types.SimpleNamespace(embed=0)
+
+    async def sleep_then(seconds, value):
+        await asyncio.sleep(seconds)
+        return value
+
+    async def fake_embed(model_name, content, task_type, op="embed"):
+        calls.embed += 1
+        texts = content if isinstance(content, list) else [content]
+        await asyncio.sleep(latency.embed)
+        return {"embedding": [[0.1] * 8 for _ in texts]}
+
+    async def resolve_user_id(user_id):
+        return user_id
+
+    async def check_limit(user_id):
+        await asyncio.sleep(latency.limit)
+
+    async def get_user_plan(user_id):
+        return await sleep_then(latency.plan, "FREE")
+
+    async def search_vectors(**kwargs):
+        return await sleep_then(latency.search, {"matches": []})
+
+    async def fetch_chunk_windows(user_id, hits, neighbors):
+        return await sleep_then(latency.chunk_fetch, {})
+
+    async def search_async(self, query, plan):
+        return await sleep_then(latency.web, "web results")
+
+    async def no_title_hits(user_id, query):
+        return []
+
+    async def no_cached_answer(query, user_id, tags):
+        return None, None, None
+
+    monkeypatch.setattr(llm_gateway, "embed", fake_embed)
+    monkeypatch.setattr(embedding_cache, "persistent", False)
+    monkeypatch.setattr(UserService, "resolve_user_id", staticmethod(resolve_user_id))
+    monkeypatch.setattr(UserService, "check_and_increment_chat_limit", staticmethod(check_limit))
+    monkeypatch.setattr(UserService, "get_user_plan", staticmethod(get_user_plan))
+    monkeypatch.setattr(VectorService, "search_vectors", staticmethod(search_vectors))
+    monkeypatch.setattr(VectorService, "fetch_chunk_windows", staticmethod(fetch_chunk_windows))
+    monkeypatch.setattr(SearchService, "search_async", search_async)
+    monkeypatch.setattr(chat_service.title_index, "match", no_title_hits)
+    monkeypatch.setattr(chat_service.ChatService, "_lookup_answer", staticmethod(no_cached_answer))
+    monkeypatch.setattr(chat_service, "db", types.SimpleNamespace(
+        thread=_FakeTable(0), message=_FakeTable(0)
+    ))
+    monkeypatch.setattr(chat_service, "CHAT_MODEL_BACKEND", "fake")
+    monkeypatch.setattr(
+        chat_service, "get_chat_model",
+        lambda: chat_service.FakeStreamingModel(delay=latency.stream_chunk)
+    )
+
+    backend = types.SimpleNamespace(latency=latency, calls=calls, service=chat_service.ChatService())
+
+    def set_db_latency(seconds):
+        chat_service.db.thread.delay = seconds
+        chat_service.db.message.delay = seconds
+
+    backend.set_db_latency = set_db_latency
+    return backend
@@ -0,0 +1,48 @@
+# ask の前処理 (_prepare) を直列に実行した場合 (以前の実装) と並列実行の所要時間の比較
+# 各ステージに固定の遅延を入れ、直列の合計とクリティカルパスを実測値と比べます。
+#   python -m pytest tests/test_ask_stage_latency.py -s で計測値を表示します
+import asyncio
+import time
+
+import services.chat_service as chat_service
+
+LIMIT = 0.02
+DB = 0.1         # thread 作成 + ユーザーメッセージ保存で2回
+EMBED = 0.15
+SEARCH = 0.15
+PLAN = 0.1
+WEB = 0.2
+
+
+def test_prepare_runs_independent_stages_concurrently(chat_backend, monkeypatch):
+    monkeypatch.setattr(chat_service, "WEB_SEARCH_SPECULATIVE", True)
+    latency = chat_backend.latency
+    latency.limit, latency.embed, latency.search, latency.plan, latency.web = LIMIT, EMBED, SEARCH, PLAN, WEB
+    chat_backend.set_db_latency(DB)
+
+    # 以前の ask はステージを1つずつ実行していました
+    sequential = LIMIT + PLAN + 2 * DB + EMBED + SEARCH + WEB
+    # 並列実行では thread / retrieval / (plan -> web) の最も遅い系列だけ待ちます
+    critical_path = LIMIT + max(2 * DB, EMBED + SEARCH, PLAN + WEB)
+
+    async def run():
+        timer = chat_service.StageTimer()
+        start = time.perf_counter()
+        prepared = await chat_backend.service._prepare("フーリエ変換とは", "user-1", None, [], timer)
+        return time.perf_counter() - start, prepared, timer
+
+    elapsed, prepared, timer = asyncio.run(run())
+
+    stages = ", ".join(f"{name}={ms:.0f}ms" for name, ms in timer.timings.items())
+    print(
+        f"\n_prepare sequential (before) {sequential * 1000:.0f}ms, "
+        f"concurrent (after) {elapsed * 1000:.0f}ms, critical path {critical_path * 1000:.0f}ms\n  {stages}"
+    )
+    assert prepared.thread_id == "thread-1"
+    assert "web results" in prepared.prompt
+    for name in ("thread", "embedding", "vector_search", "plan_lookup", "web"):
+        assert name in timer.timings
+    assert elapsed >= critical_path
+    # スケジューリングの揺れを見込んでも、直列の合計 (~820ms) より十分短いこと
+    assert elapsed < critical_path + 0.1
+    assert elapsed < sequential * 0.6
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+EMBED_LATENCY = 0.5
+CONCURRENT_ASKS = 8
+
+
+def test_concurrent_asks_do_not_serialize_behind_a_slow_embedding(chat_backend):
+    chat_backend.latency.embed = EMBED_LATENCY
+
+    async def run():
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            chat_backend.service.ask(f"線形代数の質問 {i}", f"user-{i}") for i in range(CONCURRENT_ASKS)
+        ))
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(run())
+
+    assert chat_backend.calls.embed == CONCURRENT_ASKS
+    assert all(result["answer"] for result in results)
+    # 埋め込みが直列化されると CONCURRENT_ASKS x EMBED_LATENCY (4秒) かかります
+    assert elapsed < EMBED_LATENCY * 2, f"{CONCURRENT_ASKS} asks took {elapsed:.2f}s"
+
+
+def test_slow_embedding_does_not_block_the_event_loop(chat_backend):
+    chat_backend.latency.embed = EMBED_LATENCY
+
+    async def run():
+        # ask の実行中も他のコルーチンが 10ms ごとに動けることを確認します
+        gaps = []
+        done = asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        await chat_backend.service.ask("フーリエ変換とは", "user-1")
+        done.set()
+        await tick
+        return max(gaps)
+
+    assert asyncio.run(run()) < 0.1
@@ -0,0 +1,58 @@
+# ストリーミング (ask_stream) と一括応答 (ask) の最初のトークンまでの時間 (TTFT) の比較
+# FakeStreamingModel (CHAT_MODEL_BACKEND=fake) で 20 チャンク x 50ms の回答を生成します。
+#   python -m pytest tests/test_chat_streaming.py -s で計測値を表示します
+import asyncio
+import time
+
+import services.chat_service as chat_service
+
+ANSWER = "ストリーミング検証用の回答です。" * 5
+CHUNK_CHARS = 4
+CHUNK_DELAY = 0.05
+
+
+def use_answer(monkeypatch):
+    model = chat_service.FakeStreamingModel(answer=ANSWER, chunk_chars=CHUNK_CHARS, delay=CHUNK_DELAY)
+    monkeypatch.setattr(chat_service, "get_chat_model", lambda: model)
+    return model
+
+
+async def buffered_ttft(service) -> float:
+    # 一括応答では回答全体が揃うまで最初の1文字も届きません
+    start = time.perf_counter()
+    result = await service.ask("ストリーミングとは", "user-1")
+    assert result["answer"] == ANSWER
+    return time.perf_counter() - start
+
+
+async def streaming_ttft(service):
+    start = time.perf_counter()
+    first_delta = None
+    deltas = 0
+    events = await service.ask_stream("ストリーミングとは", "user-1")
+    async for event in events:
+        if event.startswith("event: delta"):
+            deltas += 1
+            if first_delta is None:
+                first_delta = time.perf_counter() - start
+        elif event.startswith("event: done"):
+            return first_delta, time.perf_counter() - start, deltas
+    raise AssertionError("stream ended without a done event")
+
+
+def test_streaming_first_token_arrives_long_before_the_buffered_answer(chat_backend, monkeypatch):
+    model = use_answer(monkeypatch)
+
+    buffered = asyncio.run(buffered_ttft(chat_backend.service))
+    first_delta, total, deltas = asyncio.run(streaming_ttft(chat_backend.service))
+
+    print(
+        f"\nTTFT buffered {buffered * 1000:.0f}ms, streaming {first_delta * 1000:.0f}ms "
+        f"(stream complete {total * 1000:.0f}ms, {deltas} deltas)"
+    )
+    assert deltas == len(ANSWER) // CHUNK_CHARS
+    assert buffered >= model.generation_seconds
+    # 最初のチャンク (50ms) + 前処理の分だけで届くこと。一括応答 (~1s) の 1/4 未満
+    assert first_delta < buffered / 4
+    # ストリーミングでも全体の所要時間はほぼ変わりません
+    assert total < buffered * 1.5
@@ -0,0 +1,56 @@
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import database.db as db_module
+
+
+@pytest.fixture
+def fake_create_pool(monkeypatch):
+    created = []
+
+    class FakePool:
+        async def close(self):
+            pass
+
+    async def create_pool(dsn, **kwargs):
+        # 接続の確立に時間がかかる間に、他の呼び出しが割り込めるようにします
+        await asyncio.sleep(0.05)
+        pool = FakePool()
+        created.append((dsn, pool))
+        return pool
+
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u:p@db.example.com:5432/postgres?sslmode=require")
+    monkeypatch.setattr(db_module.asyncpg, "create_pool", create_pool)
+    monkeypatch.setattr(db_module, "_pg_pool", None)
+    monkeypatch.setattr(db_module, "_pg_pool_lock", asyncio.Lock())
+    return created
+
+
+def test_concurrent_first_calls_create_one_pool(fake_create_pool):
+    async def run():
+        pools = await asyncio.gather(*(db_module.get_pg_pool() for _ in range(8)))
+        await db_module.close_pg_pool()
+        return pools
+
+    pools = asyncio.run(run())
+
+    assert len(fake_create_pool) == 1
+    assert all(pool is fake_create_pool[0][1] for pool in pools)
+
+
+def test_dsn_keeps_sslmode_and_drops_prisma_params():
+    dsn = db_module._asyncpg_dsn(
+        "postgresql://u:p@db.example.com:6543/postgres"
+        "?pgbouncer=true&schema=public&connection_limit=1&sslmode=require&application_name=jibun"
+    )
+
+    parts = urlsplit(dsn)
+    assert parts.netloc == "u:p@db.example.com:6543"
+    assert parse_qs(parts.query) == {"sslmode": ["require"], "application_name": ["jibun"]}
+
+
+def test_dsn_without_params_is_unchanged():
+    url = "postgresql://u:p@localhost:5432/postgres"
+    assert db_module._asyncpg_dsn(url) == url
@@ -0,0 +1,181 @@
+# JobWorker の動作 (成功・失敗の分類・ロック喪失・最終試行) を、メモリ上の JobQueue で確認します
+# SQL (SKIP LOCKED・可視性タイムアウト・バックオフ) は test_job_queue_postgres.py で確認します
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import services.job_queue as job_queue
+from services.job_queue import JobQueue, JobWorker, PermanentJobError
+
+
+class FakeQueue:
+    def __init__(self):
+        self.queued = []
+        self.completed = {}
+        self.failures = {}
+        self.heartbeats = 0
+        self.lease_held = True
+
+    def add(self, kind="test", attempts=1, max_attempts=3, payload=None):
+        job = {
+            "id": f"job-{len(self.queued)}", "userId": "u1", "kind": kind, "payload": payload or {},
+            "attempts": attempts, "maxAttempts": max_attempts,
+        }
+        self.queued.append(job)
+        return job
+
+    async def claim(self, worker_id):
+        return self.queued.pop(0) if self.queued else None
+
+    async def heartbeat(self, job_id, worker_id):
+        self.heartbeats += 1
+        return self.lease_held
+
+    async def complete(self, job_id, worker_id, result):
+        if not self.lease_held:
+            return False
+        self.completed[job_id] = result
+        return True
+
+    async def fail(self, job_id, worker_id, error, retryable=True):
+        self.failures[job_id] = (error, retryable)
+        return "QUEUED" if retryable else "FAILED"
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    fake = FakeQueue()
+    for name in ("claim", "heartbeat", "complete", "fail"):
+        monkeypatch.setattr(JobQueue, name, staticmethod(getattr(fake, name)))
+    # 可視性タイムアウトの 1/3 ごとに延長するので、テストでは 30ms 間隔にします
+    monkeypatch.setattr(job_queue, "JOB_VISIBILITY_TIMEOUT_SECONDS", 0.09)
+    return fake
+
+
+def execute(worker, job):
+    asyncio.run(worker._execute(job))
+
+
+def test_successful_job_is_completed_and_its_upload_removed(queue, tmp_path):
+    upload = tmp_path / "upload.mp3"
+    upload.write_bytes(b"audio")
+
+    async def handler(job):
+        return {"status": "success", "jobId": job["id"]}
+
+    worker = JobWorker({"test": handler})
+    job = queue.add(payload={"upload": {"path": str(upload)}})
+    execute(worker, job)
+
+    assert queue.completed == {job["id"]: {"status": "success", "jobId": job["id"]}}
+    assert not upload.exists()
+    assert worker.counts["succeeded"] == 1
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (HTTPException(status_code=403, detail="limit exceeded"), False),
+    (HTTPException(status_code=500, detail="Failed to transcribe 1/4 audio chunks."), True),
+    (PermanentJobError("bad payload"), False),
+    (FileNotFoundError("spool missing"), False),
+    (RuntimeError("connection reset"), True),
+])
+def test_failures_are_classified_for_retry(queue, error, retryable):
+    async def handler(job):
+        raise error
+
+    worker = JobWorker({"test": handler})
+    job = queue.add()
+    execute(worker, job)
+
+    assert queue.failures[job["id"]][1] is retryable
+    assert not queue.completed
+    assert worker.counts["retried" if retryable else "failed"] == 1
+
+
+def test_upload_is_kept_while_the_job_will_be_retried(queue, tmp_path):
+    upload = tmp_path / "upload.mp3"
+    upload.write_bytes(b"audio")
+
+    async def handler(job):
+        raise RuntimeError("temporary")
+
+    execute(JobWorker({"test": handler}), queue.add(payload={"upload": {"path": str(upload)}}))
+
+    # リトライで同じファイルを使うので、QUEUED に戻ったジョブのファイルは消しません
+    assert upload.exists()
+
+
+def test_heartbeat_extends_the_lease_while_the_handler_runs(queue):
+    async def handler(job):
+        await asyncio.sleep(0.1)
+        return {}
+
+    execute(JobWorker({"test": handler}), queue.add())
+
+    assert queue.heartbeats >= 2
+
+
+def test_lost_lease_cancels_the_handler_and_discards_the_result(queue):
+    finished = []
+
+    async def handler(job):
+        await asyncio.sleep(1)
+        finished.append(job["id"])
+        return {}
+
+    queue.lease_held = False
+    worker = JobWorker({"test": handler})
+    execute(worker, queue.add())
+
+    assert finished == []
+    assert not queue.completed and not queue.failures
+    assert worker.counts["leaseLost"] == 1
+
+
+def test_job_reclaimed_after_its_final_attempt_is_failed_without_running(queue):
+    ran = []
+
+    async def handler(job):
+        ran.append(job["id"])
+        return {}
+
+    job = queue.add(attempts=4, max_attempts=3)
+    execute(JobWorker({"test": handler}), job)
+
+    assert ran == []
+    assert queue.failures[job["id"]][1] is False
+
+
+def test_unknown_kind_fails_permanently(queue):
+    job = queue.add(kind="unknown")
+    execute(JobWorker({}), job)
+
+    assert queue.failures[job["id"]] == ("Unknown job kind: unknown", False)
+
+
+def test_worker_loop_runs_queued_jobs_with_bounded_concurrency(queue):
+    running, peak = 0, 0
+
+    async def handler(job):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return {}
+
+    async def run():
+        worker = JobWorker({"test": handler}, concurrency=2, poll_interval=0.01)
+        worker.start()
+        while len(queue.completed) < 5:
+            await asyncio.sleep(0.01)
+        await worker.stop()
+        return worker
+
+    for _ in range(5):
+        queue.add()
+    worker = asyncio.run(run())
+
+    assert worker.counts["claimed"] == worker.counts["succeeded"] == 5
+    assert peak == 2
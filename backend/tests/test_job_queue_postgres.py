@@ -0,0 +1,215 @@
+# JobQueue の SQL (claim の SKIP LOCKED・heartbeat・可視性タイムアウト後の再取得・バックオフ・最終失敗) を
+# 実際の Postgres で確認します。DATABASE_URL が未設定の場合はスキップします。
+# テストごとに一時的なスキーマを作り、"Job" のマイグレーションを適用して使います (既存のテーブルには触れません)。
+import asyncio
+import os
+import uuid
+from pathlib import Path
+
+import asyncpg
+import pytest
+
+import services.job_queue as job_queue
+from database.db import _asyncpg_dsn
+from services.job_queue import JobQueue
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+MIGRATION = Path(__file__).resolve().parents[2] / "prisma" / "migrations" / "20261017140000_add_job_queue" / "migration.sql"
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL is not set")
+
+
+@pytest.fixture
+def run_with_queue(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_RETRY_BACKOFF_SECONDS", 60.0)
+
+    def run(test):
+        async def main():
+            dsn = _asyncpg_dsn(DATABASE_URL)
+            schema = f"job_queue_test_{uuid.uuid4().hex[:8]}"
+            admin = await asyncpg.connect(dsn, statement_cache_size=0)
+            await admin.execute(f'CREATE SCHEMA "{schema}"')
+            try:
+                pool = await asyncpg.create_pool(
+                    dsn, min_size=2, max_size=6, statement_cache_size=0,
+                    server_settings={"search_path": schema}
+                )
+                try:
+                    await pool.execute(MIGRATION.read_text())
+
+                    async def get_pg_pool():
+                        return pool
+
+                    monkeypatch.setattr(job_queue, "get_pg_pool", get_pg_pool)
+                    await test(pool)
+                finally:
+                    await pool.close()
+            finally:
+                await admin.execute(f'DROP SCHEMA "{schema}" CASCADE')
+                await admin.close()
+
+        asyncio.run(main())
+
+    return run
+
+
+async def job_row(pool, job_id):
+    return await pool.fetchrow(
+        """
+        SELECT *, EXTRACT(EPOCH FROM ("runAt" - LOCALTIMESTAMP)) AS "runsIn"
+        FROM "Job" WHERE "id" = $1
+        """,
+        job_id
+    )
+
+
+async def make_due(pool, job_id):
+    # バックオフを待たずに再取得できるようにします
+    await pool.execute("""UPDATE "Job" SET "runAt" = LOCALTIMESTAMP - interval '1 second' WHERE "id" = $1""", job_id)
+
+
+def test_enqueue_and_claim(run_with_queue):
+    async def test(pool):
+        job_id = await JobQueue.enqueue("u1", "voice_process", {"save": True})
+
+        job = await JobQueue.claim("w1")
+
+        assert job["id"] == job_id
+        assert job["payload"] == {"save": True}
+        assert job["attempts"] == 1
+        row = await job_row(pool, job_id)
+        assert row["status"] == "RUNNING" and row["lockedBy"] == "w1"
+        assert await JobQueue.claim("w2") is None
+
+    run_with_queue(test)
+
+
+def test_concurrent_claims_never_share_a_job(run_with_queue):
+    async def test(pool):
+        job_ids = {await JobQueue.enqueue("u1", "import_file", {}) for _ in range(3)}
+
+        claimed = await asyncio.gather(*(JobQueue.claim(f"w{i}") for i in range(6)))
+
+        ids = [job["id"] for job in claimed if job is not None]
+        assert sorted(ids) == sorted(job_ids)
+
+    run_with_queue(test)
+
+
+def test_claim_skips_rows_locked_by_another_transaction(run_with_queue):
+    async def test(pool):
+        locked_id = await JobQueue.enqueue("u1", "import_file", {})
+        await make_due(pool, locked_id)  # 先に取得されるはずのジョブ
+        free_id = await JobQueue.enqueue("u1", "import_file", {})
+
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""SELECT 1 FROM "Job" WHERE "id" = $1 FOR UPDATE""", locked_id)
+                # ロックの解放を待たずに、次のジョブを取得します
+                job = await asyncio.wait_for(JobQueue.claim("w1"), timeout=5)
+
+        assert job["id"] == free_id
+
+    run_with_queue(test)
+
+
+def test_heartbeat_extends_only_our_lease(run_with_queue):
+    async def test(pool):
+        job_id = await JobQueue.enqueue("u1", "import_file", {})
+        await JobQueue.claim("w1")
+        await pool.execute("""UPDATE "Job" SET "lockedUntil" = LOCALTIMESTAMP + interval '1 second' WHERE "id" = $1""", job_id)
+
+        assert await JobQueue.heartbeat(job_id, "w1") is True
+        assert await JobQueue.heartbeat(job_id, "w2") is False
+
+        row = await pool.fetchrow(
+            """SELECT EXTRACT(EPOCH FROM ("lockedUntil" - LOCALTIMESTAMP)) AS remaining FROM "Job" WHERE "id" = $1""",
+            job_id
+        )
+        assert row["remaining"] > job_queue.JOB_VISIBILITY_TIMEOUT_SECONDS - 5
+
+    run_with_queue(test)
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(run_with_queue):
+    async def test(pool):
+        job_id = await JobQueue.enqueue("u1", "voice_process", {})
+        await JobQueue.claim("w1")
+        # w1 が落ちて延長が止まった状態
+        await pool.execute("""UPDATE "Job" SET "lockedUntil" = LOCALTIMESTAMP - interval '1 second' WHERE "id" = $1""", job_id)
+
+        job = await JobQueue.claim("w2")
+
+        assert job["id"] == job_id and job["attempts"] == 2
+        assert await JobQueue.heartbeat(job_id, "w1") is False
+        assert await JobQueue.complete(job_id, "w1", {"from": "w1"}) is False
+        assert await JobQueue.complete(job_id, "w2", {"from": "w2"}) is True
+        assert (await JobQueue.get_job(job_id, "u1"))["result"] == {"from": "w2"}
+
+    run_with_queue(test)
+
+
+def test_retryable_failure_requeues_with_exponential_backoff(run_with_queue):
+    async def test(pool):
+        job_id = await JobQueue.enqueue("u1", "voice_process", {})
+
+        await JobQueue.claim("w1")
+        assert await JobQueue.fail(job_id, "w1", "500: transient") == "QUEUED"
+        row = await job_row(pool, job_id)
+        assert row["lockedBy"] is None and row["error"] == "500: transient" and row["finishedAt"] is None
+        assert 55 < row["runsIn"] <= 60
+        # バックオフ中は取得されません
+        assert await JobQueue.claim("w1") is None
+
+        await make_due(pool, job_id)
+        assert (await JobQueue.claim("w1"))["attempts"] == 2
+        assert await JobQueue.fail(job_id, "w1", "500: transient") == "QUEUED"
+        assert 115 < (await job_row(pool, job_id))["runsIn"] <= 120
+
+    run_with_queue(test)
+
+
+def test_job_fails_for_good_after_max_attempts(run_with_queue):
+    async def test(pool):
+        job_id = await JobQueue.enqueue("u1", "voice_process", {}, max_attempts=2)
+
+        await JobQueue.claim("w1")
+        assert await JobQueue.fail(job_id, "w1", "boom") == "QUEUED"
+        await make_due(pool, job_id)
+        await JobQueue.claim("w1")
+        assert await JobQueue.fail(job_id, "w1", "boom") == "FAILED"
+
+        row = await job_row(pool, job_id)
+        assert row["status"] == "FAILED" and row["attempts"] == 2 and row["finishedAt"] is not None
+        await make_due(pool, job_id)
+        assert await JobQueue.claim("w1") is None
+
+    run_with_queue(test)
+
+
+def test_permanent_failure_is_not_retried(run_with_queue):
+    async def test(pool):
+        job_id = await JobQueue.enqueue("u1", "import_file", {})
+        await JobQueue.claim("w1")
+
+        assert await JobQueue.fail(job_id, "w1", "403: limit exceeded", retryable=False) == "FAILED"
+        # ロックを持たないワーカーからの記録は無視されます
+        assert await JobQueue.fail(job_id, "w2", "late") is None
+
+    run_with_queue(test)
+
+
+def test_update_payload_survives_a_retry(run_with_queue):
+    async def test(pool):
+        job_id = await JobQueue.enqueue("u1", "voice_process", {"save": True})
+        await JobQueue.claim("w1")
+
+        await JobQueue.update_payload(job_id, {"usageRecorded": True})
+        await JobQueue.fail(job_id, "w1", "transient")
+        await make_due(pool, job_id)
+        job = await JobQueue.claim("w1")
+
+        assert job["payload"] == {"save": True, "usageRecorded": True}
+        assert await JobQueue.get_job(job_id, "other-user") is None
+
+    run_with_queue(test)
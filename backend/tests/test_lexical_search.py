@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import services.vector_service as vector_service
+from services.vector_service import VectorService
+
+
+class RecordingPool:
+    def __init__(self):
+        self.queries = []
+
+    async def fetch(self, sql, *params):
+        self.queries.append((sql, params))
+        return []
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    fake = RecordingPool()
+
+    async def get_pg_pool():
+        return fake
+
+    monkeypatch.setattr(vector_service, "get_pg_pool", get_pg_pool)
+    return fake
+
+
+def search(query):
+    return asyncio.run(VectorService._search_lexical_rows(query, 20, {"userId": "u1"}))
+
+
+def test_extract_search_terms_keeps_two_character_words():
+    assert VectorService.extract_search_terms("行列の固有値とMATH101") == ["行列", "固有値", "math101"]
+
+
+def test_only_trigram_indexable_terms_filter_rows(pool):
+    search("行列の固有値")
+
+    sql, params = pool.queries[0]
+    # ILIKE で絞り込むのは pg_trgm の GIN インデックスが使える3文字以上の語句だけ
+    assert [p for p in params if isinstance(p, str) and p.startswith("%")] == ["%固有値%"]
+    assert sql.count("ILIKE") == 2  # content と fileName
+    # 2文字の語句もスコアには数えます
+    assert params[0] == ["行列", "固有値"]
+
+
+def test_query_with_only_short_terms_skips_the_lexical_scan(pool):
+    assert search("微分とは") == []
+    assert pool.queries == []
@@ -0,0 +1,61 @@
+import asyncio
+
+from services.rate_governor import RateGovernor
+
+
+async def grants_within(governor: RateGovernor, seconds: float) -> int:
+    async def take_permits():
+        while True:
+            await governor.acquire()
+
+    before = governor.granted
+    task = asyncio.create_task(take_permits())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return governor.granted - before
+
+
+def test_burst_is_capped_to_a_few_seconds_of_quota():
+    # 60000 RPM = 1000/s。バケットは 0.1 秒分 (100) までしか溜まらない
+    governor = RateGovernor("test", rpm=60000, tpm=0, burst_seconds=0.1)
+    granted = asyncio.run(grants_within(governor, 0.05))
+    assert granted <= 100 + 1000 * 0.05 * 1.5
+
+
+def test_rate_limit_drains_the_bucket_and_resumes_slowly():
+    governor = RateGovernor("test", rpm=60000, tpm=0, cooldown_seconds=0.1, burst_seconds=5)
+
+    async def scenario():
+        governor.on_rate_limited()
+        during_cooldown = await grants_within(governor, 0.08)
+        after_cooldown = await grants_within(governor, 0.12)
+        return during_cooldown, after_cooldown
+
+    during_cooldown, after_cooldown = asyncio.run(scenario())
+    assert during_cooldown == 0
+    # 停止明け (~0.1s) からの ~0.1 秒で 1000/s x 0.5 = ~50。溜まっていた 5000 が一気に流れてはいけない
+    assert 0 < after_cooldown <= 100
+
+
+def test_calls_larger_than_the_bucket_borrow_instead_of_waiting_forever():
+    governor = RateGovernor("test", rpm=0, tpm=600, burst_seconds=1)  # 10 tokens/s, capacity 10
+
+    async def scenario():
+        await asyncio.wait_for(governor.acquire(tokens=50), timeout=1)
+
+    asyncio.run(scenario())
+    assert governor.tokens.level == -40
+
+
+def test_governor_can_be_used_from_another_event_loop():
+    # 10 RPS、バケットは1回分: 2回目の acquire はロックを持ったまま待ち、3回目はロックで待たされます
+    governor = RateGovernor("test", rpm=600, tpm=0, burst_seconds=0.1)
+
+    async def contended():
+        await asyncio.gather(*(governor.acquire() for _ in range(3)))
+
+    asyncio.run(contended())
+    # 別のループ (ワーカー・CLI の asyncio.run) から使っても、前のループに結び付いたロックを使いません
+    asyncio.run(contended())
+    assert governor.granted == 6
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import services.title_index as title_index_module
+from services.title_index import TitleIndex
+
+
+class FakePool:
+    def __init__(self):
+        self.titles = {}
+        self.release = None
+
+    async def fetch(self, query, user_id):
+        if self.release is not None:
+            await self.release.wait()
+        return [{"id": doc_id, "title": title} for doc_id, title in self.titles.get(user_id, [])]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    fake = FakePool()
+
+    async def get_pg_pool():
+        return fake
+
+    monkeypatch.setattr(title_index_module, "get_pg_pool", get_pg_pool)
+    return fake
+
+
+def test_matches_titles_in_the_query(pool):
+    pool.titles["u1"] = [("d1", "線形代数_第3回.pdf"), ("d2", "x")]
+    index = TitleIndex()
+
+    hits = asyncio.run(index.match("u1", "線形代数 第3回の要点は？"))
+
+    assert hits == [{"id": "d1", "title": "線形代数_第3回.pdf"}]
+
+
+def test_invalidate_during_load_does_not_cache_stale_titles(pool):
+    pool.titles["u1"] = [("d1", "古いタイトル")]
+    index = TitleIndex()
+
+    async def run():
+        pool.release = asyncio.Event()
+        load = asyncio.create_task(index.match("u1", "古いタイトル"))
+        await asyncio.sleep(0)
+        index.invalidate("u1")
+        pool.release.set()
+        await load
+        pool.release = None
+
+    asyncio.run(run())
+
+    assert index.stats()["users"] == 0
+    assert index._generations == {} and index._loading == {}
+
+
+def test_generation_bookkeeping_does_not_grow_with_users(pool):
+    index = TitleIndex(max_users=10)
+
+    async def run():
+        for i in range(500):
+            await index.match(f"user-{i}", "質問")
+            index.invalidate(f"user-{i}")
+            index.invalidate(f"other-{i}")
+
+    asyncio.run(run())
+
+    # 読み込み中のユーザーがいなければ世代番号は1つも残りません
+    assert index._generations == {} and index._loading == {}
+    assert index.stats()["users"] == 0
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import services.vector_service as vector_service
+from services.vector_service import VectorService
+
+
+class FakeConn:
+    def __init__(self, version="0.8.0"):
+        self.version = version
+        self.settings = {}
+        self.version_queries = 0
+
+    async def fetchval(self, sql, *args):
+        self.version_queries += 1
+        return self.version
+
+    async def execute(self, sql, name_value=None):
+        name = sql.split("'")[1]
+        self.settings[name] = name_value
+
+
+@pytest.fixture(autouse=True)
+def reset_support_cache(monkeypatch):
+    monkeypatch.setattr(vector_service, "_iterative_scan_supported", None)
+
+
+def apply(conn, ef_search=100, filtered=True):
+    asyncio.run(VectorService._apply_search_settings(conn, ef_search, None, filtered=filtered))
+
+
+def test_iterative_scan_is_on_by_default():
+    assert vector_service.VECTOR_ITERATIVE_SCAN == "relaxed_order"
+    conn = FakeConn("0.8.0")
+    apply(conn)
+    assert conn.settings == {"hnsw.ef_search": "100", "hnsw.iterative_scan": "relaxed_order"}
+
+
+def test_extension_version_is_checked_once():
+    conn = FakeConn("0.8.1")
+    apply(conn)
+    apply(conn)
+    assert conn.version_queries == 1
+
+
+def test_old_pgvector_falls_back_to_larger_ef_search_for_filtered_queries():
+    conn = FakeConn("0.7.4")
+    apply(conn)
+    assert conn.settings == {"hnsw.ef_search": str(vector_service.VECTOR_FILTERED_EF_SEARCH)}
+
+    unfiltered = FakeConn("0.7.4")
+    apply(unfiltered, filtered=False)
+    assert unfiltered.settings == {"hnsw.ef_search": "100"}
+
+
+def test_iterative_scan_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(vector_service, "VECTOR_ITERATIVE_SCAN", "off")
+    conn = FakeConn("0.8.0")
+    apply(conn)
+    assert conn.version_queries == 0
+    assert conn.settings == {"hnsw.ef_search": str(vector_service.VECTOR_FILTERED_EF_SEARCH)}
@@ -0,0 +1,146 @@
+import asyncio
+import types
+
+import pytest
+
+import services.voice_service as voice_service
+from services.voice_service import VoiceService
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class FlakyGateway:
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    async def upload_file(self, path, mime_type=None):
+        return path
+
+    async def generate(self, contents, op=None, tokens=None):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return types.SimpleNamespace(text="[TRANSCRIPT] hello")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+
+    async def fake_sleep(seconds):
+        recorded.append(seconds)
+
+    monkeypatch.setattr(voice_service.asyncio, "sleep", fake_sleep)
+    return recorded
+
+
+def test_rate_limited_segment_backs_off_exponentially(monkeypatch, sleeps):
+    gateway = FlakyGateway([ResourceExhausted("429 Resource exhausted")] * 4)
+    monkeypatch.setattr(voice_service, "llm_gateway", gateway)
+
+    text = asyncio.run(VoiceService._transcribe_segment(0, "seg0.mp3", "audio/mpeg", 600))
+
+    assert text == "hello"
+    assert gateway.calls == 5
+    # 30s, 60s, 120s, 120s (上限) の半分〜全量
+    for delay, cap in zip(sleeps, [30, 60, 120, 120]):
+        assert cap / 2 <= delay <= cap
+    assert sum(sleeps) >= 165
+
+
+def test_backoff_is_jittered():
+    delays = {round(VoiceService.rate_limit_backoff(2), 3) for _ in range(20)}
+    assert len(delays) > 1
+    assert all(30 <= d <= 60 for d in delays)
+
+
+def test_other_errors_keep_the_short_backoff(monkeypatch, sleeps):
+    gateway = FlakyGateway([RuntimeError("500 internal")] * 2)
+    monkeypatch.setattr(voice_service, "llm_gateway", gateway)
+
+    asyncio.run(VoiceService._transcribe_segment(0, "seg0.mp3", "audio/mpeg", 600))
+
+    assert sleeps == [2, 4]
+
+
+def test_last_attempt_raises(monkeypatch, sleeps):
+    failures = [ResourceExhausted("429")] * voice_service.VOICE_SEGMENT_MAX_ATTEMPTS
+    monkeypatch.setattr(voice_service, "llm_gateway", FlakyGateway(failures))
+
+    with pytest.raises(ResourceExhausted):
+        asyncio.run(VoiceService._transcribe_segment(0, "seg0.mp3", "audio/mpeg", 600))
+    assert len(sleeps) == voice_service.VOICE_SEGMENT_MAX_ATTEMPTS - 1
+
+
+def test_segmentation_defaults_to_fixed():
+    # 無音での分割は VOICE_SEGMENTATION=silence を指定した場合のみ
+    assert voice_service.VOICE_SEGMENTATION == "fixed"
+
+
+class SegmentGateway:
+    # 指定したセグメントだけ失敗させ、送信されたセグメントを記録します
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def upload_file(self, path, mime_type=None):
+        return path
+
+    async def generate(self, contents, op=None, tokens=None):
+        path = contents[1]
+        self.sent.append(path)
+        if path in self.failing:
+            raise RuntimeError("500 internal")
+        return types.SimpleNamespace(text=f"[TRANSCRIPT] text of {path}")
+
+
+class CheckpointPool:
+    def __init__(self):
+        self.rows = {}
+
+    async def fetch(self, query, upload_hash, layout):
+        return [
+            {"segmentIndex": index, "transcript": transcript}
+            for (h, l, index), transcript in self.rows.items() if (h, l) == (upload_hash, layout)
+        ]
+
+    async def execute(self, query, upload_hash, layout, index, transcript):
+        self.rows[(upload_hash, layout, index)] = transcript
+
+
+def test_failed_segment_fails_the_run_and_only_it_is_sent_again(monkeypatch, sleeps):
+    import services.transcript_checkpoint as checkpoint_module
+    from fastapi import HTTPException
+
+    pool = CheckpointPool()
+
+    async def get_pg_pool():
+        return pool
+
+    monkeypatch.setattr(checkpoint_module, "get_pg_pool", get_pg_pool)
+    monkeypatch.setattr(voice_service, "transcript_checkpoints", checkpoint_module.TranscriptCheckpoints(enabled=True))
+    paths = [f"seg{i}.mp3" for i in range(4)]
+
+    def transcribe():
+        return asyncio.run(VoiceService.transcribe_segments(
+            paths, "audio/mpeg", 600, upload_hash="h1", layout="fixed:600:t0"
+        ))
+
+    gateway = SegmentGateway(failing={"seg2.mp3"})
+    monkeypatch.setattr(voice_service, "llm_gateway", gateway)
+    with pytest.raises(HTTPException) as excinfo:
+        transcribe()
+    assert excinfo.value.status_code == 500
+    # 失敗したセグメント以外は保存済み。プレースホルダーの文字起こしは返しません
+    assert sorted(index for _, _, index in pool.rows) == [0, 1, 3]
+
+    # リトライ (ジョブの再実行) では失敗したセグメントだけ送信されます
+    gateway = SegmentGateway(failing=set())
+    monkeypatch.setattr(voice_service, "llm_gateway", gateway)
+    transcripts = transcribe()
+
+    assert gateway.sent == ["seg2.mp3"]
+    assert transcripts == [f"text of {path}" for path in paths]
@@ -0,0 +1,59 @@
+import asyncio
+
+import services.chat_service as chat_service
+from services.chat_service import RetrievalResult, StageTimer, WebSearchGate
+
+CONFIDENT = RetrievalResult("講義ノートの内容", [{"vectorScore": 0.9}])
+WEAK = RetrievalResult("講義ノートの内容", [{"vectorScore": 0.3}])
+
+
+def test_speculative_search_is_off_by_default():
+    assert chat_service.WEB_SEARCH_SPECULATIVE is False
+
+
+def test_skip_rate_counts_only_avoided_searches():
+    gate = WebSearchGate(enabled=True, skip_score=0.8, min_hits=1)
+
+    assert gate.skip_reason("固有値とは", CONFIDENT) == "high_confidence"
+    # 投機的な検索が送信済みなら、省略しても Tavily の呼び出しは減りません
+    assert gate.skip_reason("固有値とは", CONFIDENT, search_started=True) == "high_confidence"
+    assert gate.skip_reason("固有値とは", WEAK) is None
+    assert gate.skip_reason("固有値とは", WEAK) is None
+
+    stats = gate.stats()
+    assert stats["high_confidence"] == 2 and stats["searched"] == 2
+    assert stats["avoided"] == 1
+    assert stats["skipRate"] == 0.25
+
+
+def run_web_search(chat_backend, monkeypatch, retrieval):
+    calls = []
+
+    async def search_async(self, query, plan):
+        calls.append(query)
+        return "web results"
+
+    monkeypatch.setattr(chat_service.SearchService, "search_async", search_async)
+    monkeypatch.setattr(chat_service, "web_search_gate", WebSearchGate(enabled=True, skip_score=0.8, min_hits=1))
+
+    async def run():
+        context_task = asyncio.get_running_loop().create_future()
+        context_task.set_result(retrieval)
+        return await chat_backend.service._web_search("固有値とは", "user-1", context_task, StageTimer())
+
+    return asyncio.run(run()), calls
+
+
+def test_confident_retrieval_does_not_call_tavily(chat_backend, monkeypatch):
+    result, calls = run_web_search(chat_backend, monkeypatch, CONFIDENT)
+
+    assert result == chat_service.WEB_SEARCH_SKIPPED_MESSAGE
+    assert calls == []
+    assert chat_service.web_search_gate.stats()["skipRate"] == 1.0
+
+
+def test_weak_retrieval_searches_the_web(chat_backend, monkeypatch):
+    result, calls = run_web_search(chat_backend, monkeypatch, WEAK)
+
+    assert result == "web results"
+    assert calls == ["固有値とは"]
@@ -0,0 +1,131 @@
+# テキストのチャンク分割エンジン
+# LangChain の RecursiveCharacterTextSplitter と同じ境界でチャンクを作りますが、
+# 1度だけ構築して使い回し、チャンクをジェネレータで逐次返します (長時間の文字起こしでもリストを溜め込まない)。
+import re
+from collections import deque
+from typing import Callable, Deque, Iterator, List, Optional, Pattern, Sequence, Tuple
+
+# 日本語と英語向けの区切り文字 (段落 → 行 → 文 (。) → 読点 (、) → 単語 → 文字)
+DEFAULT_SEPARATORS = ["\n\n", "\n", "。", "、", " ", ""]
+
+
+class TextChunker:
+    """
+    Recursive, separator-aware text chunker.
+
+    Produces the same chunks as
+    RecursiveCharacterTextSplitter(chunk_size, chunk_overlap, separators)
+    with keep_separator=True and strip_whitespace=True, so data indexed with
+    the old splitter keeps its boundaries (and content hashes).
+
+    size_unit="chars" measures with len(); size_unit="tokens" measures with a
+    tiktoken encoding instead.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 500,
+        chunk_overlap: int = 50,
+        separators: Optional[Sequence[str]] = None,
+        size_unit: str = "chars",
+        encoding_name: str = "cl100k_base"
+    ):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must not exceed chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators or DEFAULT_SEPARATORS)
+        # 区切り文字の正規表現は構築時に1度だけコンパイルします ("" は1文字ずつ分割)
+        self._patterns: List[Optional[Pattern]] = [
+            re.compile(re.escape(sep)) if sep else None for sep in self.separators
+        ]
+        self._length = self._make_length_function(size_unit, encoding_name)
+
+    @staticmethod
+    def _make_length_function(size_unit: str, encoding_name: str) -> Callable[[str], int]:
+        if size_unit == "chars":
+            return len
+        if size_unit == "tokens":
+            import tiktoken
+            encoding = tiktoken.get_encoding(encoding_name)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        raise ValueError(f"Unknown size_unit: {size_unit}")
+
+    def iter_chunks(self, text: str) -> Iterator[str]:
+        """Yield chunks of `text` one at a time."""
+        if not text:
+            return
+        yield from self._split(text, 0)
+
+    def split(self, text: str) -> List[str]:
+        return list(self.iter_chunks(text))
+
+    def _split(self, text: str, level: int) -> Iterator[str]:
+        # このテキストに含まれる最初の区切り文字を選びます ("" は常に該当)
+        index = len(self.separators) - 1
+        for i in range(level, len(self.separators)):
+            sep = self.separators[i]
+            if sep == "" or sep in text:
+                index = i
+                break
+        has_finer = self.separators[index] != "" and index + 1 < len(self.separators)
+
+        merger = _SplitMerger(self.chunk_size, self.chunk_overlap)
+        for piece in self._iter_pieces(text, self._patterns[index]):
+            piece_len = self._length(piece)
+            if piece_len < self.chunk_size:
+                yield from merger.add(piece, piece_len)
+                continue
+            # 大きすぎる断片: それまでの断片を確定させ、より細かい区切りで再分割します
+            yield from merger.flush()
+            if has_finer:
+                yield from self._split(piece, index + 1)
+            else:
+                yield piece
+        yield from merger.flush()
+
+    @staticmethod
+    def _iter_pieces(text: str, pattern: Optional[Pattern]) -> Iterator[str]:
+        # 区切り文字を次の断片の先頭に付けたまま分割します (keep_separator="start" と同じ)
+        if pattern is None:
+            yield from text
+            return
+        last = 0
+        for match in pattern.finditer(text):
+            if match.start() > last:
+                yield text[last:match.start()]
+            last = match.start()
+        if last < len(text):
+            yield text[last:]
+
+
+class _SplitMerger:
+    # 小さな断片を chunk_size 以下にまとめ、chunk_overlap 分を次のチャンクに持ち越します
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.current: Deque[Tuple[str, int]] = deque()
+        self.total = 0
+
+    def add(self, piece: str, piece_len: int) -> Iterator[str]:
+        if self.current and self.total + piece_len > self.chunk_size:
+            chunk = self._join()
+            if chunk:
+                yield chunk
+            while self.total > self.chunk_overlap or (
+                self.total + piece_len > self.chunk_size and self.total > 0
+            ):
+                _, dropped_len = self.current.popleft()
+                self.total -= dropped_len
+        self.current.append((piece, piece_len))
+        self.total += piece_len
+
+    def flush(self) -> Iterator[str]:
+        chunk = self._join()
+        self.current.clear()
+        self.total = 0
+        if chunk:
+            yield chunk
+
+    def _join(self) -> str:
+        return "".join(piece for piece, _ in self.current).strip()
@@ -0,0 +1,240 @@
+# multipart/form-data のアップロードを、メモリに溜め込まずチャンク単位でディスクに書き出すユーティリティ
+# サイズ上限は受信しながらチェックし、超えた時点で読み込みを中止します (413)。
+# 書き出しと同時に SHA-256 と先頭バイトからの MIME 判定も行います。
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# リクエストボディを読み込む単位 (バイト)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# MIME 判定に使う先頭バイト数 (libmagic が通常読み込む範囲と同じ 1MB)
+_SNIFF_BYTES = 1024 * 1024
+# ファイル以外のフォーム項目 (metadata など) 1つあたりの上限
+_MAX_FIELD_BYTES = 64 * 1024
+# Content-Length で事前チェックするときの、ファイル以外の部分 (境界・ヘッダー・metadata) の余裕分
+_FORM_OVERHEAD_BYTES = _MAX_FIELD_BYTES * 4
+
+_SAFE_SUFFIX = re.compile(r"^\.[A-Za-z0-9]{1,10}$")
+
+
+def detect_mime_type(content: bytes) -> str:
+    """
+    python-magicを使用してファイルのMIMEタイプを検出します。
+    Security: クライアントからのMIMEタイプを信頼せず、マジックバイトから判定します。
+    """
+    try:
+        import magic
+        mime = magic.Magic(mime=True)
+        return mime.from_buffer(content)
+    except ImportError:
+        logger.warning("python-magic not installed, falling back to default behavior (returning empty string or handle upstream)")
+        return ""
+    except Exception as e:
+        logger.error(f"Error detecting mime type: {e}")
+        return ""
+
+
+class SpooledUpload:
+    """
+    An uploaded file that was written to a temp file while the request body
+    streamed in. `filename` and `content_type` mirror UploadFile.
+    The caller owns the file and must call cleanup().
+    """
+
+    def __init__(self, path: str, filename: str, content_type: Optional[str]):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.sha256 = ""
+        self.sniffed_mime = ""
+
+    def read_bytes(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def cleanup(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _MultipartSpooler:
+    # MultipartParser のコールバックで受け取ったデータを、ファイルとフォーム項目に振り分けます
+    def __init__(self, file_field: str, max_file_bytes: int):
+        self.file_field = file_field
+        self.max_file_bytes = max_file_bytes
+        self.fields: Dict[str, str] = {}
+        self.upload: Optional[SpooledUpload] = None
+        self.error: Optional[HTTPException] = None
+        self._file = None
+        self._hash = hashlib.sha256()
+        self._head = bytearray()
+        self._pending: List[bytes] = []
+        self._headers: Dict[str, bytes] = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._part_name: Optional[str] = None
+        self._part_is_file = False
+        self._field_value = bytearray()
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._part_name = None
+        self._part_is_file = False
+        self._field_value = bytearray()
+
+    def _on_header_end(self):
+        self._headers[bytes(self._header_field).lower().decode("latin-1")] = bytes(self._header_value)
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get("content-disposition", b""))
+        self._part_name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        if self._part_name == self.file_field and filename is not None and self.upload is None:
+            self._part_is_file = True
+            name = os.path.basename(filename.decode("utf-8", errors="replace"))
+            suffix = os.path.splitext(name)[1].lower()
+            fd, path = tempfile.mkstemp(suffix=suffix if _SAFE_SUFFIX.match(suffix) else "")
+            self._file = os.fdopen(fd, "wb")
+            content_type = self._headers.get("content-type")
+            self.upload = SpooledUpload(path, name, content_type.decode("latin-1") if content_type else None)
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self.error is not None:
+            return
+        chunk = data[start:end]
+        if self._part_is_file:
+            self.upload.size += len(chunk)
+            if self.upload.size > self.max_file_bytes:
+                self.error = HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Limit: {self.max_file_bytes // (1024 * 1024)} MB."
+                )
+                return
+            self._hash.update(chunk)
+            if len(self._head) < _SNIFF_BYTES:
+                self._head.extend(chunk[:_SNIFF_BYTES - len(self._head)])
+            self._pending.append(chunk)
+        else:
+            self._field_value.extend(chunk)
+            if len(self._field_value) > _MAX_FIELD_BYTES:
+                self.error = HTTPException(status_code=413, detail=f"Form field '{self._part_name}' too large.")
+
+    def _on_part_end(self):
+        if not self._part_is_file and self._part_name:
+            self.fields[self._part_name] = self._field_value.decode("utf-8", errors="replace")
+
+    async def flush(self):
+        # ディスクへの書き込みはイベントループを止めないようスレッドで行います
+        if self._pending and self._file is not None:
+            data = b"".join(self._pending)
+            self._pending = []
+            await run_in_threadpool(self._file.write, data)
+
+    async def finish(self):
+        await self.flush()
+        if self._file is not None:
+            await run_in_threadpool(self._file.close)
+            self._file = None
+        if self.upload is not None:
+            self.upload.sha256 = self._hash.hexdigest()
+            self.upload.sniffed_mime = detect_mime_type(bytes(self._head)) if self._head else ""
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.upload is not None:
+            self.upload.cleanup()
+
+
+async def receive_multipart_upload(
+    request: Request,
+    max_file_bytes: int,
+    file_field: str = "file",
+    required_fields: Tuple[str, ...] = ()
+) -> Tuple[SpooledUpload, Dict[str, str]]:
+    """
+    Stream a multipart/form-data request body to disk.
+    The part named `file_field` is written to a temp file in chunks of
+    UPLOAD_CHUNK_SIZE. The other parts are returned as text fields.
+    Raises 413 as soon as the file exceeds max_file_bytes (or up front, when
+    Content-Length already does), 400 for a malformed body and 422 when a
+    required form field is missing (as Form(...) would).
+    Returns (upload, fields).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_file_bytes + _FORM_OVERHEAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Limit: {max_file_bytes // (1024 * 1024)} MB."
+        )
+
+    spooler = _MultipartSpooler(file_field, max_file_bytes)
+    parser = MultipartParser(boundary, spooler.callbacks())
+    try:
+        buffer = bytearray()
+        async for data in request.stream():
+            buffer.extend(data)
+            if len(buffer) < UPLOAD_CHUNK_SIZE:
+                continue
+            parser.write(bytes(buffer))
+            buffer.clear()
+            if spooler.error is not None:
+                raise spooler.error
+            await spooler.flush()
+        if buffer:
+            parser.write(bytes(buffer))
+        parser.finalize()
+        if spooler.error is not None:
+            raise spooler.error
+        await spooler.finish()
+    except HTTPException:
+        spooler.abort()
+        raise
+    except Exception as e:
+        spooler.abort()
+        logger.error(f"Error receiving upload: {e}")
+        raise HTTPException(status_code=400, detail="Malformed multipart body")
+
+    missing = [name for name in required_fields if name not in spooler.fields]
+    if spooler.upload is None or missing:
+        if spooler.upload is not None:
+            spooler.upload.cleanup()
+        raise HTTPException(status_code=422, detail=f"Missing form field(s): {', '.join(missing or [file_field])}")
+    logger.info(
+        f"Spooled upload {spooler.upload.filename}: {spooler.upload.size} bytes, "
+        f"sha256={spooler.upload.sha256[:12]}..., mime={spooler.upload.sniffed_mime or 'unknown'}"
+    )
+    return spooler.upload, spooler.fields
@@ -0,0 +1,41 @@
+# ジョブワーカーを API サーバーとは別プロセスで起動するエントリーポイント
+# 使い方: cd backend && python worker.py  (API 側は JOB_WORKER_IN_PROCESS=false)
+# アップロードは JOB_SPOOL_DIR に保存されるため、API と同じディスク (またはマウントしたボリューム) を共有してください。
+import asyncio
+import logging
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+from database.db import connect_db, disconnect_db
+from services.job_queue import job_worker
+
+
+async def main():
+    await connect_db()
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    job_worker.start()
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping job worker...")
+        await job_worker.stop()
+        await disconnect_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
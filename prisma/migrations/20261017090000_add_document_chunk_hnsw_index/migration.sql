@@ -0,0 +1,5 @@
+-- CreateIndex
+-- HNSW index for cosine distance (embedding <=> query) used by VectorService.search_vectors.
+-- Prisma cannot express this index on an Unsupported("vector") column, so it is managed here.
+-- Rebuild with: python -m services.vector_service reindex
+CREATE INDEX IF NOT EXISTS "DocumentChunk_embedding_hnsw_idx" ON "DocumentChunk" USING hnsw ("embedding" vector_cosine_ops) WITH (m = 16, ef_construction = 64);
@@ -0,0 +1,9 @@
+-- Enable pg_trgm extension (lexical search for Japanese text without word splitting)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- CreateIndex
+-- Trigram GIN indexes used by the lexical arm of VectorService.search_vectors(mode="hybrid").
+CREATE INDEX IF NOT EXISTS "DocumentChunk_content_trgm_idx" ON "DocumentChunk" USING gin ("content" gin_trgm_ops);
+
+-- CreateIndex
+CREATE INDEX IF NOT EXISTS "DocumentChunk_fileName_trgm_idx" ON "DocumentChunk" USING gin ("fileName" gin_trgm_ops);
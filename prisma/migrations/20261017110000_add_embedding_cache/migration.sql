@@ -0,0 +1,12 @@
+-- CreateTable
+CREATE TABLE "EmbeddingCache" (
+    "key" TEXT NOT NULL,
+    "model" TEXT NOT NULL,
+    "embedding" vector(768) NOT NULL,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "EmbeddingCache_pkey" PRIMARY KEY ("key")
+);
+
+-- CreateIndex
+CREATE INDEX "EmbeddingCache_createdAt_idx" ON "EmbeddingCache"("createdAt");
@@ -0,0 +1,5 @@
+-- AlterTable
+ALTER TABLE "DocumentChunk" ADD COLUMN "contentHash" TEXT;
+
+-- Backfill (same value as VectorService.content_hash: hex sha256 of the UTF-8 content)
+UPDATE "DocumentChunk" SET "contentHash" = encode(sha256(convert_to("content", 'UTF8')), 'hex') WHERE "contentHash" IS NULL;
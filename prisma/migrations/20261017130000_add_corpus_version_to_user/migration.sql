@@ -0,0 +1,3 @@
+-- AlterTable
+-- Bumped by the backend whenever the user's searchable documents change (answer cache key)
+ALTER TABLE "User" ADD COLUMN "corpusVersion" INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,13 @@
+-- CreateTable
+CREATE TABLE "TranscriptSegment" (
+    "uploadHash" TEXT NOT NULL,
+    "layout" TEXT NOT NULL,
+    "segmentIndex" INTEGER NOT NULL,
+    "transcript" TEXT NOT NULL,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "TranscriptSegment_pkey" PRIMARY KEY ("uploadHash", "layout", "segmentIndex")
+);
+
+-- CreateIndex
+CREATE INDEX "TranscriptSegment_createdAt_idx" ON "TranscriptSegment"("createdAt");